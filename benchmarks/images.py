@@ -0,0 +1,200 @@
+"""
+Build a matrix of configurations of a project (pip cache, base image, extras) and
+measure cold and warm build time, image and layer sizes and the time from
+starting a container until it answers http requests.
+
+    python benchmarks/images.py --project example --output results-0.3.0.json
+    python benchmarks/images.py --project example --baseline results-0.2.0.json
+
+Cold builds start with an empty build cache, i.e., the build cache of docker
+gets pruned (run on a dedicated machine), warm builds rebuild unchanged inputs.
+Base images are pulled before, their download is not part of the build time.
+"""
+
+import argparse
+import datetime
+import itertools
+import json
+import re
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from typing import Dict, List, Optional, Tuple
+
+from setuptools_docker.report import BuildReport
+
+BASE_IMAGES = ["python:3.8-slim-bullseye", "python:3.8-bullseye"]
+
+# relative change of a metric reported as regression against the baseline
+REGRESSION_THRESHOLD = 0.1
+
+
+def configurations(base_images: List[str], extras: List[str]) -> Dict[str, List[str]]:
+    """bdist_docker args of all combinations of pip cache, base image and extras."""
+    matrix = {}
+    for pip_cache, base_image, extra in itertools.product(
+        [True, False], base_images, extras
+    ):
+        name = "-".join(
+            [
+                "pip-cache" if pip_cache else "no-pip-cache",
+                re.sub(r"[^\w.]+", "_", base_image),
+                re.sub(r"\W+", "_", extra) or "no-extras",
+            ]
+        )
+        matrix[name] = [
+            f"--pip-cache-docker={int(pip_cache)}",
+            f"--base-image={base_image}",
+            f"--extra-requires={extra}",
+        ]
+    return matrix
+
+
+def build(project_dir: str, image: str, args: List[str]) -> float:
+    """Seconds for building ``image``, without the build cache of bdist_docker."""
+    name, tag = image.split(":")
+    start = time.monotonic()
+    subprocess.run(
+        [sys.executable, "-m", "setup", "bdist_docker", "--no-build-cache"]
+        + ["--image-name", name, "--image-tag", tag]
+        + args,
+        cwd=project_dir,
+        check=True,
+    )
+    return time.monotonic() - start
+
+
+def measure_ready(image: str, port: int, path: str, timeout: float = 60) -> float:
+    """Seconds from starting a container of ``image`` until ``path`` answers."""
+    start = time.monotonic()
+    container = subprocess.run(
+        ["docker", "run", "-d", "--rm", "-p", f"127.0.0.1::{port}", image],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout.strip()
+    try:
+        host_port = subprocess.run(
+            ["docker", "port", container, str(port)],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.split(":")[-1]
+        url = f"http://127.0.0.1:{host_port.strip()}{path}"
+        while time.monotonic() - start < timeout:
+            try:
+                with urllib.request.urlopen(url, timeout=1):
+                    return time.monotonic() - start
+            except (urllib.error.URLError, ConnectionError):
+                time.sleep(0.02)
+        raise Exception(f"{image} not ready after {timeout}s")
+    finally:
+        subprocess.run(["docker", "rm", "-f", container], capture_output=True)
+
+
+def benchmark(
+    project_dir: str, image: str, args: List[str], port: int, path: str, runs: int
+) -> Dict:
+    base_image = next(a.split("=", 1)[1] for a in args if a.startswith("--base-image"))
+    subprocess.run(["docker", "pull", "-q", base_image], check=True)
+    subprocess.run(
+        ["docker", "builder", "prune", "-af"], capture_output=True, check=True
+    )
+    cold_s = build(project_dir, image, args)
+    warm_s = statistics.median(build(project_dir, image, args) for _ in range(runs))
+
+    report = BuildReport()
+    report.inspect_image(image)
+    return {
+        "cold_build_s": cold_s,
+        "warm_build_s": warm_s,
+        "image_bytes": report.image["size"],
+        "layers": len(report.image["layers"]),
+        "layer_bytes": [layer["size"] for layer in report.image["layers"]],
+        "ready_s": statistics.median(
+            measure_ready(image, port, path) for _ in range(runs)
+        ),
+    }
+
+
+def compare(results: Dict, baseline: Dict) -> List[Tuple[str, str, float, float]]:
+    """Metrics which got worse by more than ``REGRESSION_THRESHOLD``."""
+    regressions = []
+    for name, metrics in results.items():
+        for metric, value in metrics.items():
+            old = baseline.get(name, {}).get(metric)
+            if isinstance(value, (int, float)) and old:
+                if (value - old) / old > REGRESSION_THRESHOLD:
+                    regressions.append((name, metric, old, value))
+    return regressions
+
+
+def main(args: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--project", required=True, help="project dir with setup.py")
+    parser.add_argument("--image", default="bench-images")
+    parser.add_argument("--base-image", action="append", default=[])
+    parser.add_argument(
+        "--extras",
+        action="append",
+        default=[],
+        help="extra_requires to build with, space separated, '' for none",
+    )
+    parser.add_argument("--port", type=int, default=8000, help="port of the app")
+    parser.add_argument("--path", default="/", help="path answering when ready")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--output", help="write results as json to this file")
+    parser.add_argument("--baseline", help="results json to compare with")
+    parsed = parser.parse_args(args)
+
+    matrix = configurations(
+        parsed.base_image or BASE_IMAGES, parsed.extras or ["gunicorn"]
+    )
+    results = {}
+    for i, (name, build_args) in enumerate(matrix.items()):
+        image = f"{parsed.image}:{i}"
+        results[name] = benchmark(
+            parsed.project, image, build_args, parsed.port, parsed.path, parsed.runs
+        )
+        r = results[name]
+        print(
+            f"{name}: build cold {r['cold_build_s']:6.1f} s, "
+            f"warm {r['warm_build_s']:6.1f} s, image {r['image_bytes'] / 1e6:7.1f} MB "
+            f"in {r['layers']} layers, ready {r['ready_s'] * 1000:7.0f} ms"
+        )
+
+    if parsed.output:
+        with open(parsed.output, "w") as f:
+            json.dump(
+                {
+                    "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                    "docker": _docker_version(),
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
+
+    if parsed.baseline:
+        with open(parsed.baseline) as f:
+            regressions = compare(results, json.load(f)["results"])
+        for name, metric, old, new in regressions:
+            print(f"regression: {name} {metric} {old:.3f} -> {new:.3f}")
+        if regressions:
+            sys.exit(1)
+
+
+def _docker_version() -> Optional[str]:
+    res = subprocess.run(
+        ["docker", "version", "--format", "{{.Server.Version}}"],
+        capture_output=True,
+        text=True,
+    )
+    return res.stdout.strip() if res.returncode == 0 else None
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""
+Compare the installers of the builder stage (bdist_docker --installer) installing a
+large requirements set from a local index, with cold and warm cache.
+
+    pip install uv
+    python benchmarks/installers.py --requirements requirements.txt
+
+The wheels of the requirements get downloaded once to --wheel-dir and are served
+by a local simple index (PEP 503), so that the network does not dominate.
+"""
+
+import argparse
+import http.server
+import json
+import os
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List
+
+from setuptools_docker.docker import INSTALLERS
+
+# pure python and binary wheels with deep dependency trees
+DEFAULT_REQUIREMENTS = [
+    "boto3",
+    "django",
+    "flask",
+    "matplotlib",
+    "numpy",
+    "pandas",
+    "pydantic",
+    "requests",
+    "scikit-learn",
+    "scipy",
+    "sqlalchemy",
+]
+
+
+class SimpleIndexHandler(http.server.BaseHTTPRequestHandler):
+    """Serves the wheels of a directory as simple index under /simple/."""
+
+    def do_GET(self):
+        self._serve(body=True)
+
+    def do_HEAD(self):
+        self._serve(body=False)
+
+    def _serve(self, body: bool) -> None:
+        wheel_dir = self.server.wheel_dir
+        m = re.fullmatch(r"/simple/([^/]+)/", self.path)
+        path = os.path.join(wheel_dir, os.path.basename(self.path))
+        if m:
+            project = _normalize(m.group(1))
+            links = [
+                f'<a href="/files/{name}">{name}</a>'
+                for name in sorted(os.listdir(wheel_dir))
+                if _normalize(name.split("-")[0]) == project
+            ]
+            content = ("<html><body>" + "".join(links) + "</body></html>").encode()
+            self._respond(200, len(content), "text/html")
+            if body:
+                self.wfile.write(content)
+        elif self.path.startswith("/files/") and os.path.exists(path):
+            self._respond(200, os.path.getsize(path), "application/octet-stream")
+            if body:
+                with open(path, "rb") as f:
+                    shutil.copyfileobj(f, self.wfile)
+        else:
+            self._respond(404, 0, "text/html")
+
+    def _respond(self, status: int, length: int, content_type: str) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(length))
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def serve_index(wheel_dir: str) -> http.server.ThreadingHTTPServer:
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), SimpleIndexHandler)
+    server.wheel_dir = wheel_dir
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def download_wheels(requirements: List[str], wheel_dir: str) -> None:
+    subprocess.run(
+        [sys.executable, "-m", "pip", "download", "--only-binary", ":all:", "-d"]
+        + [wheel_dir]
+        + requirements,
+        check=True,
+    )
+
+
+def measure_install(
+    installer: str, requirements: List[str], index_url: str, cache_dir: str
+) -> float:
+    """Seconds for installing ``requirements`` into a fresh venv."""
+    with tempfile.TemporaryDirectory() as venv:
+        subprocess.run([sys.executable, "-m", "venv", venv], check=True)
+        config = INSTALLERS[installer]
+        # same command and environment as in the builder stage
+        command = config["command"].split()
+        env = dict(os.environ, **dict(config["env"]))
+        if installer == "pip":
+            command[0] = os.path.join(venv, "bin", "pip")
+            env["PIP_CACHE_DIR"] = cache_dir
+        else:
+            env["VIRTUAL_ENV"] = venv
+            env["UV_CACHE_DIR"] = cache_dir
+
+        start = time.monotonic()
+        subprocess.run(
+            command + ["-q", "-i", index_url] + requirements,
+            env=env,
+            check=True,
+        )
+        return time.monotonic() - start
+
+
+def main(args: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requirements", help="requirements file to install")
+    parser.add_argument("--wheel-dir", default="build/benchmark-wheels")
+    parser.add_argument(
+        "--installer", action="append", choices=list(INSTALLERS), default=[]
+    )
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--output", help="write results as json to this file")
+    parsed = parser.parse_args(args)
+
+    if parsed.requirements:
+        with open(parsed.requirements) as f:
+            requirements = [
+                line.strip() for line in f if line.strip() and line[0] != "#"
+            ]
+    else:
+        requirements = DEFAULT_REQUIREMENTS
+
+    os.makedirs(parsed.wheel_dir, exist_ok=True)
+    download_wheels(requirements, parsed.wheel_dir)
+    server = serve_index(parsed.wheel_dir)
+    index_url = f"http://127.0.0.1:{server.server_port}/simple/"
+
+    results: Dict[str, Dict[str, float]] = {}
+    for installer in parsed.installer or list(INSTALLERS):
+        cold, warm = [], []
+        for _ in range(parsed.runs):
+            with tempfile.TemporaryDirectory() as cache_dir:
+                cold.append(
+                    measure_install(installer, requirements, index_url, cache_dir)
+                )
+                warm.append(
+                    measure_install(installer, requirements, index_url, cache_dir)
+                )
+        results[installer] = {
+            "cold_s": statistics.median(cold),
+            "warm_s": statistics.median(warm),
+        }
+        print(
+            f"{installer:>6}: cold {results[installer]['cold_s']:7.2f} s, "
+            f"warm {results[installer]['warm_s']:7.2f} s"
+        )
+
+    server.shutdown()
+    if parsed.output:
+        with open(parsed.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+def _normalize(name: str) -> str:
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Measure the cold start import time of a module within images built with and without
+precompiled bytecode (bdist_docker --compile-bytecode).
+
+    python benchmarks/startup.py --project example --module setuptools_docker_example
+"""
+
+import argparse
+import json
+import re
+import statistics
+import subprocess
+import sys
+import time
+from typing import Dict, List
+
+VARIANTS = {
+    "plain": [],
+    "compiled": ["--compile-bytecode"],
+    "bytecode-only": ["--bytecode-only-dependencies"],
+}
+
+
+def build(project_dir: str, image: str, tag: str, args: List[str]) -> None:
+    subprocess.run(
+        [
+            sys.executable,
+            "-m",
+            "setup",
+            "bdist_docker",
+            "--image-name",
+            image,
+            "--image-tag",
+            tag,
+            "--no-build-cache",
+        ]
+        + args,
+        cwd=project_dir,
+        check=True,
+    )
+
+
+def measure_import(image: str, module: str) -> Dict[str, float]:
+    """Import time of ``module`` in a fresh container, via python -X importtime."""
+    start = time.monotonic()
+    res = subprocess.run(
+        [
+            "docker",
+            "run",
+            "--rm",
+            "--entrypoint",
+            "python",
+            image,
+            "-X",
+            "importtime",
+            "-c",
+            f"import {module}",
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    wall = time.monotonic() - start
+
+    cumulative_us = 0
+    for line in res.stderr.splitlines():
+        m = re.match(r"import time:\s+\d+ \|\s+(\d+) \| (\s*)(\S+)", line)
+        # only top level imports, nested ones are part of their cumulative time
+        if m and not m.group(2):
+            cumulative_us += int(m.group(1))
+
+    return {"import_s": cumulative_us / 1e6, "container_s": wall}
+
+
+def main(args: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--project", required=True, help="project dir with setup.py")
+    parser.add_argument("--module", required=True, help="module to import")
+    parser.add_argument("--image", default="bench-startup")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--output", help="write results as json to this file")
+    parsed = parser.parse_args(args)
+
+    results = {}
+    for variant, build_args in VARIANTS.items():
+        build(parsed.project, parsed.image, variant, build_args)
+        runs = [
+            measure_import(f"{parsed.image}:{variant}", parsed.module)
+            for _ in range(parsed.runs)
+        ]
+        results[variant] = {
+            key: statistics.median(r[key] for r in runs) for key in runs[0]
+        }
+        print(
+            f"{variant:>14}: import {results[variant]['import_s'] * 1000:8.1f} ms, "
+            f"container {results[variant]['container_s'] * 1000:8.1f} ms"
+        )
+
+    if parsed.output:
+        with open(parsed.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
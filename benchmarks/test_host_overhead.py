@@ -0,0 +1,132 @@
+"""
+Microbenchmarks of the host side of bdist_docker, i.e., parsing options, rendering
+and staging the context, at the scale of large monorepos and without docker.
+
+    pip install pytest-benchmark
+    python -m pytest benchmarks/test_host_overhead.py --benchmark-autosave
+    python -m pytest benchmarks/test_host_overhead.py --benchmark-compare \\
+        --benchmark-compare-fail=median:10%
+
+Builds use the recording image builder, which stages the context like a docker
+build but does not run one.
+"""
+
+import itertools
+import os
+
+import pytest
+from setuptools import Distribution
+
+from setuptools_docker.command import _parse_envvars, _parse_list, bdist_docker
+from setuptools_docker.docker import _render_index_url, prepare_context, render_context
+from setuptools_docker.staging import stage_files
+
+INIT_SCRIPTS = 1000
+ENV_VARS = 5000
+WHEEL_SIZE = 256 * 1024**2
+
+
+@pytest.fixture(scope="module")
+def project(tmp_path_factory):
+    root = tmp_path_factory.mktemp("project")
+    wheel_file = root / "example-1.0-py3-none-any.whl"
+    with open(wheel_file, "wb") as f:
+        # a large wheel, staging links or copies it, never reads it into memory
+        f.truncate(WHEEL_SIZE)
+
+    init_dir = root / "init.d"
+    init_dir.mkdir()
+    init_scripts = []
+    for i in range(INIT_SCRIPTS):
+        script = init_dir / f"{i // 10:03d}-script-{i}.sh"
+        script.write_text(f"echo {i}\n")
+        init_scripts.append(str(script))
+
+    return {
+        "root": root,
+        "wheel_file": str(wheel_file),
+        "init_scripts": init_scripts,
+        "env_vars": " ".join(f"VAR_{i}=value-{i}" for i in range(ENV_VARS)),
+    }
+
+
+def context_args(project):
+    return {
+        "init_scripts": project["init_scripts"],
+        "env_vars": _parse_envvars(_parse_list(project["env_vars"])),
+        "index_url": "pypi.example.com/simple",
+        "index_username": "user",
+        "index_password": "secret",
+        "extra_requires": ["gunicorn", "uvicorn"],
+    }
+
+
+def test_parse_list(benchmark, project):
+    assert len(benchmark(_parse_list, project["env_vars"])) == ENV_VARS
+
+
+def test_parse_envvars(benchmark, project):
+    env_vars = _parse_list(project["env_vars"])
+    assert len(benchmark(_parse_envvars, env_vars)) == ENV_VARS
+
+
+def test_render_index_url(benchmark):
+    url = benchmark(_render_index_url, "pypi.example.com/simple", "user", "secret")
+    assert url.startswith("https://user:")
+
+
+def test_render_context(benchmark, project):
+    context_files, _ = benchmark(
+        render_context, project["wheel_file"], **context_args(project)
+    )
+    assert len(context_files) > INIT_SCRIPTS
+
+
+def test_prepare_context_new(benchmark, project):
+    counter = itertools.count()
+
+    def setup():
+        context_path = project["root"] / f"context-{next(counter)}"
+        return (str(context_path), project["wheel_file"]), context_args(project)
+
+    benchmark.pedantic(prepare_context, setup=setup, rounds=20)
+
+
+def test_prepare_context_unchanged(benchmark, project):
+    context_path = str(project["root"] / "context-unchanged")
+    context_files, _ = render_context(project["wheel_file"], **context_args(project))
+    stage_files(context_path, context_files)
+
+    benchmark(stage_files, context_path, context_files)
+    wheel_file = os.path.join(context_path, "example-1.0-py3-none-any.whl")
+    assert os.path.getsize(wheel_file) == WHEEL_SIZE
+
+
+@pytest.mark.parametrize("stream_context", [False, True])
+def test_build(benchmark, project, stream_context):
+    dist = Distribution(
+        {
+            "name": "example",
+            "version": "1.0",
+            "cmdclass": {"bdist_docker": bdist_docker},
+        }
+    )
+    dist.command_options["build"] = {
+        "build_base": ("setup.cfg", str(project["root"] / "build"))
+    }
+    dist.command_options["bdist_docker"] = {
+        "image_builder": ("setup.cfg", "recording"),
+        "environment_vars": ("setup.cfg", project["env_vars"]),
+        "init_scripts": ("setup.cfg", " ".join(project["init_scripts"])),
+    }
+    cmd = dist.get_command_obj("bdist_docker")
+    # every round renders, stages and builds
+    cmd.build_cache = False
+    cmd.stream_context = stream_context
+    cmd.pip_cache_docker = not stream_context
+    cmd.ensure_finalized()
+
+    benchmark(cmd.build, project["wheel_file"])
+    assert {call for call, _ in cmd.image_builder.calls} == {
+        "build_streamed" if stream_context else "build"
+    }
@@ -1 +1 @@
-from .command import bdist_docker
+from .command import bdist_docker, bdist_docker_batch
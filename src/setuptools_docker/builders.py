@@ -0,0 +1,120 @@
+import abc
+import hashlib
+import os
+from typing import Dict, List, Optional, Tuple
+
+from .docker import build_image, image_id, tag_image
+from .engine import build_image_streamed, iter_context_tar
+from .staging import StagingSource
+
+
+class Builder(abc.ABC):
+    """
+    Runs the builds of bdist_docker, i.e., everything which needs docker. The
+    context is prepared on the host before, independent of the builder.
+    """
+
+    @abc.abstractmethod
+    def build(self, context_path: str, image_name: str, image_tag: str, **kwargs):
+        """Build the staged context in ``context_path``, see ``build_image``."""
+
+    @abc.abstractmethod
+    def build_streamed(
+        self,
+        context_files: Dict[str, StagingSource],
+        image_name: str,
+        image_tag: str,
+        **kwargs,
+    ) -> Optional[str]:
+        """Build from a streamed context, see ``build_image_streamed``."""
+
+    @abc.abstractmethod
+    def image_id(self, image: str) -> Optional[str]:
+        """Id of ``image``, None if it does not exist."""
+
+    @abc.abstractmethod
+    def tag(self, image: str, image_name: str, image_tag: str) -> None:
+        """Tag ``image`` as ``image_name:image_tag``."""
+
+
+class DockerBuilder(Builder):
+    """Builds via the docker cli or the engine api."""
+
+    def build(self, context_path: str, image_name: str, image_tag: str, **kwargs):
+        build_image(context_path, image_name, image_tag, **kwargs)
+
+    def build_streamed(
+        self,
+        context_files: Dict[str, StagingSource],
+        image_name: str,
+        image_tag: str,
+        **kwargs,
+    ) -> Optional[str]:
+        return build_image_streamed(context_files, image_name, image_tag, **kwargs)
+
+    def image_id(self, image: str) -> Optional[str]:
+        return image_id(image)
+
+    def tag(self, image: str, image_name: str, image_tag: str) -> None:
+        tag_image(image, image_name, image_tag)
+
+
+class RecordingBuilder(Builder):
+    """
+    Records builds instead of running docker, e.g., for tests and for profiling
+    the host side of builds. Streamed contexts are generated like for the engine.
+    Images get ids derived from the names and sizes of their context files.
+    """
+
+    def __init__(self) -> None:
+        self.calls: List[Tuple[str, Dict]] = []
+        self.images: Dict[str, str] = {}
+
+    def build(self, context_path: str, image_name: str, image_tag: str, **kwargs):
+        files = {}
+        for root, _, names in os.walk(context_path):
+            for name in names:
+                path = os.path.join(root, name)
+                files[os.path.relpath(path, context_path)] = os.path.getsize(path)
+        self._record(
+            "build",
+            image_name,
+            image_tag,
+            dict(kwargs, context_path=context_path, files=files),
+            sorted(files.items()),
+        )
+
+    def build_streamed(
+        self,
+        context_files: Dict[str, StagingSource],
+        image_name: str,
+        image_tag: str,
+        **kwargs,
+    ) -> Optional[str]:
+        size = sum(len(chunk) for chunk in iter_context_tar(context_files))
+        return self._record(
+            "build_streamed",
+            image_name,
+            image_tag,
+            dict(kwargs, files=sorted(context_files), tar_size=size),
+            (sorted(context_files), size),
+        )
+
+    def image_id(self, image: str) -> Optional[str]:
+        return self.images.get(image)
+
+    def tag(self, image: str, image_name: str, image_tag: str) -> None:
+        self.calls.append(("tag", {"image": image, "tag": f"{image_name}:{image_tag}"}))
+        self.images[f"{image_name}:{image_tag}"] = image
+
+    def _record(
+        self, call: str, image_name: str, image_tag: str, args: Dict, content
+    ) -> str:
+        built_image = f"sha256:{hashlib.sha256(repr(content).encode()).hexdigest()}"
+        self.calls.append((call, dict(args, image=f"{image_name}:{image_tag}")))
+        self.images[f"{image_name}:{image_tag}"] = built_image
+        self.images[built_image] = built_image
+        return built_image
+
+
+BUILDERS = {"docker": DockerBuilder, "recording": RecordingBuilder}
@@ -0,0 +1,82 @@
+import hashlib
+import json
+import os
+import pathlib
+import threading
+import time
+from typing import Dict, Optional
+
+from .staging import StagingSource, file_digest
+
+INDEX_FILE = "index.json"
+
+
+class BuildCache:
+    """
+    Maps hashes of build inputs to ids of images built from them. Holds at most
+    ``max_entries`` entries, the least recently used ones get evicted.
+    """
+
+    # shared by all instances, parallel builds may use the same cache dir
+    _lock = threading.Lock()
+
+    def __init__(self, cache_dir: str, max_entries: int = 50) -> None:
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+
+    def key(self, context_files: Dict[str, StagingSource], args: Dict) -> str:
+        """
+        Hash of all files of the build context (wheel, requirements, init scripts,
+        rendered Dockerfile, ...) plus the given build arguments.
+        """
+        h = hashlib.sha256()
+        h.update(json.dumps(args, sort_keys=True, default=str).encode())
+        for name in sorted(context_files):
+            source = context_files[name]
+            h.update(name.encode() + b"\0")
+            h.update(
+                hashlib.sha256(source).hexdigest().encode()
+                if isinstance(source, bytes)
+                else file_digest(source).encode()
+            )
+
+        return h.hexdigest()
+
+    def lookup(self, key: str) -> Optional[str]:
+        with self._lock:
+            index = self._read_index()
+            entry = index.get(key)
+            if entry is None:
+                return None
+            entry["last_used"] = time.time()
+            self._write_index(index)
+            return entry["image_id"]
+
+    def store(self, key: str, image_id: str) -> None:
+        with self._lock:
+            index = self._read_index()
+            index[key] = {"image_id": image_id, "last_used": time.time()}
+            by_usage = sorted(index, key=lambda k: index[k]["last_used"])
+            for evicted in by_usage[: max(0, len(index) - self.max_entries)]:
+                del index[evicted]
+            self._write_index(index)
+
+    def invalidate(self, key: str) -> None:
+        with self._lock:
+            index = self._read_index()
+            if index.pop(key, None) is not None:
+                self._write_index(index)
+
+    def _read_index(self) -> Dict[str, Dict]:
+        try:
+            with open(os.path.join(self.cache_dir, INDEX_FILE)) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _write_index(self, index: Dict[str, Dict]) -> None:
+        pathlib.Path(self.cache_dir).mkdir(parents=True, exist_ok=True)
+        tmp_file = os.path.join(self.cache_dir, f"{INDEX_FILE}.{os.getpid()}.tmp")
+        with open(tmp_file, "w") as f:
+            json.dump(index, f)
+        os.replace(tmp_file, os.path.join(self.cache_dir, INDEX_FILE))
@@ -1,10 +1,53 @@
+import json
 import os
+import pathlib
 import re
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List, Optional, Tuple
 
+from distutils import log
+from distutils.errors import DistutilsExecError, DistutilsOptionError
+from distutils.util import strtobool
 from setuptools import Command
 
-from .docker import build_image, prepare_context
+from .builders import BUILDERS
+from .cache import BuildCache
+from .docker import (
+    DEFAULT_BASE_IMAGE,
+    INSTALLERS,
+    RUNTIME_PROFILES,
+    WHEELHOUSE_DIR,
+    cache_spec,
+    render_context,
+    render_host_index_url,
+)
+from .indexproxy import IndexProxy
+from .oci import build_oci_image
+from .plan import BuildPlan, build_plan
+from .registry import push_image_layout
+from .report import BuildReport
+from .staging import context_size, scan_context, stage_files
+from .wheelhouse import (
+    check_lock,
+    default_cache_dir,
+    fill_wheelhouse,
+    host_platform,
+    lock_requirements,
+    pip_platforms,
+    python_version_of,
+)
+from .wheels import (
+    normalize_platform,
+    platform_wheel,
+    wheel_dist_name,
+    wheel_requirements,
+)
+
+BACKENDS = ["docker", "oci"]
+LAYERINGS = ["single", "split"]
+
+VARIANT_SECTION_PREFIX = "bdist_docker"
 
 
 class bdist_docker(Command):
@@ -47,16 +90,233 @@ class bdist_docker(Command):
         ("init-scripts=", None, "Extra init scripts to add to image"),
         ("pip-cache-docker=", None, "Utilize docker cache for pip"),
         ("environment-vars=", None, "Environment variables to set in target image"),
+        ("build-cache", None, "Skip builds if inputs match a previous build"),
+        ("no-build-cache", None, "Always build, don't use build cache"),
+        ("build-cache-dir=", None, "Directory for build cache index"),
+        ("build-cache-size=", None, "Max number of builds kept in build cache"),
+        (
+            "stream-context",
+            None,
+            "Stream build context to docker engine api instead of writing it to disk",
+        ),
+        ("docker-host=", None, "Docker engine to stream build context to"),
+        (
+            "index-proxy",
+            None,
+            "Install from a caching proxy of index-url on the host, which keeps the "
+            "credentials",
+        ),
+        (
+            "index-proxy-cache-dir=",
+            None,
+            "Cache dir of the index proxy. Defaults to ~/.cache/setuptools-docker/"
+            "index-proxy",
+        ),
+        (
+            "index-proxy-cache-size=",
+            None,
+            "Max size of the index proxy cache, e.g., 5G. Defaults to 2G",
+        ),
+        (
+            "context-budget=",
+            None,
+            "Max size of the build context sent to docker, e.g., 200M. Fails the "
+            "build if exceeded",
+        ),
+        ("context-budget-warn", None, "Only warn if the context budget is exceeded"),
+        (
+            "wheelhouse",
+            None,
+            "Download dependency wheels on the host and install them offline",
+        ),
+        ("wheelhouse-cache-dir=", None, "Host cache dir for wheelhouse downloads"),
+        ("wheelhouse-jobs=", None, "Number of parallel wheelhouse downloads"),
+        (
+            "wheelhouse-python-version=",
+            None,
+            "Python version to resolve wheels for. Defaults to version of base image",
+        ),
+        (
+            "wheelhouse-platforms=",
+            None,
+            "Platforms to resolve wheels for, e.g., manylinux2014_x86_64. Defaults "
+            "to the manylinux platforms of the image",
+        ),
+        (
+            "compile-bytecode",
+            None,
+            "Precompile bytecode (unchecked-hash pycs) of venv in builder stage",
+        ),
+        (
+            "bytecode-only-dependencies",
+            None,
+            "Remove sources of third-party packages, keeping only their bytecode",
+        ),
+        (
+            "prune-venv",
+            None,
+            "Remove files not needed at runtime (tests, caches, ...) from venv",
+        ),
+        (
+            "prune-rules=",
+            None,
+            "Prune rules to apply. Defaults to all rules except docs",
+        ),
+        ("prune-include=", None, "Globs of extra files to prune from venv"),
+        ("prune-exclude=", None, "Globs of files to keep when pruning venv"),
+        (
+            "strip-shared-objects",
+            None,
+            "Strip unneeded symbols from shared objects in venv",
+        ),
+        (
+            "plan-output=",
+            None,
+            "Write json build plan (stages, layers, context files) to file instead "
+            "of building",
+        ),
+        (
+            "template=",
+            None,
+            "Custom Dockerfile template extending Dockerfile.j2",
+        ),
+        (
+            "extra-files=",
+            None,
+            "Files to copy into image, as path/on/host:/path/in/image",
+        ),
+        (
+            "runtime-profile=",
+            None,
+            "Allocator and environment of image: default, throughput or low-memory",
+        ),
+        (
+            "installer=",
+            None,
+            f"Installer of the builder stage, one of {', '.join(INSTALLERS)}",
+        ),
+        (
+            "minimal-runtime",
+            None,
+            "Copy only interpreter, venv and the shared libraries they need onto a "
+            "distroless base image, without shell",
+        ),
+        (
+            "native-build",
+            None,
+            "Build dependencies from sdists in parallel with a compiler cache",
+        ),
+        (
+            "native-build-jobs=",
+            None,
+            "Parallel jobs for native builds. Defaults to number of cores of builder",
+        ),
+        (
+            "platforms=",
+            None,
+            "Platforms to build a multi-platform image for, e.g., linux/amd64 "
+            "linux/arm64",
+        ),
+        ("push", None, "Push image to registry instead of loading it"),
+        (
+            "push-tags=",
+            None,
+            "Tags to push the image with (oci backend only). Defaults to image-tag",
+        ),
+        (
+            "push-mount-from=",
+            None,
+            "Repositories to mount missing blobs from when pushing, e.g., of other "
+            "images sharing the dependencies (oci backend only)",
+        ),
+        ("push-jobs=", None, "Number of concurrent blob uploads (oci backend only)"),
+        ("registry-username=", None, "Username for the registry (oci backend only)"),
+        ("registry-password=", None, "Password for the registry (oci backend only)"),
+        (
+            "cache-from=",
+            None,
+            "Build caches to import: registry, local, inline or buildx --cache-from "
+            "specs",
+        ),
+        (
+            "cache-to=",
+            None,
+            "Build cache to export: registry, local, inline or a buildx --cache-to spec",
+        ),
+        (
+            "buildkit-cache-dir=",
+            None,
+            "Directory of the local build cache. Defaults to build/buildkit-cache",
+        ),
+        (
+            "lock-file=",
+            None,
+            "Hash pinned lock of all dependencies to install. Gets generated from "
+            "requirements file and wheel if missing",
+        ),
+        ("update-lock", None, "Regenerate lock file"),
+        ("build-report=", None, "Write json report of build timings and sizes to file"),
+        ("print-report", None, "Log summary of build timings and sizes"),
+        (
+            "build-progress=",
+            None,
+            "Progress output of docker build (plain, rawjson, ...). Defaults to plain "
+            "if a report is requested",
+        ),
+        (
+            "layering=",
+            None,
+            "Layering of python packages, one of "
+            f"{', '.join(LAYERINGS)} (separate layers for dependencies and wheel)",
+        ),
+        (
+            "backend=",
+            None,
+            f"Backend for building the image, one of {', '.join(BACKENDS)}",
+        ),
+        (
+            "image-builder=",
+            None,
+            "Runs the builds of the docker backend, one of "
+            f"{', '.join(BUILDERS)} (recording only records them, without docker)",
+        ),
+        (
+            "base-image-layout=",
+            None,
+            "Local oci image layout holding the base image (oci backend only)",
+        ),
+        (
+            "oci-output=",
+            None,
+            "Oci layout directory or .tar archive to write (oci backend only)",
+        ),
     ]
 
-    boolean_options = ["pip-cache-docker"]
+    boolean_options = [
+        "pip-cache-docker",
+        "build-cache",
+        "stream-context",
+        "wheelhouse",
+        "compile-bytecode",
+        "bytecode-only-dependencies",
+        "prune-venv",
+        "strip-shared-objects",
+        "print-report",
+        "update-lock",
+        "push",
+        "native-build",
+        "minimal-runtime",
+        "context-budget-warn",
+        "index-proxy",
+    ]
+    negative_opt = {"no-build-cache": "build-cache"}
 
     def initialize_options(self) -> None:
         self.build_context = None
         self.image_name = None
         self.image_tag = None
         self.builder_extra_os_packages = None
-        self.base_image = "python:3.8-slim-bullseye"
+        self.base_image = DEFAULT_BASE_IMAGE
         self.extra_os_packages = None
         self.extra_requires = None
         self.requirements_file = None
@@ -69,6 +329,57 @@ class bdist_docker(Command):
         self.init_scripts = None
         self.pip_cache_docker = True
         self.environment_vars = None
+        self.build_cache = True
+        self.build_cache_dir = None
+        self.build_cache_size = 50
+        self.stream_context = False
+        self.docker_host = None
+        self.context_budget = None
+        self.context_budget_warn = False
+        self.index_proxy = False
+        self.index_proxy_cache_dir = None
+        self.index_proxy_cache_size = "2G"
+        self.wheelhouse = False
+        self.wheelhouse_cache_dir = None
+        self.wheelhouse_jobs = 8
+        self.wheelhouse_python_version = None
+        self.wheelhouse_platforms = None
+        self.compile_bytecode = False
+        self.bytecode_only_dependencies = False
+        self.prune_venv = False
+        self.prune_rules = None
+        self.prune_include = None
+        self.prune_exclude = None
+        self.strip_shared_objects = False
+        self.plan_output = None
+        self.template = None
+        self.extra_files = None
+        self.runtime_profile = "default"
+        self.minimal_runtime = False
+        self.installer = "pip"
+        self.native_build = False
+        self.native_build_jobs = None
+        self.platforms = None
+        self.push = False
+        self.push_tags = None
+        self.push_mount_from = None
+        self.push_jobs = 8
+        self.registry_username = None
+        self.registry_password = None
+        self.cache_from = None
+        self.cache_to = None
+        self.buildkit_cache_dir = None
+        self.lock_file = None
+        self.update_lock = False
+        self.build_report = None
+        self.print_report = False
+        self.build_progress = None
+        self.report = None
+        self.layering = "single"
+        self.backend = "docker"
+        self.image_builder = "docker"
+        self.base_image_layout = None
+        self.oci_output = None
 
     def finalize_options(self) -> None:
         if self.image_name is None:
@@ -87,17 +398,403 @@ class bdist_docker(Command):
             build_base = getattr(build_cmd_obj, "build_base")
             self.build_context = os.path.join(build_base, "docker")
 
+        if self.build_cache_dir is None:
+            build_cmd_obj = self.distribution.get_command_obj("build")
+            build_cmd_obj.ensure_finalized()
+            build_base = getattr(build_cmd_obj, "build_base")
+            self.build_cache_dir = os.path.join(build_base, "docker-cache")
+
+        self.build_cache_size = int(self.build_cache_size)
+        if isinstance(self.pip_cache_docker, str):
+            # given as value on the command line, e.g., --pip-cache-docker=0
+            self.pip_cache_docker = bool(strtobool(self.pip_cache_docker))
+        if self.context_budget is not None:
+            self.context_budget = _parse_size(self.context_budget)
+
+        if self.index_proxy_cache_dir is None:
+            # shared by all builds on the host
+            self.index_proxy_cache_dir = os.path.join(
+                os.path.expanduser("~"), ".cache", "setuptools-docker", "index-proxy"
+            )
+        self.index_proxy_cache_size = _parse_size(str(self.index_proxy_cache_size))
+
+        if self.buildkit_cache_dir is None:
+            build_cmd_obj = self.distribution.get_command_obj("build")
+            build_cmd_obj.ensure_finalized()
+            build_base = getattr(build_cmd_obj, "build_base")
+            self.buildkit_cache_dir = os.path.join(
+                build_base, "buildkit-cache", re.sub(r"[^\w.-]", "_", self.image_name)
+            )
+
+        self.cache_from = [
+            cache_spec(spec, self.image_name, self.image_tag, self.buildkit_cache_dir)
+            for spec in _parse_list(self.cache_from)
+        ]
+        if self.cache_to is not None:
+            self.cache_to = cache_spec(
+                self.cache_to,
+                self.image_name,
+                self.image_tag,
+                self.buildkit_cache_dir,
+                export=True,
+            )
+
+        if self.wheelhouse_cache_dir is None:
+            self.wheelhouse_cache_dir = default_cache_dir()
+
+        if self.wheelhouse_python_version is None:
+            self.wheelhouse_python_version = python_version_of(self.base_image)
+
+        self.wheelhouse_jobs = int(self.wheelhouse_jobs)
+
+        if self.native_build_jobs is not None:
+            self.native_build_jobs = int(self.native_build_jobs)
+
+        if self.build_progress is None and (self.build_report or self.print_report):
+            # progress needs to be parseable for reporting timings of steps
+            self.build_progress = "plain"
+
+        if self.runtime_profile not in RUNTIME_PROFILES:
+            raise Exception(f"Invalid runtime profile: {self.runtime_profile}")
+
+        if self.installer not in INSTALLERS:
+            raise Exception(f"Invalid installer: {self.installer}")
+
+        if self.layering not in LAYERINGS:
+            raise Exception(f"Invalid layering: {self.layering}")
+
+        if self.backend not in BACKENDS:
+            raise Exception(f"Invalid backend: {self.backend}")
+
+        if isinstance(self.image_builder, str):
+            if self.image_builder not in BUILDERS:
+                raise Exception(f"Invalid image builder: {self.image_builder}")
+            self.image_builder = BUILDERS[self.image_builder]()
+
+        if self.stream_context and (self.pip_cache_docker or self.index_password):
+            # the engine api uses the classic builder, i.e., no buildkit features
+            raise Exception(
+                "stream-context supports neither pip-cache-docker nor index-password"
+            )
+
+        if self.stream_context and self.index_proxy:
+            # the engine api builds without access to the network of the host
+            raise Exception("stream-context does not support index-proxy")
+
+        if self.stream_context and self.native_build:
+            # native builds use cache mounts
+            raise Exception("stream-context does not support native-build")
+
+        if self.native_build and not self.pip_cache_docker:
+            raise Exception("native-build requires pip-cache-docker")
+
+        # as in TARGETPLATFORM, which selects the platform wheels within the build
+        self.platforms = [normalize_platform(p) for p in _parse_list(self.platforms)]
+
+        # wheels of the host, e.g., macos or a newer glibc, can't be installed
+        self.wheelhouse_platforms = _parse_list(
+            self.wheelhouse_platforms
+        ) or pip_platforms(host_platform())
+
+        if self.stream_context and (
+            self.cache_from or self.cache_to or self.platforms or self.push
+        ):
+            raise Exception(
+                "stream-context supports neither cache-from, cache-to, platforms nor "
+                "push"
+            )
+
+        if len(self.platforms) > 1 and self.lock_file:
+            # the hashes of platform specific wheels differ
+            raise Exception("lock-file is not supported for multiple platforms")
+
+        if self.backend == "oci":
+            # options of the Dockerfile and of docker build do not apply
+            for option, value in [
+                ("platforms", self.platforms),
+                ("minimal-runtime", self.minimal_runtime),
+                ("layering", self.layering != "single"),
+                ("compile-bytecode", self.compile_bytecode),
+                ("bytecode-only-dependencies", self.bytecode_only_dependencies),
+                ("prune-venv", self.prune_venv),
+                ("prune-rules", self.prune_rules),
+                ("strip-shared-objects", self.strip_shared_objects),
+                ("runtime-profile", self.runtime_profile != "default"),
+                ("extra-files", self.extra_files),
+                ("installer", self.installer != "pip"),
+                ("template", self.template),
+                ("native-build", self.native_build),
+                ("wheelhouse", self.wheelhouse),
+                ("lock-file", self.lock_file),
+                ("stream-context", self.stream_context),
+                ("index-proxy", self.index_proxy),
+                ("cache-from", self.cache_from),
+                ("cache-to", self.cache_to),
+            ]:
+                if value:
+                    raise DistutilsOptionError(f"oci backend does not support {option}")
+            if self.base_image_layout is None:
+                raise Exception("oci backend requires base-image-layout")
+            if self.wheelhouse_python_version is None:
+                raise Exception(
+                    "oci backend requires wheelhouse-python-version unless the "
+                    "base-image is an official python image"
+                )
+            if self.oci_output is None:
+                self.oci_output = os.path.join(self.build_context, "image.tar")
+
+        self.push_tags = _parse_list(self.push_tags) or [self.image_tag]
+        self.push_mount_from = _parse_list(self.push_mount_from)
+        self.push_jobs = int(self.push_jobs)
+
     def run(self) -> None:
-        self.run_command("bdist_wheel")
+        self.report = BuildReport()
+        with self.report.span("bdist_wheel"):
+            self.run_command("bdist_wheel")
+        self.build(_wheel_file(self.distribution))
+
+    def build(self, wheel_file: str, log_prefix: Optional[str] = None) -> None:
+        """Build image from an already built wheel."""
+        if self.report is None:
+            self.report = BuildReport()
+
+        if self.plan_output:
+            pathlib.Path(self.plan_output).parent.mkdir(parents=True, exist_ok=True)
+            with open(self.plan_output, "w") as f:
+                json.dump(self.plan(wheel_file).to_dict(), f, indent=2)
+            log.info(f"wrote build plan to {self.plan_output}")
+            return
+
+        try:
+            with self.report.span("bdist_docker"):
+                self._build(wheel_file, log_prefix)
+        finally:
+            # reports of failed builds show the failed step and where time went
+            if self.build_report:
+                self.report.write(self.build_report)
+            if self.print_report:
+                log.info(self.report.summary())
+
+    def plan(self, wheel_file: str) -> BuildPlan:
+        """
+        In-memory plan of building the image from an already built wheel, without
+        side effects: a lock file to be written and the wheelhouse are planned.
+        """
+        platform_wheels = {
+            p: platform_wheel(wheel_file, p, self.wheelhouse_python_version)
+            for p in self.platforms
+        }
+        planned = []
+        if self.lock_file and (self.update_lock or not os.path.exists(self.lock_file)):
+            planned.append(os.path.basename(self.lock_file))
+        elif self.lock_file:
+            # locks of multi-platform builds get resolved from the platform wheel
+            self._check_lock(
+                platform_wheels[self.platforms[0]] if self.platforms else wheel_file
+            )
+        if self.wheelhouse:
+            planned.append(WHEELHOUSE_DIR)
 
-        wheel_file = None
-        for dist_file in self.distribution.dist_files:
-            if dist_file[0] == "bdist_wheel":
-                wheel_file = dist_file[2]
+        return build_plan(
+            wheel_file,
+            planned=planned,
+            use_wheelhouse=self.wheelhouse,
+            **self._render_args(platform_wheels),
+        )
+
+    def _build(self, wheel_file: str, log_prefix: Optional[str] = None) -> None:
+        report = self.report
+        if self.backend == "oci":
+            with report.span("build_oci_image"):
+                build_oci_image(
+                    output=self.oci_output,
+                    base_layout=self.base_image_layout,
+                    wheel_file=wheel_file,
+                    image_name=self.image_name,
+                    image_tag=self.image_tag,
+                    requirements_file=self.requirements_file,
+                    extra_requires=_parse_list(self.extra_requires),
+                    index_url=self.index_url,
+                    index_username=self.index_username,
+                    index_password=self.index_password,
+                    init_scripts=_parse_list(self.init_scripts),
+                    entrypoint=_parse_list(self.entrypoint),
+                    command=_parse_list(self.command),
+                    user_id=self.user_id,
+                    env_vars=_parse_envvars(_parse_list(self.environment_vars)),
+                    python_version=self.wheelhouse_python_version,
+                    platforms=self.wheelhouse_platforms,
+                )
+            if self.push:
+                with report.span("push_image_layout"):
+                    push_image_layout(
+                        self.oci_output,
+                        self.image_name,
+                        self.push_tags,
+                        username=self.registry_username,
+                        password=self.registry_password,
+                        mount_from=self.push_mount_from,
+                        jobs=self.push_jobs,
+                    )
+            return
+
+        context_args = self._context_args(wheel_file)
+        if self.index_proxy and context_args["index_url"] and not self.wheelhouse:
+            proxy = IndexProxy(
+                render_host_index_url(self.index_url, None, None),
+                self.index_proxy_cache_dir,
+                username=self.index_username,
+                password=self.index_password,
+                max_size=self.index_proxy_cache_size,
+            )
+            with proxy as proxy_url:
+                self._build_image(
+                    wheel_file,
+                    dict(context_args, index_proxy_url=proxy_url),
+                    log_prefix,
+                )
+        else:
+            self._build_image(wheel_file, context_args, log_prefix)
+
+    def _build_image(
+        self, wheel_file: str, context_args: Dict, log_prefix: Optional[str] = None
+    ) -> None:
+        report = self.report
+        builder = self.image_builder
+        with report.span("render_context"):
+            context_files, secrets = render_context(wheel_file, **context_args)
+
+        cache = (
+            BuildCache(self.build_cache_dir, self.build_cache_size)
+            # multi-platform and pushed images are not in the local image store
+            if self.build_cache and not self.platforms and not self.push
+            else None
+        )
+        if cache:
+            # the password only gets passed as secret, i.e., is not part of context
+            with report.span("build_cache_lookup"):
+                cache_key = cache.key(
+                    context_files,
+                    dict(context_args, index_password=None, index_proxy_url=None),
+                )
+                cached_image = cache.lookup(cache_key)
+            if cached_image and builder.image_id(cached_image) == cached_image:
+                log.info(f"inputs unchanged, reusing image {cached_image}")
+                builder.tag(cached_image, self.image_name, self.image_tag)
+                return
+            elif cached_image:
+                cache.invalidate(cache_key)
 
-        secrets: Dict[str, str] = prepare_context(
-            context_path=self.build_context,
-            wheel_file=wheel_file,
+        if self.stream_context:
+            self._check_context_size(context_size(context_files))
+            with report.span("build_image"):
+                built_image = builder.build_streamed(
+                    context_files,
+                    image_name=self.image_name,
+                    image_tag=self.image_tag,
+                    docker_host=self.docker_host,
+                    log_prefix=log_prefix,
+                )
+        else:
+            with report.span("prepare_context"):
+                stage_files(self.build_context, context_files)
+                self._check_context_size(
+                    *scan_context(self.build_context, context_files)
+                )
+            with report.span("build_image"):
+                builder.build(
+                    context_path=self.build_context,
+                    image_name=self.image_name,
+                    image_tag=self.image_tag,
+                    secrets=secrets,
+                    # the index proxy listens on localhost of the host
+                    extra_docker_args=(
+                        ["--network", "host"]
+                        if context_args.get("index_proxy_url")
+                        else []
+                    ),
+                    log_prefix=log_prefix,
+                    progress=self.build_progress,
+                    output_handler=(
+                        report.parse_progress
+                        if self.build_report or self.print_report
+                        else None
+                    ),
+                    cache_from=self.cache_from,
+                    cache_to=self.cache_to,
+                    platforms=self.platforms,
+                    push=self.push,
+                )
+            built_image = builder.image_id(f"{self.image_name}:{self.image_tag}")
+
+        if self.build_report or self.print_report:
+            report.inspect_image(f"{self.image_name}:{self.image_tag}")
+
+        if cache and built_image:
+            cache.store(cache_key, built_image)
+
+    def _check_context_size(self, size: int, ignored: int = 0) -> None:
+        log.info(
+            f"build context: {_format_size(size)}"
+            + (
+                f", {_format_size(ignored)} excluded by .dockerignore"
+                if ignored
+                else ""
+            )
+        )
+        if self.context_budget is not None and size > self.context_budget:
+            message = (
+                f"build context of {_format_size(size)} exceeds budget of "
+                f"{_format_size(self.context_budget)}"
+            )
+            if not self.context_budget_warn:
+                raise Exception(message)
+            log.warn(message)
+
+    def _context_args(self, wheel_file: str) -> Dict:
+        """Arguments of ``render_context``, incl. lock file and wheelhouse."""
+        platform_wheels = {
+            p: platform_wheel(wheel_file, p, self.wheelhouse_python_version)
+            for p in self.platforms
+        }
+
+        if self.lock_file and (self.update_lock or not os.path.exists(self.lock_file)):
+            with self.report.span("lock"):
+                if self.platforms:
+                    self._write_lock(
+                        platform_wheels[self.platforms[0]],
+                        pip_platforms(self.platforms[0]),
+                    )
+                else:
+                    self._write_lock(wheel_file)
+        elif self.lock_file:
+            # locks of multi-platform builds get resolved from the platform wheel
+            self._check_lock(
+                platform_wheels[self.platforms[0]] if self.platforms else wheel_file
+            )
+
+        wheelhouse = {}
+        platform_wheelhouses = {}
+        if self.wheelhouse and self.platforms:
+            with self.report.span("wheelhouse"):
+                platform_wheelhouses = {
+                    p: self._fill_wheelhouse(w, pip_platforms(p))
+                    for p, w in platform_wheels.items()
+                }
+        elif self.wheelhouse:
+            with self.report.span("wheelhouse"):
+                wheelhouse = self._fill_wheelhouse(wheel_file)
+
+        return self._render_args(platform_wheels, wheelhouse, platform_wheelhouses)
+
+    def _render_args(
+        self,
+        platform_wheels: Dict[str, str],
+        wheelhouse: Dict[str, str] = {},
+        platform_wheelhouses: Dict[str, Dict[str, str]] = {},
+    ) -> Dict:
+        """Arguments of ``render_context`` for the options, without side effects."""
+        return dict(
             base_image=self.base_image,
             extra_os_packages=_parse_list(self.extra_os_packages),
             builder_extra_os_packages=_parse_list(self.builder_extra_os_packages),
@@ -112,15 +809,200 @@ class bdist_docker(Command):
             user_id=self.user_id,
             pip_cache=self.pip_cache_docker,
             env_vars=_parse_envvars(_parse_list(self.environment_vars)),
+            split_layers=self.layering == "split",
+            wheelhouse=wheelhouse,
+            compile_bytecode=self.compile_bytecode,
+            bytecode_only_dependencies=self.bytecode_only_dependencies,
+            prune_venv=self.prune_venv or self.strip_shared_objects,
+            prune_rules=(
+                _parse_list(self.prune_rules)
+                if self.prune_rules is not None or not self.prune_venv
+                else None
+            ),
+            prune_include=_parse_list(self.prune_include),
+            prune_exclude=_parse_list(self.prune_exclude),
+            strip_shared_objects=self.strip_shared_objects,
+            lock_file=self.lock_file,
+            platform_wheels=platform_wheels,
+            platform_wheelhouses=platform_wheelhouses,
+            native_build=self.native_build,
+            native_build_jobs=self.native_build_jobs,
+            runtime_profile=self.runtime_profile,
+            minimal_runtime=self.minimal_runtime,
+            installer=self.installer,
+            template=self.template,
+            extra_files=_parse_extra_files(_parse_list(self.extra_files)),
         )
 
-        build_image(
-            context_path=self.build_context,
-            image_name=self.image_name,
-            image_tag=self.image_tag,
-            secrets=secrets,
+    def _fill_wheelhouse(
+        self, wheel_file: str, platforms: Optional[List[str]] = None
+    ) -> Dict[str, str]:
+        return fill_wheelhouse(
+            (
+                ["--no-deps", "-r", self.lock_file]
+                if self.lock_file
+                else self._requirements(wheel_file)
+            ),
+            cache_dir=self.wheelhouse_cache_dir,
+            index_url=self.index_url,
+            index_username=self.index_username,
+            index_password=self.index_password,
+            python_version=self.wheelhouse_python_version,
+            platforms=(
+                platforms if platforms is not None else self.wheelhouse_platforms
+            ),
+            exclude=[wheel_dist_name(wheel_file)],
+            jobs=self.wheelhouse_jobs,
         )
 
+    def _write_lock(
+        self, wheel_file: str, platforms: Optional[List[str]] = None
+    ) -> None:
+        log.info(f"writing lock file {self.lock_file}")
+        lock = lock_requirements(
+            self._requirements(wheel_file),
+            index_url=self.index_url,
+            index_username=self.index_username,
+            index_password=self.index_password,
+            python_version=self.wheelhouse_python_version,
+            platforms=(
+                platforms if platforms is not None else self.wheelhouse_platforms
+            ),
+            exclude=[wheel_dist_name(wheel_file)],
+            requirements_file=self.requirements_file,
+            wheel_requirements=wheel_requirements(
+                wheel_file, _parse_list(self.extra_requires)
+            ),
+        )
+        pathlib.Path(self.lock_file).parent.mkdir(parents=True, exist_ok=True)
+        with open(self.lock_file, "w") as f:
+            f.write(lock)
+
+    def _check_lock(self, wheel_file: str) -> None:
+        check_lock(
+            self.lock_file,
+            self.requirements_file,
+            wheel_requirements(wheel_file, _parse_list(self.extra_requires)),
+        )
+
+    def _requirements(self, wheel_file: str) -> List[str]:
+        """pip install arguments for the requirements file and the wheel."""
+        extra_requires = _parse_list(self.extra_requires)
+        return (["-r", self.requirements_file] if self.requirements_file else []) + [
+            wheel_file
+            + ("[" + ",".join(extra_requires) + "]" if extra_requires else "")
+        ]
+
+
+class bdist_docker_batch(Command):
+    description = "Create docker images for multiple variants in parallel"
+    user_options = [
+        (
+            "variants=",
+            None,
+            "Variants to build. Defaults to all [bdist_docker:<variant>] sections",
+        ),
+        ("jobs=", "j", "Max number of parallel builds"),
+    ]
+
+    def initialize_options(self) -> None:
+        self.variants = None
+        self.jobs = None
+
+    def finalize_options(self) -> None:
+        if self.variants is None:
+            self.variants = [
+                section.split(":", 1)[1]
+                for section in self.distribution.command_options
+                if section.startswith(f"{VARIANT_SECTION_PREFIX}:")
+            ]
+        else:
+            self.variants = _parse_list(self.variants)
+
+        if not self.variants:
+            raise Exception(f"No [{VARIANT_SECTION_PREFIX}:<variant>] sections found")
+
+        self.jobs = (
+            int(self.jobs) if self.jobs else min(len(self.variants), os.cpu_count())
+        )
+
+    def run(self) -> None:
+        self.run_command("bdist_wheel")
+        wheel_file = _wheel_file(self.distribution)
+
+        commands = {v: self._variant_command(v) for v in self.variants}
+        for option in ["build_context", "image_tag"]:
+            values = [getattr(commands[v], option) for v in self.variants]
+            if len(set(values)) < len(values):
+                # concurrent builds would overwrite each other's context or image
+                raise DistutilsOptionError(f"Variants share {option}: {values}")
+        results: Dict[str, Tuple[float, Optional[Exception]]] = {}
+
+        def build(variant: str) -> None:
+            start = time.monotonic()
+            try:
+                commands[variant].build(wheel_file, log_prefix=variant)
+                results[variant] = (time.monotonic() - start, None)
+            except Exception as e:
+                results[variant] = (time.monotonic() - start, e)
+
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            list(executor.map(build, self.variants))
+
+        for variant in self.variants:
+            duration, error = results[variant]
+            image = f"{commands[variant].image_name}:{commands[variant].image_tag}"
+            status = f"failed: {error}" if error else "ok"
+            log.info(f"{variant}: {image} {status} ({duration:.1f}s)")
+
+        failed = [v for v in self.variants if results[v][1] is not None]
+        if failed:
+            raise DistutilsExecError(f"Failed to build variants: {', '.join(failed)}")
+
+    def _variant_command(self, variant: str) -> bdist_docker:
+        """
+        bdist_docker command configured from the [bdist_docker] section, overridden by
+        [bdist_docker:<variant>]. Context directory and image tag are variant specific:
+        unless set in the variant section, they get derived from the shared ones.
+        """
+        variant_options = self.distribution.get_option_dict(
+            f"{VARIANT_SECTION_PREFIX}:{variant}"
+        )
+        options = dict(self.distribution.get_option_dict("bdist_docker"))
+        options.update(variant_options)
+
+        cmd = bdist_docker(self.distribution)
+        cmd.initialize_options()
+        self.distribution._set_command_options(cmd, options)
+
+        if "build_context" not in variant_options:
+            if cmd.build_context is None:
+                build_cmd_obj = self.distribution.get_command_obj("build")
+                build_cmd_obj.ensure_finalized()
+                build_base = getattr(build_cmd_obj, "build_base")
+                cmd.build_context = os.path.join(build_base, "docker-variants")
+            cmd.build_context = os.path.join(cmd.build_context, variant)
+
+        if "image_tag" not in variant_options:
+            if cmd.image_tag is None:
+                dist_version = self.distribution.metadata.version
+                cmd.image_tag = (
+                    dist_version.replace("+", "_") if dist_version else "latest"
+                )
+            cmd.image_tag = f"{cmd.image_tag}-{variant}"
+
+        cmd.ensure_finalized()
+        return cmd
+
+
+def _wheel_file(distribution) -> Optional[str]:
+    wheel_file = None
+    for dist_file in distribution.dist_files:
+        if dist_file[0] == "bdist_wheel":
+            wheel_file = dist_file[2]
+
+    return wheel_file
+
 
 def _parse_list(l: Optional[str]) -> List[str]:
     if l is None:
@@ -134,6 +1016,17 @@ def _parse_list(l: Optional[str]) -> List[str]:
     return [v.strip() for v in vs if v.strip()]
 
 
+def _parse_size(size: str) -> int:
+    m = re.fullmatch(r"(\d+)\s*([KMG]?)B?", size.strip(), re.I)
+    if not m:
+        raise Exception(f"Invalid size: {size}")
+    return int(m.group(1)) * 1024 ** "_KMG".index(m.group(2).upper() or "_")
+
+
+def _format_size(size: int) -> str:
+    return f"{size / 1024 ** 2:.1f} MB"
+
+
 def _parse_envvars(l: List[str]) -> List[Tuple[str, str]]:
     def match(e: str):
         m = re.fullmatch(r"([a-zA-Z_]\w*)=(.*)", e)
@@ -143,3 +1036,14 @@ def _parse_envvars(l: List[str]) -> List[Tuple[str, str]]:
             raise Exception(f"Invalid environment var mapping: {e}")
 
     return [(m.group(1), m.group(2)) for m in map(match, l)]
+
+
+def _parse_extra_files(l: List[str]) -> List[Tuple[str, str]]:
+    def match(e: str):
+        m = re.fullmatch(r"([^:]+):(/.*)", e)
+        if m:
+            return m
+        else:
+            raise Exception(f"Invalid extra file mapping: {e}")
+
+    return [(m.group(1), m.group(2)) for m in map(match, l)]
@@ -1,33 +1,136 @@
 #!/bin/bash
 
-# usage: process_init_files [file [file [...]]]
-#    ie: process_init_files /app/init.d/*
-process_init_files() {
-	echo
-	local f
-	for f; do
-		case "$f" in
-			*.sh)
-				if [ -x "$f" ]; then
-					echo "$0: running $f"
-					"$f"
-				else
-					echo "$0: sourcing $f"
-					. "$f"
-				fi
-				;;
-			*)
-        >&2"$0: ignoring $f"
-        ;;
-		esac
-		echo
+# Runs the init scripts (*.sh) in $INIT_DIR (default /app/init.d), sorted by name,
+# before executing the command.
+#
+# Consecutive scripts with the same number prefix (e.g. 10-warm-cache.sh and
+# 10-fetch-secrets.sh) form a phase. With INIT_PARALLEL=1 executable scripts of a
+# phase run concurrently, the next phase starts after all of them succeeded.
+# Otherwise, and for scripts without number prefix, scripts run one after another.
+# Scripts which are not executable get sourced, i.e., can export variables for
+# the command.
+#
+# The first failing script stops the start of the container with its exit code.
+# The duration of each script gets logged, as json lines if INIT_LOG_FORMAT=json.
+
+INIT_DIR="${INIT_DIR:-/app/init.d}"
+
+_now_ms() {
+	if [ -n "$EPOCHREALTIME" ]; then
+		local t="${EPOCHREALTIME/[.,]/}"
+		echo "${t:0:-3}"
+	else
+		date +%s%3N
+	fi
+}
+
+# usage: _json_string value
+_json_string() {
+	local s="${1//\\/\\\\}"
+	s="${s//\"/\\\"}"
+	s="${s//$'\n'/\\n}"
+	s="${s//$'\t'/\\t}"
+	printf '"%s"' "$s"
+}
+
+# usage: _log script phase exit_code start_ms
+_log() {
+	local duration=$(($(_now_ms) - $4))
+	if [ "$INIT_LOG_FORMAT" = "json" ]; then
+		printf '{"event": "init_script", "script": %s, "phase": %s, "exit_code": %d, "duration_ms": %d}\n' \
+			"$(_json_string "$1")" "$(_json_string "$2")" "$3" "$duration"
+	else
+		echo "$0: $1 exited with $3 after ${duration}ms"
+	fi
+}
+
+# usage: _run_script script phase
+_run_script() {
+	local start rc
+	start=$(_now_ms)
+	"$1"
+	rc=$?
+	_log "$1" "$2" "$rc" "$start"
+	return "$rc"
+}
+
+# usage: _source_script script phase
+_source_script() {
+	local start rc
+	start=$(_now_ms)
+	. "$1"
+	rc=$?
+	_log "$1" "$2" "$rc" "$start"
+	return "$rc"
+}
+
+# usage: _run_phase phase script [script [...]]
+_run_phase() {
+	local phase="$1" script rc pids=()
+	shift
+	for script; do
+		if [ ! -x "$script" ]; then
+			_source_script "$script" "$phase" || rc=$?
+		elif [ "$INIT_PARALLEL" != "1" ] || [ $# -eq 1 ]; then
+			_run_script "$script" "$phase" || rc=$?
+		else
+			# own process group per script, so that it can be stopped incl. children
+			set -m
+			_run_script "$script" "$phase" &
+			set +m
+			pids+=($!)
+			continue
+		fi
+		if [ -n "$rc" ]; then
+			_stop "${pids[@]}"
+			return "$rc"
+		fi
+	done
+
+	for _ in "${pids[@]}"; do
+		wait -n
+		rc=$?
+		if [ "$rc" -ne 0 ]; then
+			_stop "${pids[@]}"
+			return "$rc"
+		fi
+	done
+}
+
+# usage: _stop [pid [...]]
+_stop() {
+	local pid
+	for pid; do
+		kill -TERM -- "-$pid" 2>/dev/null
 	done
+	wait
+}
+
+_run_init_scripts() {
+	local script name phase="" next scripts=()
+	shopt -s nullglob
+	for script in "$INIT_DIR"/*; do
+		name="${script##*/}"
+		if [[ "$name" != *.sh ]]; then
+			echo "$0: ignoring $script" >&2
+			continue
+		fi
+
+		next=""
+		[[ "$name" =~ ^([0-9]+)[-_] ]] && next="${BASH_REMATCH[1]}"
+		if [ ${#scripts[@]} -gt 0 ] && { [ -z "$next" ] || [ "$next" != "$phase" ]; }; then
+			_run_phase "$phase" "${scripts[@]}" || return
+			scripts=()
+		fi
+		phase="$next"
+		scripts+=("$script")
+	done
+
+	if [ ${#scripts[@]} -gt 0 ]; then
+		_run_phase "$phase" "${scripts[@]}" || return
+	fi
+	shopt -u nullglob
 }
 
-echo "Running entrypoint"
-if [ -n "$(ls -A /app/init.d 2>/dev/null)" ]; then
-  process_init_files /app/init.d/*
-else
-  echo "$0: no additional init scripts in /app/init.d found"
-fi
+_run_init_scripts || exit
 exec "$@"
@@ -1,22 +1,124 @@
+import functools
 import os
-import pathlib
 import random
-import shutil
+import shlex
 import subprocess
+import sys
 import urllib.parse
 from string import ascii_letters
-from typing import Dict, List, Optional, Tuple
+from typing import Callable, Dict, List, Optional, Tuple
 
 from furl import furl
-from jinja2 import Environment, FileSystemLoader
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader, Template
+
+from .staging import DOCKERIGNORE_FILE, StagingSource, dockerignore, stage_files
+from .venvtool import PRUNE_RULES_DEFAULT
+from .wheels import wheel_dist_name, wheel_requirements
 
 INDEX_SECRET_NAME = "INDEX_PASSWORD"
 
+# secret, as the url of an index proxy varies between builds
+INDEX_URL_SECRET_NAME = "INDEX_URL"
 
-def prepare_context(
-    context_path: str,
+WHEEL_REQUIREMENTS_FILE = "wheel-requirements.txt"
+
+WHEELHOUSE_DIR = "wheelhouse"
+
+VENVTOOL_FILE = "venvtool.py"
+
+LAUNCHER_FILE = "launcher.py"
+
+DEFAULT_BASE_IMAGE = "python:3.8-slim-bullseye"
+
+# base of minimal runtime images, everything else gets copied from the builder
+MINIMAL_BASE_IMAGE = "gcr.io/distroless/static-debian11"
+
+# root of the interpreter and shared libraries of minimal runtime images
+RUNTIME_CLOSURE_DIR = "/runtime-closure"
+
+PLATFORM_WHEELS_DIR = "wheels"
+
+EXTRA_FILES_DIR = "extra-files"
+
+DOCKERFILE_TEMPLATE = "Dockerfile.j2"
+
+# architecture independent location of jemalloc for LD_PRELOAD
+JEMALLOC_PATH = "/usr/local/lib/libjemalloc.so.2"
+
+# allocator and environment of the final image (debian based images only)
+RUNTIME_PROFILES = {
+    "default": {"packages": [], "setup": None, "env": []},
+    # jemalloc fragments less with many threads and long running processes
+    "throughput": {
+        "packages": ["libjemalloc2"],
+        "setup": f"ln -s $(find /usr/lib -name libjemalloc.so.2 | head -n 1) {JEMALLOC_PATH}",
+        "env": [
+            ("LD_PRELOAD", JEMALLOC_PATH),
+            (
+                "MALLOC_CONF",
+                "background_thread:true,dirty_decay_ms:30000,muzzy_decay_ms:30000",
+            ),
+        ],
+    },
+    # fewer glibc arenas and returning freed memory to the os early
+    "low-memory": {
+        "packages": [],
+        "setup": None,
+        "env": [
+            ("MALLOC_ARENA_MAX", "2"),
+            ("MALLOC_TRIM_THRESHOLD_", "131072"),
+            ("MALLOC_MMAP_THRESHOLD_", "131072"),
+        ],
+    },
+}
+
+
+# installers of the builder stage, with the image providing their binary
+INSTALLERS = {
+    "pip": {
+        "command": "pip install",
+        "image": None,
+        "binary": None,
+        "env": [],
+        "cache_dir": "/root/.cache/pip",
+        "no_cache": "--no-cache-dir",
+        "compile": "",
+        "no_compile": "--no-compile",
+    },
+    # downloads and unpacks in parallel, installs into the venv of VIRTUAL_ENV
+    "uv": {
+        "command": "uv pip install",
+        "image": "ghcr.io/astral-sh/uv:0.4.30",
+        "binary": "/uv",
+        "env": [
+            ("VIRTUAL_ENV", "/app/venv"),
+            ("UV_CACHE_DIR", "/root/.cache/uv"),
+            # the cache is a mount, i.e., another file system than the venv
+            ("UV_LINK_MODE", "copy"),
+        ],
+        "cache_dir": "/root/.cache/uv",
+        "no_cache": "--no-cache",
+        # pip compiles by default, uv does not
+        "compile": "--compile-bytecode",
+        "no_compile": "",
+    },
+}
+
+
+def prepare_context(context_path: str, wheel_file: str, **kwargs) -> Dict[str, str]:
+    """
+    Write the build context for ``wheel_file`` to ``context_path``. See
+    ``render_context`` for the supported arguments. Returns the secrets to pass to
+    ``build_image``.
+    """
+    context_files, secrets = render_context(wheel_file, **kwargs)
+    stage_files(context_path, context_files)
+    return secrets
+
+
+def render_context(
     wheel_file: str,
-    base_image: str = "python:3.8-slim-bullseye",
+    base_image: str = DEFAULT_BASE_IMAGE,
     extra_os_packages: List[str] = [],
     builder_extra_os_packages: List[str] = [],
     requirements_file: Optional[str] = None,
@@ -31,37 +133,157 @@ def prepare_context(
     pip_cache: bool = True,
     env_vars: List[Tuple[str, str]] = [],
     pip_extra_args: Optional[str] = None,
-) -> Dict[str, str]:
-    pathlib.Path(context_path).mkdir(parents=True, exist_ok=True)
+    split_layers: bool = False,
+    wheelhouse: Dict[str, str] = {},
+    compile_bytecode: bool = False,
+    bytecode_only_dependencies: bool = False,
+    prune_venv: bool = False,
+    prune_rules: Optional[List[str]] = None,
+    prune_include: List[str] = [],
+    prune_exclude: List[str] = [],
+    strip_shared_objects: bool = False,
+    lock_file: Optional[str] = None,
+    platform_wheels: Dict[str, str] = {},
+    platform_wheelhouses: Dict[str, Dict[str, str]] = {},
+    native_build: bool = False,
+    native_build_jobs: Optional[int] = None,
+    runtime_profile: str = "default",
+    template: Optional[str] = None,
+    extra_files: List[Tuple[str, str]] = [],
+    minimal_runtime: bool = False,
+    installer: str = "pip",
+    index_proxy_url: Optional[str] = None,
+    use_wheelhouse: Optional[bool] = None,
+) -> Tuple[Dict[str, StagingSource], Dict[str, str]]:
+    """
+    Files of the build context incl. the rendered Dockerfile, mapped from their
+    name within the context to their source, and the secrets needed for building.
 
-    entrypoint_script = os.path.join(
-        os.path.dirname(os.path.realpath(__file__)), "docker-entrypoint.sh"
-    )
+    For multi-platform builds, ``platform_wheels`` maps each platform (e.g.
+    ``linux/arm64``) to the wheel to install and ``platform_wheelhouses`` to its
+    wheelhouse. The build then selects them via ``TARGETPLATFORM``.
+    ``use_wheelhouse`` (by default, whether a wheelhouse is given) installs from
+    the wheelhouse only, e.g., for planning before the wheelhouse gets filled.
+
+    A custom ``template`` can extend ``Dockerfile.j2`` and override its blocks
+    ``builder_setup``, ``stages``, ``runtime_setup`` and ``entrypoint``.
+    ``extra_files`` are pairs of a file on the host and its destination in the
+    image.
+
+    With ``minimal_runtime`` the final stage gets neither apt nor a shell: the
+    interpreter, the venv and the shared libraries they need get copied from the
+    builder onto a distroless base (unless ``base_image`` is set) and a python
+    launcher replaces ``docker-entrypoint.sh``.
 
-    # copy wheel and other files
-    for to_copy in [str(entrypoint_script), wheel_file]:
-        shutil.copy(to_copy, context_path)
+    ``installer`` selects the installer of the builder stage, one of
+    ``INSTALLERS``. Index, secret and ``pip_extra_args`` get passed to it as is.
+
+    With ``index_proxy_url`` dependencies get installed from an ``IndexProxy`` of
+    the index instead, passed as secret, i.e., without affecting the layer cache.
+    """
+    if runtime_profile not in RUNTIME_PROFILES:
+        raise Exception(f"Invalid runtime profile: {runtime_profile}")
+
+    if installer not in INSTALLERS:
+        raise Exception(f"Invalid installer: {installer}")
+
+    if minimal_runtime:
+        if extra_os_packages or RUNTIME_PROFILES[runtime_profile]["packages"]:
+            raise Exception(
+                "minimal-runtime supports neither extra-os-packages nor runtime "
+                "profiles installing packages"
+            )
+        if base_image == DEFAULT_BASE_IMAGE:
+            base_image = MINIMAL_BASE_IMAGE
+        entrypoint_file = LAUNCHER_FILE
+        launcher = ["/app/venv/bin/python", "-S", f"/app/{LAUNCHER_FILE}"]
+    else:
+        entrypoint_file = "docker-entrypoint.sh"
+        launcher = ["/app/docker-entrypoint.sh"]
+
+    context_files: Dict[str, StagingSource] = {
+        entrypoint_file: os.path.join(
+            os.path.dirname(os.path.realpath(__file__)), entrypoint_file
+        ),
+    }
+
+    if platform_wheels:
+        for platform, platform_wheel in platform_wheels.items():
+            name = (
+                f"{PLATFORM_WHEELS_DIR}/{platform}/{os.path.basename(platform_wheel)}"
+            )
+            context_files[name] = platform_wheel
+    else:
+        context_files[os.path.basename(wheel_file)] = wheel_file
+
+    if lock_file:
+        # the lock already covers the requirements file and those of the wheel
+        requirements_file = None
+        context_files[os.path.basename(lock_file)] = lock_file
 
     if requirements_file:
-        shutil.copy(requirements_file, context_path)
+        context_files[os.path.basename(requirements_file)] = requirements_file
 
     for init_script in init_scripts:
-        shutil.copy(init_script, context_path)
+        context_files[os.path.basename(init_script)] = init_script
 
-    entrypoint_exec_form = (
-        str(["/app/docker-entrypoint.sh"] + entrypoint).replace("'", '"')
-        if entrypoint
-        else None
-    )
+    extra_file_dests = []
+    for i, (source, dest) in enumerate(extra_files):
+        name = f"{EXTRA_FILES_DIR}/{i}/{os.path.basename(source)}"
+        context_files[name] = source
+        extra_file_dests.append((name, dest))
+
+    for wheel_name, wheel_path in wheelhouse.items():
+        context_files[f"{WHEELHOUSE_DIR}/{wheel_name}"] = wheel_path
+
+    for platform, platform_wheelhouse in platform_wheelhouses.items():
+        for wheel_name, wheel_path in platform_wheelhouse.items():
+            context_files[f"{WHEELHOUSE_DIR}/{platform}/{wheel_name}"] = wheel_path
+
+    needs_venvtool = bytecode_only_dependencies or prune_venv or minimal_runtime
+    if needs_venvtool:
+        context_files[VENVTOOL_FILE] = os.path.join(
+            os.path.dirname(os.path.realpath(__file__)), VENVTOOL_FILE
+        )
+
+    if use_wheelhouse is None:
+        use_wheelhouse = bool(wheelhouse or platform_wheelhouses)
+
+    if use_wheelhouse:
+        # everything gets installed from the wheelhouse, no need for the index
+        index_url = index_username = index_password = None
+
+    if index_proxy_url and index_url:
+        # the proxy authenticates against the index
+        index_url = f"$(cat /run/secrets/{INDEX_URL_SECRET_NAME})"
+        index_username = index_password = None
+    else:
+        index_proxy_url = None
+
+    if native_build:
+        if not pip_cache:
+            # built wheels get cached by pip
+            raise Exception("native_build requires pip_cache")
+        builder_extra_os_packages = builder_extra_os_packages + ["ccache"]
+
+    if split_layers and not lock_file:
+        # dependencies get installed in a step of their own, which is only
+        # invalidated if the requirements of the wheel change
+        context_files[WHEEL_REQUIREMENTS_FILE] = "".join(
+            r + "\n" for r in wheel_requirements(wheel_file, extra_requires)
+        ).encode()
+
+    entrypoint_exec_form = str(launcher + (entrypoint or ["python"])).replace("'", '"')
     command_exec_form = str(command).replace("'", '"') if command else None
     init_scripts_base = list(map(lambda s: os.path.basename(s), init_scripts))
 
-    index_url_with_auth = _render_index_url(index_url, index_username, index_password)
+    index_url_with_auth = (
+        index_url
+        if index_proxy_url
+        else _render_index_url(index_url, index_username, index_password)
+    )
 
-    dockerfile_template = Environment(
-        loader=FileSystemLoader(searchpath=os.path.dirname(os.path.realpath(__file__))),
-        trim_blocks=True,
-    ).get_template("Dockerfile.j2")
+    dockerfile_template = _template(template)
 
     requirements_file_basename = (
         os.path.basename(requirements_file) if requirements_file else None
@@ -71,14 +293,35 @@ def prepare_context(
         extra_requires = "[" + ",".join(extra_requires) + "]"
 
     dockerfile = dockerfile_template.render(
-        wheel_file=os.path.basename(wheel_file),
+        wheel_file=(
+            # the wheel of the target platform, expanded by the shell
+            f"$(echo {PLATFORM_WHEELS_DIR}/*.whl)"
+            if platform_wheels
+            else os.path.basename(wheel_file)
+        ),
+        per_platform=bool(platform_wheels),
+        installer=INSTALLERS[installer],
+        minimal_runtime=minimal_runtime,
+        entrypoint_file=entrypoint_file,
+        runtime_closure_dir=RUNTIME_CLOSURE_DIR,
+        extra_files=extra_file_dests,
+        runtime_profile=RUNTIME_PROFILES[runtime_profile],
+        native_build_env=(
+            _native_build_env(native_build_jobs) if native_build else None
+        ),
+        platform_wheels_dir=PLATFORM_WHEELS_DIR,
         extra_requires=extra_requires,
         base_image=base_image,
         extra_os_packages=extra_os_packages,
         builder_extra_os_packages=builder_extra_os_packages,
         requirements_file=requirements_file_basename,
+        lock_file=os.path.basename(lock_file) if lock_file else None,
         index_url=index_url_with_auth,
-        index_url_needs_secret=index_password is not None,
+        index_secret=(
+            INDEX_URL_SECRET_NAME
+            if index_proxy_url
+            else INDEX_SECRET_NAME if index_password is not None else None
+        ),
         pip_extra_args=pip_extra_args,
         init_scripts_base=init_scripts_base,
         entrypoint_exec_form=entrypoint_exec_form,
@@ -86,19 +329,92 @@ def prepare_context(
         user_id=user_id,
         pip_cache=pip_cache,
         env_vars=env_vars,
+        split_layers=split_layers,
+        wheel_requirements_file=WHEEL_REQUIREMENTS_FILE,
+        wheelhouse=WHEELHOUSE_DIR if use_wheelhouse else None,
+        compile_bytecode=compile_bytecode or bytecode_only_dependencies,
+        bytecode_only_dependencies=bytecode_only_dependencies,
+        venvtool=VENVTOOL_FILE if needs_venvtool else None,
+        prune_args=(
+            _prune_args(prune_rules, prune_include, prune_exclude, strip_shared_objects)
+            if prune_venv
+            else None
+        ),
+        dist_name=wheel_dist_name(wheel_file) if bytecode_only_dependencies else None,
     ).replace("__BS__", "\\")
 
-    # write Dockerfile
-    with open(os.path.join(context_path, "Dockerfile"), "w") as dockerfile_f:
-        dockerfile_f.write(dockerfile)
+    context_files["Dockerfile"] = dockerfile.encode()
+    # allowlist, so that nothing else in the context dir gets sent to docker
+    context_files[DOCKERIGNORE_FILE] = dockerignore(
+        list(context_files) + [DOCKERIGNORE_FILE]
+    )
 
-    return (
+    if index_proxy_url:
+        return context_files, {INDEX_URL_SECRET_NAME: index_proxy_url}
+    return context_files, (
         {INDEX_SECRET_NAME: urllib.parse.quote(index_password, safe="")}
         if index_password
         else {}
     )
 
 
+def _template(template: Optional[str] = None) -> Template:
+    """The Dockerfile template or a custom one extending it."""
+    package_dir = os.path.dirname(os.path.realpath(__file__))
+    if template is None:
+        return _template_environment((package_dir,)).get_template(DOCKERFILE_TEMPLATE)
+
+    template_dir, template_name = os.path.split(os.path.realpath(template))
+    if template_name == DOCKERFILE_TEMPLATE:
+        raise Exception(f"Custom template must not be named {DOCKERFILE_TEMPLATE}")
+    return _template_environment((template_dir, package_dir)).get_template(
+        template_name
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def _template_environment(search_path: Tuple[str, ...]) -> Environment:
+    # templates get compiled once per process (and reloaded if changed), the
+    # bytecode cache saves compiling them in each process
+    return Environment(
+        loader=FileSystemLoader(searchpath=list(search_path)),
+        trim_blocks=True,
+        bytecode_cache=FileSystemBytecodeCache(),
+    )
+
+
+def _native_build_env(jobs: Optional[int]) -> str:
+    # evaluated by the shell, i.e., scales with the cores of the builder
+    jobs_expr = str(jobs) if jobs else "$(nproc)"
+    return " ".join(
+        f'{var}="{value}"'
+        for var, value in [
+            ("MAKEFLAGS", f"-j{jobs_expr}"),
+            ("NPY_NUM_BUILD_JOBS", jobs_expr),
+            ("CMAKE_BUILD_PARALLEL_LEVEL", jobs_expr),
+            ("MAX_JOBS", jobs_expr),
+        ]
+    )
+
+
+def _prune_args(
+    rules: Optional[List[str]],
+    include: List[str],
+    exclude: List[str],
+    strip: bool,
+) -> str:
+    args = []
+    for rule in rules if rules is not None else PRUNE_RULES_DEFAULT:
+        args += ["--rule", rule]
+    for glob in include:
+        args += ["--include", glob]
+    for glob in exclude:
+        args += ["--exclude", glob]
+    if strip:
+        args.append("--strip")
+    return " ".join(shlex.quote(a) for a in args)
+
+
 def build_image(
     context_path: str,
     image_name: str,
@@ -106,18 +422,25 @@ def build_image(
     secrets: Dict[str, str] = {},
     target: Optional[str] = None,
     extra_docker_args: List[str] = [],
+    log_prefix: Optional[str] = None,
+    progress: Optional[str] = None,
+    output_handler: Optional[Callable[[str], None]] = None,
+    cache_from: List[str] = [],
+    cache_to: Optional[str] = None,
+    platforms: List[str] = [],
+    push: bool = False,
 ):
     subprocess_env = secrets.copy()
     subprocess_env["PATH"] = os.environ["PATH"]
     subprocess_env["USER"] = os.environ["USER"]
     subprocess_env["HOME"] = os.environ["HOME"]
     subprocess_env["DOCKER_BUILDKIT"] = "1"
-    subprocess.run(
-        [
-            "docker",
-            "build",
-        ]
+    if "BUILDX_BUILDER" in os.environ:
+        subprocess_env["BUILDX_BUILDER"] = os.environ["BUILDX_BUILDER"]
+    args = (
+        _build_command(cache_from, cache_to, platforms, push)
         + (["--target", target] if target else [])
+        + ([f"--progress={progress}"] if progress else [])
         + _secrets_args(secrets)
         + extra_docker_args
         + [
@@ -126,8 +449,94 @@ def build_image(
             "-t",
             f"{image_name}:{image_tag}",
             str(context_path),
-        ],
+        ]
+    )
+
+    if log_prefix is None and output_handler is None:
+        subprocess.run(args, env=subprocess_env).check_returncode()
+        return
+
+    # prefix output, so that output of parallel builds can be told apart
+    with subprocess.Popen(
+        args,
         env=subprocess_env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+    ) as process:
+        for line in process.stdout:
+            if output_handler:
+                output_handler(line)
+            sys.stdout.write(f"[{log_prefix}] {line}" if log_prefix else line)
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, args)
+
+
+def _build_command(
+    cache_from: List[str],
+    cache_to: Optional[str],
+    platforms: List[str] = [],
+    push: bool = False,
+) -> List[str]:
+    if not cache_from and not cache_to and not platforms and not push:
+        return ["docker", "build"]
+
+    # cache import/export and multi-platform builds are only supported by buildx,
+    # which does not load the image into the local image store by default
+    return (
+        ["docker", "buildx", "build", "--push" if push else "--load"]
+        + (["--platform", ",".join(platforms)] if platforms else [])
+        + [arg for spec in cache_from for arg in ["--cache-from", spec]]
+        + (["--cache-to", cache_to] if cache_to else [])
+    )
+
+
+def cache_spec(
+    spec: str, image_name: str, image_tag: str, local_dir: str, export: bool = False
+) -> str:
+    """
+    Expand the shorthands ``registry``, ``local`` and ``inline`` of a
+    ``--cache-from``/``--cache-to`` spec to a full spec for ``image_name``. Full
+    specs (``type=...``) are passed unchanged.
+    """
+    if spec == "registry":
+        spec = f"type=registry,ref={image_name}:buildcache"
+        return spec + ",mode=max" if export else spec
+    elif spec == "local":
+        return (
+            f"type=local,dest={local_dir},mode=max"
+            if export
+            else f"type=local,src={local_dir}"
+        )
+    elif spec == "inline":
+        # the cache gets embedded into the image, i.e., imported from the image
+        return (
+            "type=inline" if export else f"type=registry,ref={image_name}:{image_tag}"
+        )
+    elif spec.startswith("type=") or "=" not in spec:
+        # full spec or plain image reference
+        return spec
+    else:
+        raise Exception(f"Invalid cache spec: {spec}")
+
+
+def image_id(image: str) -> Optional[str]:
+    """Id of a local image or None if it does not exist."""
+    try:
+        res = subprocess.run(
+            ["docker", "image", "inspect", "--format", "{{.Id}}", image],
+            capture_output=True,
+            text=True,
+        )
+    except FileNotFoundError:
+        # no docker cli, e.g., when talking to the engine api directly
+        return None
+    return res.stdout.strip() if res.returncode == 0 else None
+
+
+def tag_image(image: str, image_name: str, image_tag: str) -> None:
+    subprocess.run(
+        ["docker", "tag", image, f"{image_name}:{image_tag}"]
     ).check_returncode()
 
 
@@ -162,6 +571,24 @@ def _render_index_url(
         )
 
 
+def render_host_index_url(
+    url: Optional[str], user: Optional[str], password: Optional[str]
+) -> Optional[str]:
+    # pip runs on the host here, so credentials can go into the url directly
+    if url is None:
+        return None
+    f = furl(url)
+
+    if not f.scheme:
+        f.scheme = "https"
+    if user:
+        f.username = user
+    if password:
+        f.password = password
+
+    return str(f)
+
+
 def _rand_pw_placeholder(url: str) -> str:
     s = "PASSWORD"
     while url.count(s) > 0:
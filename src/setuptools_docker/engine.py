@@ -0,0 +1,130 @@
+import http.client
+import json
+import os
+import socket
+import sys
+import tarfile
+import urllib.parse
+from typing import Dict, Iterator, Optional
+
+from .staging import StagingSource
+
+DEFAULT_DOCKER_HOST = "unix:///var/run/docker.sock"
+
+_CHUNK_SIZE = 1024 * 1024
+
+
+def build_image_streamed(
+    context_files: Dict[str, StagingSource],
+    image_name: str,
+    image_tag: str,
+    docker_host: Optional[str] = None,
+    target: Optional[str] = None,
+    log_prefix: Optional[str] = None,
+) -> Optional[str]:
+    """
+    Build an image via the /build endpoint of the docker engine, streaming the
+    context as tar generated on the fly from ``context_files``, i.e., without
+    writing a context directory.
+
+    The endpoint uses the classic builder, which supports neither secrets nor cache
+    mounts. Returns the id of the built image.
+    """
+    query = {"t": f"{image_name}:{image_tag}", "dockerfile": "Dockerfile", "rm": "1"}
+    if target:
+        query["target"] = target
+
+    conn = _connection(
+        docker_host or os.environ.get("DOCKER_HOST", DEFAULT_DOCKER_HOST)
+    )
+    try:
+        conn.request(
+            "POST",
+            f"/build?{urllib.parse.urlencode(query)}",
+            body=iter_context_tar(context_files),
+            headers={"Content-Type": "application/x-tar"},
+            encode_chunked=True,
+        )
+        response = conn.getresponse()
+        if response.status != 200:
+            raise Exception(
+                f"Docker engine build failed ({response.status}): "
+                f"{response.read().decode(errors='replace')}"
+            )
+
+        built_image = None
+        for message in _iter_json_messages(response):
+            if "error" in message:
+                raise Exception(f"Docker engine build failed: {message['error']}")
+            if "stream" in message:
+                for line in message["stream"].splitlines(keepends=True):
+                    sys.stdout.write(f"[{log_prefix}] {line}" if log_prefix else line)
+            if "aux" in message and "ID" in message["aux"]:
+                built_image = message["aux"]["ID"]
+
+        return built_image
+    finally:
+        conn.close()
+
+
+def iter_context_tar(context_files: Dict[str, StagingSource]) -> Iterator[bytes]:
+    """Lazily generate a tar stream of ``context_files`` in chunks."""
+    for name in sorted(context_files):
+        source = context_files[name]
+        info = tarfile.TarInfo(name)
+        if isinstance(source, bytes):
+            info.size = len(source)
+            info.mode = 0o644
+        else:
+            stat = os.stat(source)
+            info.size = stat.st_size
+            info.mode = stat.st_mode & 0o777
+            info.mtime = int(stat.st_mtime)
+        yield info.tobuf(format=tarfile.PAX_FORMAT)
+
+        if isinstance(source, bytes):
+            yield source
+        else:
+            with open(source, "rb") as f:
+                for chunk in iter(lambda: f.read(_CHUNK_SIZE), b""):
+                    yield chunk
+
+        if info.size % tarfile.BLOCKSIZE:
+            yield tarfile.NUL * (tarfile.BLOCKSIZE - info.size % tarfile.BLOCKSIZE)
+
+    # end of archive marker
+    yield tarfile.NUL * (2 * tarfile.BLOCKSIZE)
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path: str) -> None:
+        super().__init__("localhost")
+        self.socket_path = socket_path
+
+    def connect(self) -> None:
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.socket_path)
+
+
+def _connection(docker_host: str) -> http.client.HTTPConnection:
+    url = urllib.parse.urlparse(docker_host)
+    if url.scheme == "unix":
+        return _UnixHTTPConnection(url.path)
+    elif url.scheme in ["tcp", "http"]:
+        return http.client.HTTPConnection(url.hostname, url.port or 2375)
+    else:
+        raise Exception(f"Unsupported docker host: {docker_host}")
+
+
+def _iter_json_messages(response: http.client.HTTPResponse) -> Iterator[Dict]:
+    decoder = json.JSONDecoder()
+    buffer = ""
+    for line in response:
+        buffer += line.decode()
+        while buffer.strip():
+            try:
+                message, end = decoder.raw_decode(buffer.lstrip())
+            except json.JSONDecodeError:
+                break
+            yield message
+            buffer = buffer.lstrip()[end:]
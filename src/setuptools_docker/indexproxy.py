@@ -0,0 +1,258 @@
+import base64
+import hashlib
+import html
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+
+from distutils import log
+
+# project pages are revalidated after this many seconds, files never change
+PAGE_TTL = 600
+
+
+class IndexProxy:
+    """
+    Caching proxy of a simple index (PEP 503) on the host, e.g., for sharing
+    downloads between the builds of an agent. Credentials of the upstream index
+    stay on the host, builds talk to the proxy without authentication.
+
+    Project pages and files are cached in ``cache_dir``, files are evicted least
+    recently used first once the cache exceeds ``max_size`` bytes. If the
+    upstream index is unavailable, cached project pages are served even if
+    outdated. Use as context manager, which yields the url of the proxy.
+
+    Credentials only get sent to the host of the upstream index. Only files
+    linked from a project page served by the proxy can be downloaded via it.
+    """
+
+    def __init__(
+        self,
+        upstream_url: str,
+        cache_dir: str,
+        username: Optional[str] = None,
+        password: Optional[str] = None,
+        max_size: int = 2 * 1024**3,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ) -> None:
+        self.upstream_url = upstream_url.rstrip("/") + "/"
+        self.cache_dir = cache_dir
+        self.username = username
+        self.password = password
+        self.max_size = max_size
+        self._address = (host, port)
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._evict_lock = threading.Lock()
+        # upstream urls of the files linked from served pages, by token
+        self._file_urls: Dict[str, str] = {}
+        self._opener = urllib.request.build_opener(_RedirectHandler())
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/simple/"
+
+    def __enter__(self) -> str:
+        os.makedirs(os.path.join(self.cache_dir, "pages"), exist_ok=True)
+        os.makedirs(os.path.join(self.cache_dir, "files"), exist_ok=True)
+        self._server = ThreadingHTTPServer(self._address, _ProxyHandler)
+        self._server.daemon_threads = True
+        self._server.proxy = self
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        log.info(f"index proxy for {self.upstream_url} listening on {self.url}")
+        return self.url
+
+    def __exit__(self, *exc_info) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def project_page(self, project: str) -> bytes:
+        """Page of ``project`` with links rewritten to files of the proxy."""
+        path = os.path.join(self.cache_dir, "pages", _normalize(project) + ".html")
+        links_path = os.path.join(
+            self.cache_dir, "pages", _normalize(project) + ".json"
+        )
+        try:
+            age = time.time() - os.path.getmtime(path)
+            os.stat(links_path)
+        except FileNotFoundError:
+            age = None
+
+        if age is None or age > PAGE_TTL:
+            page_url = urllib.parse.urljoin(self.upstream_url, f"{project}/")
+            try:
+                page = self._fetch(page_url, headers={"Accept": "text/html"})
+            except OSError as e:
+                # client errors, e.g., an unknown project, are no outage of the index
+                client_error = isinstance(e, urllib.error.HTTPError) and e.code < 500
+                if age is None or client_error:
+                    raise
+                log.warn(f"index unavailable, serving cached {project}: {e}")
+            else:
+                rewritten, links = _rewrite_links(page.decode(), page_url)
+                _write_atomic(links_path, json.dumps(links).encode())
+                _write_atomic(path, rewritten.encode())
+
+        with open(links_path) as f:
+            self._file_urls.update(json.load(f))
+        with open(path, "rb") as f:
+            return f.read()
+
+    def file_url(self, token: str) -> Optional[str]:
+        """Upstream url of a file linked from a served page, None if unknown."""
+        return self._file_urls.get(token)
+
+    def file(self, upstream_url: str) -> str:
+        """Path of the cached file downloaded from ``upstream_url``."""
+        name = _token(upstream_url)
+        path = os.path.join(self.cache_dir, "files", name)
+        if os.path.exists(path):
+            # mtime as last access, atime is often not updated
+            os.utime(path)
+            return path
+
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, "wb") as f, self._open(upstream_url) as response:
+                shutil.copyfileobj(response, f)
+            os.replace(tmp, path)
+        except BaseException:
+            os.remove(tmp)
+            raise
+        self.evict()
+        return path
+
+    def evict(self) -> None:
+        """Remove least recently used files until the cache fits ``max_size``."""
+        with self._evict_lock:
+            files_dir = os.path.join(self.cache_dir, "files")
+            entries = [
+                (e.stat().st_mtime, e.stat().st_size, e.path)
+                for e in os.scandir(files_dir)
+                if e.is_file()
+            ]
+            size = sum(e[1] for e in entries)
+            for _, file_size, path in sorted(entries):
+                if size <= self.max_size:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                size -= file_size
+
+    def _fetch(self, url: str, headers: dict = {}) -> bytes:
+        with self._open(url, headers) as response:
+            return response.read()
+
+    def _open(self, url: str, headers: dict = {}):
+        request = urllib.request.Request(url, headers=dict(headers))
+        upstream_netloc = urllib.parse.urlsplit(self.upstream_url).netloc
+        if self.username and urllib.parse.urlsplit(url).netloc == upstream_netloc:
+            credentials = f"{self.username}:{self.password or ''}"
+            request.add_header(
+                "Authorization",
+                f"Basic {base64.b64encode(credentials.encode()).decode()}",
+            )
+        return self._opener.open(request, timeout=60)
+
+
+class _RedirectHandler(urllib.request.HTTPRedirectHandler):
+    """Drops the credentials on redirects to other hosts, e.g., to a cdn."""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        new = super().redirect_request(req, fp, code, msg, headers, newurl)
+        if new is not None and (
+            urllib.parse.urlsplit(newurl).netloc
+            != urllib.parse.urlsplit(req.full_url).netloc
+        ):
+            new.remove_header("Authorization")
+        return new
+
+
+class _ProxyHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        proxy: IndexProxy = self.server.proxy
+        try:
+            m = re.fullmatch(r"/simple/([^/]+)/?", self.path)
+            if m:
+                self._send(proxy.project_page(m.group(1)), "text/html")
+                return
+            m = re.fullmatch(r"/files/([^/]+)/([^/]+)", self.path)
+            upstream_url = m and proxy.file_url(m.group(1))
+            if upstream_url:
+                if m.group(2).endswith(".metadata"):
+                    # metadata of the file (PEP 658)
+                    upstream_url += ".metadata"
+                path = proxy.file(upstream_url)
+                self.send_response(200)
+                self.send_header("Content-Type", "application/octet-stream")
+                self.send_header("Content-Length", str(os.path.getsize(path)))
+                self.end_headers()
+                with open(path, "rb") as f:
+                    shutil.copyfileobj(f, self.wfile)
+                return
+            self._send(b"", "text/plain", 404)
+        except urllib.error.HTTPError as e:
+            self._send(b"", "text/plain", e.code)
+        except OSError as e:
+            log.warn(f"index proxy failed for {self.path}: {e}")
+            self._send(b"", "text/plain", 502)
+
+    def _send(self, body: bytes, content_type: str, status: int = 200) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def _rewrite_links(page: str, page_url: str) -> Tuple[str, Dict[str, str]]:
+    """
+    Point the links of a project page to the proxy, keeping hash fragments.
+    Returns the page and the upstream urls of the links by token.
+    """
+    links = {}
+
+    def rewrite(m: "re.Match") -> str:
+        href = next(g for g in m.groups() if g is not None)
+        url, _, fragment = html.unescape(href).partition("#")
+        url = urllib.parse.urljoin(page_url, url)
+        filename = urllib.parse.unquote(url.rsplit("/", 1)[-1].split("?")[0])
+        links[_token(url)] = url
+        proxied = f"/files/{_token(url)}/{urllib.parse.quote(filename)}"
+        return (
+            'href="' + html.escape(proxied + ("#" + fragment if fragment else "")) + '"'
+        )
+
+    # double, single or unquoted attribute values
+    href = r"""\bhref\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'>]+))"""
+    return re.sub(href, rewrite, page, flags=re.I), links
+
+
+def _token(url: str) -> str:
+    return hashlib.sha256(url.encode()).hexdigest()
+
+
+def _write_atomic(path: str, content: bytes) -> None:
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, "wb") as f:
+        f.write(content)
+    os.replace(tmp, path)
+
+
+def _normalize(name: str) -> str:
+    return re.sub(r"[-_.]+", "-", name).lower()
@@ -0,0 +1,133 @@
+"""
+Entrypoint of minimal runtime images, which have neither bash nor a shell at all.
+Runs the init scripts in $INIT_DIR like docker-entrypoint.sh and then replaces
+itself with the command. This module is copied into the image and executed by its
+python (with -S), so it must only use the standard library.
+
+Init scripts must be executable, e.g., python scripts with a
+``#!/app/venv/bin/python`` shebang, as without a shell they can not be sourced.
+"""
+
+import json
+import os
+import re
+import signal
+import subprocess
+import sys
+import time
+from typing import List, Optional, Tuple
+
+DEFAULT_INIT_DIR = "/app/init.d"
+
+
+def init_phases(init_dir: str) -> List[Tuple[str, List[str]]]:
+    """
+    Init scripts grouped into phases, sorted by name. Consecutive scripts with the
+    same number prefix form a phase, scripts without prefix a phase of their own.
+    """
+    if not os.path.isdir(init_dir):
+        return []
+
+    phases: List[Tuple[str, List[str]]] = []
+    for name in sorted(os.listdir(init_dir)):
+        if name.startswith("."):
+            continue
+        m = re.match(r"(\d+)[-_]", name)
+        phase = m.group(1) if m else ""
+        if phases and phase and phases[-1][0] == phase:
+            phases[-1][1].append(os.path.join(init_dir, name))
+        else:
+            phases.append((phase, [os.path.join(init_dir, name)]))
+    return phases
+
+
+def run_phase(phase: str, scripts: List[str], parallel: bool = False) -> int:
+    """Run the scripts of a phase, stopping all of them on the first failure."""
+    for script in scripts:
+        if not os.access(script, os.X_OK):
+            _log(script, phase, 1, time.monotonic(), "not executable")
+            return 1
+
+    if not parallel and len(scripts) > 1:
+        for script in scripts:
+            # a single script runs like a phase of its own
+            rc = run_phase(phase, [script], parallel=True)
+            if rc:
+                return rc
+        return 0
+
+    running = {}
+    for script in scripts:
+        # own session per script, so that it can be stopped incl. children
+        process = subprocess.Popen([script], start_new_session=True)
+        running[process.pid] = (process, script, time.monotonic())
+
+    rc = 0
+    while running:
+        pid, status = os.wait()
+        if pid not in running:
+            continue
+        process, script, start = running.pop(pid)
+        # like the shell, 128 + signal for scripts killed by a signal
+        process.returncode = (
+            128 + os.WTERMSIG(status)
+            if os.WIFSIGNALED(status)
+            else os.WEXITSTATUS(status)
+        )
+        _log(script, phase, process.returncode, start)
+        if process.returncode:
+            rc = process.returncode
+            _stop([p for p, _, _ in running.values()])
+            break
+    return rc
+
+
+def main(args: Optional[List[str]] = None) -> None:
+    args = sys.argv[1:] if args is None else args
+    parallel = os.environ.get("INIT_PARALLEL") == "1"
+    for phase, scripts in init_phases(os.environ.get("INIT_DIR", DEFAULT_INIT_DIR)):
+        rc = run_phase(phase, scripts, parallel)
+        if rc:
+            sys.exit(rc)
+
+    if args:
+        sys.stdout.flush()
+        os.execvp(args[0], args)
+
+
+def _stop(processes: List[subprocess.Popen]) -> None:
+    for process in processes:
+        try:
+            os.killpg(process.pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    for process in processes:
+        process.wait()
+
+
+def _log(
+    script: str, phase: str, exit_code: int, start: float, error: str = ""
+) -> None:
+    duration_ms = int((time.monotonic() - start) * 1000)
+    if os.environ.get("INIT_LOG_FORMAT") == "json":
+        record = {
+            "event": "init_script",
+            "script": script,
+            "phase": phase,
+            "exit_code": exit_code,
+            "duration_ms": duration_ms,
+        }
+        if error:
+            record["error"] = error
+        print(json.dumps(record), flush=True)
+    else:
+        detail = f" ({error})" if error else ""
+        print(
+            f"{sys.argv[0]}: {script} exited with {exit_code} after "
+            f"{duration_ms}ms{detail}",
+            flush=True,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,466 @@
+import gzip
+import hashlib
+import io
+import json
+import os
+import pathlib
+import platform
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+from typing import IO, Dict, List, Optional, Tuple, Union
+
+from .docker import render_host_index_url
+from .wheels import wheel_requirements
+
+MEDIA_TYPE_INDEX = "application/vnd.oci.image.index.v1+json"
+MEDIA_TYPE_MANIFEST = "application/vnd.oci.image.manifest.v1+json"
+MEDIA_TYPE_CONFIG = "application/vnd.oci.image.config.v1+json"
+MEDIA_TYPE_LAYER = "application/vnd.oci.image.layer.v1.tar+gzip"
+DOCKER_MEDIA_TYPE_MANIFEST_LIST = (
+    "application/vnd.docker.distribution.manifest.list.v2+json"
+)
+
+REF_NAME_ANNOTATION = "org.opencontainers.image.ref.name"
+
+SITE_PACKAGES_PATH = "app/site-packages"
+PACKAGES_PATH = "app/packages"
+
+# source of a file within a layer: either a path on the host or literal content
+LayerSource = Union[str, bytes]
+
+
+def build_oci_image(
+    output: str,
+    base_layout: str,
+    wheel_file: str,
+    image_name: str,
+    image_tag: str,
+    requirements_file: Optional[str] = None,
+    extra_requires: List[str] = [],
+    index_url: Optional[str] = None,
+    index_username: Optional[str] = None,
+    index_password: Optional[str] = None,
+    init_scripts: List[str] = [],
+    entrypoint: List[str] = [],
+    command: List[str] = [],
+    user_id: Optional[int] = None,
+    env_vars: List[Tuple[str, str]] = [],
+    pip_extra_args: Optional[str] = None,
+    base_ref: Optional[str] = None,
+    python_version: Optional[str] = None,
+    platforms: List[str] = [],
+) -> str:
+    """
+    Assemble an image without docker daemon and write it as oci image layout.
+
+    Dependencies, the wheel itself and the scripts end up in separate layers. The
+    python packages get installed on the host via pip, thus this is limited to
+    wheels. They get selected for ``python_version`` and the pip ``platforms`` of the
+    base image, which default to those of the host. The base image needs to be
+    available as local oci image layout, e.g., created with
+    `skopeo copy docker://python:3.8-slim-bullseye oci:base`.
+
+    If ``output`` ends with ``.tar`` an oci archive gets written, otherwise a
+    layout directory. Returns the digest of the written manifest.
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        host_index_url = render_host_index_url(
+            index_url, index_username, index_password
+        )
+        # dependencies, application and scripts go into separate layers, so that
+        # the (large) dependency layer stays the same if only the application changes
+        site_packages = os.path.join(tmp_dir, "site-packages")
+        _pip_install_target(
+            site_packages,
+            (["-r", requirements_file] if requirements_file else [])
+            + wheel_requirements(wheel_file, extra_requires),
+            index_url=host_index_url,
+            pip_extra_args=pip_extra_args,
+            python_version=python_version,
+            platforms=platforms,
+        )
+        packages = os.path.join(tmp_dir, "packages")
+        _pip_install_target(
+            packages,
+            [wheel_file],
+            index_url=host_index_url,
+            pip_extra_args=pip_extra_args,
+            python_version=python_version,
+            platforms=platforms,
+            no_deps=True,
+        )
+
+        layers = [
+            _tree_files(site_packages, SITE_PACKAGES_PATH),
+            _app_files(init_scripts),
+            _tree_files(packages, PACKAGES_PATH),
+        ]
+
+        layout_dir = (
+            os.path.join(tmp_dir, "layout") if output.endswith(".tar") else output
+        )
+        digest = write_image_layout(
+            layout_dir,
+            base_layout,
+            layers,
+            ref_name=f"{image_name}:{image_tag}",
+            config_overrides=_config_overrides(entrypoint, command, user_id, env_vars),
+            base_ref=base_ref,
+        )
+
+        if output.endswith(".tar"):
+            pathlib.Path(output).parent.mkdir(parents=True, exist_ok=True)
+            with open(output, "wb") as output_f:
+                write_layer_tar(output_f, _tree_files(layout_dir, ""))
+
+    return digest
+
+
+def write_image_layout(
+    layout_dir: str,
+    base_layout: str,
+    layers: List[Dict[str, LayerSource]],
+    ref_name: str,
+    config_overrides: Dict = {},
+    base_ref: Optional[str] = None,
+) -> str:
+    """
+    Write an oci image layout consisting of the image from ``base_layout`` extended by
+    ``layers``. Each layer is given as a mapping from path within the image to its
+    source. Returns the digest of the written manifest.
+    """
+    blobs_dir = os.path.join(layout_dir, "blobs", "sha256")
+    pathlib.Path(blobs_dir).mkdir(parents=True, exist_ok=True)
+
+    base_manifest = _resolve_base_manifest(base_layout, base_ref)
+    base_config = json.loads(read_blob(base_layout, base_manifest["config"]["digest"]))
+
+    for descriptor in base_manifest["layers"]:
+        _copy_blob(base_layout, layout_dir, descriptor["digest"])
+
+    layer_descriptors = list(base_manifest["layers"])
+    config = dict(base_config)
+    config["rootfs"] = dict(
+        base_config.get("rootfs", {"type": "layers"}),
+        diff_ids=list(base_config.get("rootfs", {}).get("diff_ids", [])),
+    )
+    config["history"] = list(base_config.get("history", []))
+
+    for files in layers:
+        descriptor, diff_id = write_layer_blob(blobs_dir, files)
+        layer_descriptors.append(descriptor)
+        config["rootfs"]["diff_ids"].append(diff_id)
+        config["history"].append({"created_by": "setuptools-docker"})
+
+    container_config = dict(base_config.get("config", {}))
+    container_config.update(config_overrides)
+    if "Env" in config_overrides:
+        # e.g. LANG and PYTHON_VERSION of the base image
+        container_config["Env"] = _merge_env(
+            base_config.get("config", {}).get("Env") or [], config_overrides["Env"]
+        )
+    config["config"] = container_config
+    # keep image reproducible - take over creation date of base image
+    config["created"] = base_config.get("created", "1970-01-01T00:00:00Z")
+
+    config_descriptor = write_json_blob(blobs_dir, config, MEDIA_TYPE_CONFIG)
+    manifest_descriptor = write_json_blob(
+        blobs_dir,
+        {
+            "schemaVersion": 2,
+            "mediaType": MEDIA_TYPE_MANIFEST,
+            "config": config_descriptor,
+            "layers": layer_descriptors,
+        },
+        MEDIA_TYPE_MANIFEST,
+    )
+    manifest_descriptor["annotations"] = {REF_NAME_ANNOTATION: ref_name}
+
+    with open(os.path.join(layout_dir, "oci-layout"), "w") as f:
+        json.dump({"imageLayoutVersion": "1.0.0"}, f)
+    with open(os.path.join(layout_dir, "index.json"), "w") as f:
+        json.dump(
+            {
+                "schemaVersion": 2,
+                "mediaType": MEDIA_TYPE_INDEX,
+                "manifests": [manifest_descriptor],
+            },
+            f,
+            indent=2,
+        )
+
+    return manifest_descriptor["digest"]
+
+
+def write_layer_tar(fileobj: IO[bytes], files: Dict[str, LayerSource]) -> None:
+    """
+    Write a reproducible tar stream: entries are sorted, parent directories are
+    added implicitly and mtime as well as ownership are normalized.
+    """
+    entries: Dict[str, Optional[LayerSource]] = {}
+    for arcname, source in files.items():
+        arcname = arcname.strip("/")
+        parts = arcname.split("/")
+        for i in range(1, len(parts)):
+            entries.setdefault("/".join(parts[:i]), None)
+        entries[arcname] = source
+
+    with tarfile.open(fileobj=fileobj, mode="w|", format=tarfile.PAX_FORMAT) as tar:
+        for arcname in sorted(entries):
+            source = entries[arcname]
+            if source is None:
+                info = tarfile.TarInfo(arcname)
+                info.type = tarfile.DIRTYPE
+                info.mode = 0o755
+                tar.addfile(_normalize(info))
+            elif isinstance(source, bytes):
+                info = tarfile.TarInfo(arcname)
+                info.size = len(source)
+                # literal scripts need to be executable
+                info.mode = 0o755 if source.startswith(b"#!") else 0o644
+                tar.addfile(_normalize(info), io.BytesIO(source))
+            else:
+                info = _normalize(tar.gettarinfo(source, arcname))
+                if info.isreg():
+                    with open(source, "rb") as source_f:
+                        tar.addfile(info, source_f)
+                else:
+                    tar.addfile(info)
+
+
+def write_layer_blob(blobs_dir: str, files: Dict[str, LayerSource]) -> Tuple[Dict, str]:
+    """
+    Write a gzipped layer blob into ``blobs_dir``. Returns the descriptor of the blob
+    and the diff id (digest of the uncompressed tar).
+    """
+    with tempfile.NamedTemporaryFile(dir=blobs_dir, delete=False) as tmp_f:
+        try:
+            compressed = _HashingWriter(tmp_f)
+            with gzip.GzipFile(
+                filename="", mode="wb", fileobj=compressed, mtime=0
+            ) as gz:
+                uncompressed = _HashingWriter(gz)
+                write_layer_tar(uncompressed, files)
+        except BaseException:
+            tmp_f.close()
+            os.remove(tmp_f.name)
+            raise
+
+    digest = f"sha256:{compressed.sha256.hexdigest()}"
+    os.replace(tmp_f.name, os.path.join(blobs_dir, compressed.sha256.hexdigest()))
+    return (
+        {"mediaType": MEDIA_TYPE_LAYER, "digest": digest, "size": compressed.size},
+        f"sha256:{uncompressed.sha256.hexdigest()}",
+    )
+
+
+def write_json_blob(blobs_dir: str, content: Dict, media_type: str) -> Dict:
+    data = json.dumps(content, sort_keys=True, separators=(",", ":")).encode()
+    hexdigest = hashlib.sha256(data).hexdigest()
+    with open(os.path.join(blobs_dir, hexdigest), "wb") as f:
+        f.write(data)
+
+    return {"mediaType": media_type, "digest": f"sha256:{hexdigest}", "size": len(data)}
+
+
+def blob_path(layout_dir: str, digest: str) -> str:
+    """Path of the blob with ``digest`` within an oci image layout."""
+    algorithm, hexdigest = digest.split(":", 1)
+    return os.path.join(layout_dir, "blobs", algorithm, hexdigest)
+
+
+def read_blob(layout_dir: str, digest: str) -> bytes:
+    with open(blob_path(layout_dir, digest), "rb") as f:
+        return f.read()
+
+
+def _pip_install_target(
+    target_dir: str,
+    requirements: List[str],
+    index_url: Optional[str] = None,
+    pip_extra_args: Optional[str] = None,
+    python_version: Optional[str] = None,
+    platforms: List[str] = [],
+    no_deps: bool = False,
+) -> None:
+    pathlib.Path(target_dir).mkdir(parents=True, exist_ok=True)
+    if not requirements:
+        return
+
+    subprocess.run(
+        [
+            sys.executable,
+            "-m",
+            "pip",
+            "install",
+            "--no-compile",
+            "--no-warn-script-location",
+            "--only-binary",
+            ":all:",
+            "--target",
+            target_dir,
+        ]
+        + (["--no-deps"] if no_deps else [])
+        # wheels for the python and platform of the base image, not of the host
+        + (
+            ["--python-version", python_version, "--implementation", "cp"]
+            if python_version
+            else []
+        )
+        + [arg for p in platforms for arg in ["--platform", p]]
+        + (pip_extra_args.split() if pip_extra_args else [])
+        + requirements,
+        # credentials must not show up in the process list
+        env=dict(os.environ, PIP_INDEX_URL=index_url) if index_url else None,
+    ).check_returncode()
+
+
+def _tree_files(root: str, prefix: str) -> Dict[str, LayerSource]:
+    files: Dict[str, LayerSource] = {}
+    for dir_path, dir_names, file_names in os.walk(root):
+        rel_dir = os.path.relpath(dir_path, root)
+        for name in dir_names + file_names:
+            path = os.path.join(dir_path, name)
+            arcname = os.path.normpath(os.path.join(prefix, rel_dir, name))
+            if name in dir_names and not os.path.islink(path):
+                continue
+            files[arcname] = _rewrite_shebang(path)
+
+    return files
+
+
+def _rewrite_shebang(path: str) -> LayerSource:
+    # console scripts installed by pip point to the host interpreter
+    if os.path.islink(path) or os.path.basename(os.path.dirname(path)) != "bin":
+        return path
+
+    with open(path, "rb") as f:
+        content = f.read()
+    if not content.startswith(b"#!") or b"python" not in content.split(b"\n", 1)[0]:
+        return path
+
+    return b"#!/usr/bin/env python\n" + content.split(b"\n", 1)[1]
+
+
+def _app_files(init_scripts: List[str]) -> Dict[str, LayerSource]:
+    entrypoint_script = os.path.join(
+        os.path.dirname(os.path.realpath(__file__)), "docker-entrypoint.sh"
+    )
+    files: Dict[str, LayerSource] = {"app/docker-entrypoint.sh": entrypoint_script}
+    for init_script in init_scripts:
+        files[f"app/init.d/{os.path.basename(init_script)}"] = init_script
+
+    return files
+
+
+def _config_overrides(
+    entrypoint: List[str],
+    command: List[str],
+    user_id: Optional[int],
+    env_vars: List[Tuple[str, str]],
+) -> Dict:
+    env = [
+        f"PATH=/{PACKAGES_PATH}/bin:/{SITE_PACKAGES_PATH}/bin:"
+        "/usr/local/sbin:/usr/local/bin:/usr/sbin:/usr/bin:/sbin:/bin",
+        f"PYTHONPATH=/{PACKAGES_PATH}:/{SITE_PACKAGES_PATH}",
+        "PYTHONDONTWRITEBYTECODE=1",
+        "PYTHONUNBUFFERED=1",
+    ] + [f"{name}={value}" for name, value in env_vars]
+
+    overrides = {
+        "Env": env,
+        "Entrypoint": ["/app/docker-entrypoint.sh"] + (entrypoint or ["python"]),
+        "Cmd": command or None,
+    }
+    if user_id:
+        overrides["User"] = str(user_id)
+
+    return overrides
+
+
+def _merge_env(base: List[str], overrides: List[str]) -> List[str]:
+    """Env of the base image with ``overrides`` applied by name."""
+    env = dict(e.split("=", 1) if "=" in e else (e, "") for e in base)
+    env.update(e.split("=", 1) if "=" in e else (e, "") for e in overrides)
+    return [f"{name}={value}" for name, value in env.items()]
+
+
+def _resolve_base_manifest(layout_dir: str, ref: Optional[str] = None) -> Dict:
+    with open(os.path.join(layout_dir, "index.json")) as f:
+        index = json.load(f)
+
+    manifests = index["manifests"]
+    if ref is not None:
+        manifests = [
+            m
+            for m in manifests
+            if m.get("annotations", {}).get(REF_NAME_ANNOTATION) == ref
+        ]
+    if not manifests:
+        raise Exception(f"No image {ref} found in oci layout {layout_dir}")
+
+    descriptor = manifests[0]
+    # multi platform images -> pick the manifest for the platform we run on
+    while descriptor["mediaType"] in [
+        MEDIA_TYPE_INDEX,
+        DOCKER_MEDIA_TYPE_MANIFEST_LIST,
+    ]:
+        nested = json.loads(read_blob(layout_dir, descriptor["digest"]))
+        descriptor = _select_platform(nested["manifests"])
+
+    return json.loads(read_blob(layout_dir, descriptor["digest"]))
+
+
+def _select_platform(manifests: List[Dict]) -> Dict:
+    arch = {"x86_64": "amd64", "aarch64": "arm64"}.get(
+        platform.machine(), platform.machine()
+    )
+    for m in manifests:
+        p = m.get("platform", {})
+        if p.get("os") == "linux" and p.get("architecture") == arch:
+            return m
+
+    raise Exception(f"No manifest found for platform linux/{arch}")
+
+
+def _copy_blob(src_layout: str, dest_layout: str, digest: str) -> None:
+    src = blob_path(src_layout, digest)
+    dest = blob_path(dest_layout, digest)
+    if os.path.exists(dest):
+        return
+    pathlib.Path(dest).parent.mkdir(parents=True, exist_ok=True)
+    try:
+        os.link(src, dest)
+    except OSError:
+        shutil.copyfile(src, dest)
+
+
+def _normalize(info: tarfile.TarInfo) -> tarfile.TarInfo:
+    info.mtime = 0
+    info.uid = 0
+    info.gid = 0
+    info.uname = ""
+    info.gname = ""
+    info.pax_headers = {}
+    if info.issym():
+        return info
+    info.mode = 0o755 if info.isdir() or info.mode & 0o100 else 0o644
+    return info
+
+
+class _HashingWriter:
+    def __init__(self, fileobj: IO[bytes]) -> None:
+        self.fileobj = fileobj
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data: bytes) -> int:
+        self.sha256.update(data)
+        self.size += len(data)
+        return self.fileobj.write(data)
+
+    def flush(self) -> None:
+        self.fileobj.flush()
@@ -0,0 +1,243 @@
+import hashlib
+import re
+import shlex
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from .docker import render_context
+from .staging import DOCKERIGNORE_FILE, StagingSource, file_digest
+
+# instructions adding a layer to the image
+LAYER_COMMANDS = ["RUN", "COPY", "ADD"]
+
+
+@dataclass(frozen=True)
+class ContextFile:
+    """File of the build context: its name within the context and its source."""
+
+    name: str
+    source: StagingSource = field(repr=False)
+    digest: str
+
+
+@dataclass(frozen=True)
+class Instruction:
+    command: str
+    arguments: str
+    cache_mounts: Tuple[str, ...] = ()
+    secrets: Tuple[str, ...] = ()
+
+    @property
+    def creates_layer(self) -> bool:
+        return self.command in LAYER_COMMANDS
+
+    def context_sources(self) -> List[str]:
+        """Names of context files and directories copied by a COPY/ADD."""
+        if self.command not in ["COPY", "ADD"]:
+            return []
+        args = [a for a in shlex.split(self.arguments) if not a.startswith("--")]
+        if any(a.startswith("--from=") for a in shlex.split(self.arguments)):
+            return []
+        return [a.rstrip("/") for a in args[:-1]]
+
+
+@dataclass(frozen=True)
+class Stage:
+    base: str
+    name: Optional[str]
+    instructions: Tuple[Instruction, ...]
+
+    @property
+    def layers(self) -> Tuple[Instruction, ...]:
+        return tuple(i for i in self.instructions if i.creates_layer)
+
+    def dependencies(self) -> List[str]:
+        """Names of other stages this one is based on or copies from."""
+        deps = [self.base]
+        for instruction in self.instructions:
+            m = re.search(r"--from=(\S+)", instruction.arguments)
+            if instruction.command in ["COPY", "ADD"] and m:
+                deps.append(m.group(1))
+        return deps
+
+
+@dataclass(frozen=True)
+class BuildPlan:
+    """
+    Everything needed for building an image: the rendered Dockerfile, parsed into
+    stages and their layers, the files of the build context and the secrets.
+
+    ``planned`` are inputs only materialized when building, e.g., a lock file to
+    be resolved or the wheelhouse to be filled. Planned files have no digest.
+    """
+
+    dockerfile: str
+    stages: Tuple[Stage, ...]
+    files: Tuple[ContextFile, ...]
+    secrets: Dict[str, str] = field(default_factory=dict, repr=False, compare=False)
+    planned: Tuple[str, ...] = ()
+
+    def context_files(self) -> Dict[str, StagingSource]:
+        """Files of the build context incl. Dockerfile, e.g., for ``stage_files``."""
+        return {f.name: f.source for f in self.files}
+
+    def key(self) -> str:
+        """Hash of the build context, i.e., of all inputs of the build."""
+        h = hashlib.sha256()
+        for f in sorted(self.files, key=lambda f: f.name):
+            h.update(f.name.encode() + b"\0" + f.digest.encode())
+        return h.hexdigest()
+
+    def diff(self, other: "BuildPlan") -> Dict[str, List[str]]:
+        """
+        Context files and stages (by name or index) of ``other`` which differ from
+        this plan. A stage differs if its instructions, the files it copies or the
+        stages it depends on differ.
+        """
+        digests = {f.name: f.digest for f in self.files}
+        other_digests = {f.name: f.digest for f in other.files}
+        changed_files = sorted(
+            n
+            for n in set(digests) | set(other_digests)
+            if digests.get(n) != other_digests.get(n)
+            # derived from the other files
+            and n not in ["Dockerfile", DOCKERIGNORE_FILE]
+        )
+
+        stages = {_stage_id(s, i): s for i, s in enumerate(self.stages)}
+        changed_stages: List[str] = []
+        for i, stage in enumerate(other.stages):
+            stage_id = _stage_id(stage, i)
+            copied = [
+                source
+                for instruction in stage.instructions
+                for source in instruction.context_sources()
+            ]
+            if (
+                stages.get(stage_id) != stage
+                or any(d in changed_stages for d in stage.dependencies())
+                or any(
+                    name == source or name.startswith(source + "/") or source == "."
+                    for name in changed_files
+                    for source in copied
+                )
+            ):
+                changed_stages.append(stage_id)
+
+        return {"files": changed_files, "stages": changed_stages}
+
+    def to_dict(self) -> Dict:
+        return {
+            "key": self.key(),
+            "stages": [
+                {
+                    "name": s.name,
+                    "base": s.base,
+                    "layers": [
+                        {
+                            "instruction": f"{i.command} {i.arguments}",
+                            "cache_mounts": list(i.cache_mounts),
+                            "secrets": list(i.secrets),
+                        }
+                        for i in s.layers
+                    ],
+                }
+                for s in self.stages
+            ],
+            "files": [
+                {
+                    "name": f.name,
+                    "source": f.source if isinstance(f.source, str) else None,
+                    "digest": f.digest,
+                }
+                for f in self.files
+            ],
+            # only names, values must not leak
+            "secrets": sorted(self.secrets),
+            "planned": list(self.planned),
+        }
+
+
+def build_plan(wheel_file: str, planned: List[str] = [], **kwargs) -> BuildPlan:
+    """
+    Plan the build of an image for ``wheel_file``, without writing files or
+    talking to docker. See ``render_context`` for the supported arguments.
+    Context files named in ``planned`` do not exist yet.
+    """
+    context_files, secrets = render_context(wheel_file, **kwargs)
+    dockerfile = context_files["Dockerfile"].decode()
+    return BuildPlan(
+        dockerfile=dockerfile,
+        stages=parse_dockerfile(dockerfile),
+        files=tuple(
+            ContextFile(name, source, "" if name in planned else _digest(source))
+            for name, source in sorted(context_files.items())
+        ),
+        secrets=secrets,
+        planned=tuple(planned),
+    )
+
+
+def parse_dockerfile(dockerfile: str) -> Tuple[Stage, ...]:
+    """Parse the stages and their instructions of a Dockerfile."""
+    stages = []
+    current: Optional[Tuple[str, Optional[str], List[Instruction]]] = None
+    for line in _logical_lines(dockerfile):
+        command, _, arguments = line.partition(" ")
+        command = command.upper()
+        arguments = arguments.strip()
+        if command == "FROM":
+            if current:
+                stages.append(Stage(current[0], current[1], tuple(current[2])))
+            m = re.fullmatch(r"(?:--\S+\s+)*(\S+)(?:\s+AS\s+(\S+))?", arguments, re.I)
+            current = (m.group(1), m.group(2), [])
+        elif current is not None:
+            mounts = re.findall(r"--mount=(\S+)", arguments)
+            current[2].append(
+                Instruction(
+                    command,
+                    " ".join(arguments.split()),
+                    cache_mounts=_mount_values(mounts, "cache", "target"),
+                    secrets=_mount_values(mounts, "secret", "id"),
+                )
+            )
+
+    if current:
+        stages.append(Stage(current[0], current[1], tuple(current[2])))
+    return tuple(stages)
+
+
+def _logical_lines(dockerfile: str) -> List[str]:
+    lines = []
+    pending = ""
+    for line in dockerfile.splitlines():
+        stripped = line.strip()
+        if not stripped or stripped.startswith("#"):
+            continue
+        if stripped.endswith("\\"):
+            pending += stripped[:-1] + " "
+            continue
+        lines.append(pending + stripped)
+        pending = ""
+    if pending:
+        lines.append(pending.strip())
+    return lines
+
+
+def _mount_values(mounts: List[str], mount_type: str, key: str) -> Tuple[str, ...]:
+    values = []
+    for mount in mounts:
+        options = dict(o.partition("=")[::2] for o in mount.split(","))
+        if options.get("type") == mount_type and key in options:
+            values.append(options[key])
+    return tuple(values)
+
+
+def _digest(source: StagingSource) -> str:
+    if isinstance(source, bytes):
+        return hashlib.sha256(source).hexdigest()
+    return file_digest(source)
+
+
+def _stage_id(stage: Stage, index: int) -> str:
+    return stage.name or str(index)
@@ -0,0 +1,305 @@
+import base64
+import json
+import os
+import re
+import tarfile
+import tempfile
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import IO, Dict, List, Optional, Tuple, Union
+
+from distutils import log
+
+from .oci import MEDIA_TYPE_MANIFEST, REF_NAME_ANNOTATION, blob_path, read_blob
+
+DEFAULT_REGISTRY = "registry-1.docker.io"
+
+# registries talked to via plain http, as docker does by default
+INSECURE_HOSTS = ["localhost", "127.0.0.1"]
+
+
+def parse_repository(image_name: str) -> Tuple[str, str]:
+    """Registry and repository of an image name, e.g., ghcr.io and org/app."""
+    first, _, rest = image_name.partition("/")
+    if rest and ("." in first or ":" in first or first == "localhost"):
+        return first, rest
+    return DEFAULT_REGISTRY, image_name if rest else f"library/{image_name}"
+
+
+class RegistryClient:
+    """
+    Client of the OCI distribution api, supporting basic and bearer token auth.
+    Thread safe, i.e., can be used for concurrent uploads.
+    """
+
+    def __init__(
+        self,
+        registry: str,
+        username: Optional[str] = None,
+        password: Optional[str] = None,
+    ) -> None:
+        scheme = "http" if registry.split(":")[0] in INSECURE_HOSTS else "https"
+        self.base_url = f"{scheme}://{registry}"
+        self.username = username
+        self.password = password
+        self._tokens: Dict[str, str] = {}
+        self._basic_auth = False
+        self._lock = threading.Lock()
+
+    def blob_exists(self, repository: str, digest: str) -> bool:
+        try:
+            with self._request(
+                "HEAD", f"/v2/{repository}/blobs/{digest}", _scope(repository)
+            ):
+                return True
+        except urllib.error.HTTPError as e:
+            if e.code == 404:
+                return False
+            raise
+
+    def mount_blob(
+        self, repository: str, digest: str, from_repository: str
+    ) -> Tuple[bool, Optional[str]]:
+        """
+        Mount a blob from another repository. Returns whether it got mounted and if
+        not, the location of the upload the registry started instead.
+        """
+        query = urllib.parse.urlencode({"mount": digest, "from": from_repository})
+        with self._request(
+            "POST",
+            f"/v2/{repository}/blobs/uploads/?{query}",
+            _scope(repository) + " " + _scope(from_repository, "pull"),
+            data=b"",
+        ) as response:
+            if response.status == 201:
+                return True, None
+            return False, urllib.parse.urljoin(
+                self.base_url, response.headers["Location"]
+            )
+
+    def cancel_upload(self, repository: str, location: str) -> None:
+        with self._request("DELETE", location, _scope(repository)):
+            pass
+
+    def upload_blob(
+        self, repository: str, digest: str, path: str, location: Optional[str] = None
+    ) -> None:
+        """
+        Upload a blob monolithically, streaming it from ``path``, to the upload at
+        ``location`` or a new one.
+        """
+        scope = _scope(repository)
+        if location is None:
+            with self._request(
+                "POST", f"/v2/{repository}/blobs/uploads/", scope, data=b""
+            ) as response:
+                location = urllib.parse.urljoin(
+                    self.base_url, response.headers["Location"]
+                )
+
+        separator = "&" if "?" in location else "?"
+        with open(path, "rb") as f:
+            with self._request(
+                "PUT",
+                f"{location}{separator}{urllib.parse.urlencode({'digest': digest})}",
+                scope,
+                data=f,
+                headers={
+                    "Content-Type": "application/octet-stream",
+                    "Content-Length": str(os.path.getsize(path)),
+                },
+            ):
+                pass
+
+    def put_manifest(
+        self, repository: str, reference: str, manifest: bytes, media_type: str
+    ) -> None:
+        with self._request(
+            "PUT",
+            f"/v2/{repository}/manifests/{reference}",
+            _scope(repository),
+            data=manifest,
+            headers={"Content-Type": media_type},
+        ):
+            pass
+
+    def _request(
+        self,
+        method: str,
+        url: str,
+        scope: str,
+        data: Union[bytes, IO[bytes], None] = None,
+        headers: Dict[str, str] = {},
+    ):
+        if not url.startswith(("http://", "https://")):
+            url = self.base_url + url
+
+        for attempt in range(2):
+            request = urllib.request.Request(
+                url, data=data, method=method, headers=dict(headers)
+            )
+            auth = self._auth_header(scope)
+            if auth:
+                request.add_header("Authorization", auth)
+            try:
+                return urllib.request.urlopen(request)
+            except urllib.error.HTTPError as e:
+                if e.code != 401 or attempt > 0:
+                    raise
+                self._authenticate(e.headers.get("WWW-Authenticate", ""), scope)
+                if hasattr(data, "seek"):
+                    data.seek(0)
+
+    def _auth_header(self, scope: str) -> Optional[str]:
+        with self._lock:
+            token = self._tokens.get(scope)
+            basic_auth = self._basic_auth
+        if token:
+            return f"Bearer {token}"
+        if basic_auth and self.username:
+            credentials = f"{self.username}:{self.password or ''}"
+            return f"Basic {base64.b64encode(credentials.encode()).decode()}"
+        return None
+
+    def _authenticate(self, challenge: str, scope: str) -> None:
+        if challenge.lower().startswith("basic"):
+            with self._lock:
+                self._basic_auth = True
+            return
+        if not challenge.lower().startswith("bearer"):
+            raise Exception(f"Unsupported registry authentication: {challenge}")
+
+        params = dict(re.findall(r'(\w+)="([^"]*)"', challenge))
+        query = [("service", params["service"])] if "service" in params else []
+        query += [("scope", s) for s in scope.split(" ")]
+        request = urllib.request.Request(
+            f"{params['realm']}?{urllib.parse.urlencode(query)}"
+        )
+        if self.username:
+            credentials = f"{self.username}:{self.password or ''}"
+            request.add_header(
+                "Authorization",
+                f"Basic {base64.b64encode(credentials.encode()).decode()}",
+            )
+        with urllib.request.urlopen(request) as response:
+            token_response = json.load(response)
+
+        with self._lock:
+            self._tokens[scope] = token_response.get(
+                "token", token_response.get("access_token")
+            )
+
+
+def push_image_layout(
+    layout: str,
+    image_name: str,
+    tags: List[str],
+    username: Optional[str] = None,
+    password: Optional[str] = None,
+    mount_from: List[str] = [],
+    jobs: int = 8,
+    ref: Optional[str] = None,
+) -> Dict[str, str]:
+    """
+    Push the image of an oci layout (directory or .tar archive, as written by
+    ``build_oci_image``) to the registry of ``image_name`` with all ``tags``.
+
+    Blobs which already exist in the repository are skipped, missing ones get
+    mounted from the repositories of ``mount_from`` (e.g., other services sharing
+    the dependency layer) or uploaded, concurrently. Returns how each blob was
+    handled (exists, mounted or uploaded) by digest.
+    """
+    if layout.endswith(".tar"):
+        with tempfile.TemporaryDirectory() as layout_dir:
+            with tarfile.open(layout) as tar:
+                _extract(tar, layout_dir)
+            return push_image_layout(
+                layout_dir,
+                image_name,
+                tags,
+                username=username,
+                password=password,
+                mount_from=mount_from,
+                jobs=jobs,
+                ref=ref,
+            )
+
+    with open(os.path.join(layout, "index.json")) as f:
+        descriptors = [
+            d
+            for d in json.load(f)["manifests"]
+            if ref is None or d.get("annotations", {}).get(REF_NAME_ANNOTATION) == ref
+        ]
+    if not descriptors:
+        raise Exception(f"No image {ref} found in oci layout {layout}")
+    media_type = descriptors[0].get("mediaType", MEDIA_TYPE_MANIFEST)
+    if media_type != MEDIA_TYPE_MANIFEST:
+        raise Exception(f"Pushing {media_type} is not supported")
+
+    manifest = read_blob(layout, descriptors[0]["digest"])
+    manifest_json = json.loads(manifest)
+    # the same blob may be referenced multiple times
+    digests = list(
+        dict.fromkeys(
+            d["digest"] for d in [manifest_json["config"]] + manifest_json["layers"]
+        )
+    )
+
+    registry, repository = parse_repository(image_name)
+    mount_repositories = [parse_repository(m)[1] for m in mount_from]
+    client = RegistryClient(registry, username, password)
+
+    def push_blob(digest: str) -> str:
+        if client.blob_exists(repository, digest):
+            return "exists"
+        location = None
+        for mount_repository in mount_repositories:
+            if location is not None:
+                client.cancel_upload(repository, location)
+            mounted, location = client.mount_blob(repository, digest, mount_repository)
+            if mounted:
+                return "mounted"
+        client.upload_blob(repository, digest, blob_path(layout, digest), location)
+        return "uploaded"
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        results = dict(zip(digests, executor.map(push_blob, digests)))
+
+    # all blobs are in place, i.e., the tags can be put concurrently
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        list(
+            executor.map(
+                lambda tag: client.put_manifest(repository, tag, manifest, media_type),
+                tags,
+            )
+        )
+
+    counts = {s: list(results.values()).count(s) for s in set(results.values())}
+    log.info(
+        f"pushed {registry}/{repository}:{','.join(tags)} "
+        + ", ".join(f"{n} {s}" for s, n in sorted(counts.items()))
+    )
+    return results
+
+
+def _extract(tar: tarfile.TarFile, dest: str) -> None:
+    if hasattr(tarfile, "data_filter"):
+        tar.extractall(dest, filter="data")
+        return
+
+    # python without extraction filters: only files and directories within dest
+    dest = os.path.realpath(dest)
+    for member in tar.getmembers():
+        path = os.path.realpath(os.path.join(dest, member.name))
+        if not (member.isfile() or member.isdir()) or (
+            os.path.commonpath([dest, path]) != dest
+        ):
+            raise Exception(f"Invalid member of oci layout archive: {member.name}")
+    tar.extractall(dest)
+
+
+def _scope(repository: str, actions: str = "pull,push") -> str:
+    return f"repository:{repository}:{actions}"
@@ -0,0 +1,157 @@
+import contextlib
+import datetime
+import json
+import os
+import pathlib
+import re
+import subprocess
+import time
+from typing import Dict, Iterator, List, Optional
+
+
+class BuildReport:
+    """
+    Collects timings of the phases of a build, of the steps of docker build (parsed
+    from its plain or rawjson progress output) and sizes of the built image.
+    """
+
+    def __init__(self) -> None:
+        self.spans: List[Dict] = []
+        self.steps: Dict[str, Dict] = {}
+        self.image: Dict = {}
+        self._origin = time.monotonic()
+
+    @contextlib.contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.spans.append(
+                {
+                    "name": name,
+                    "start": round(start - self._origin, 3),
+                    "duration": round(time.monotonic() - start, 3),
+                }
+            )
+
+    def parse_progress(self, line: str) -> None:
+        """Process a line of docker build output (--progress=plain or rawjson)."""
+        line = line.strip()
+        if line.startswith("{"):
+            self._parse_rawjson(line)
+            return
+
+        m = re.match(r"#(\d+) (.*)$", line)
+        if not m:
+            return
+        step = self.steps.setdefault(m.group(1), {"name": None})
+        text = m.group(2)
+        done = re.fullmatch(r"DONE (\d+(?:\.\d+)?)s", text)
+        if done:
+            step["duration"] = float(done.group(1))
+        elif text == "CACHED":
+            step["cached"] = True
+        elif text.startswith("ERROR"):
+            step["error"] = True
+        elif step["name"] is None and text.startswith("["):
+            step["name"] = text
+
+    def _parse_rawjson(self, line: str) -> None:
+        try:
+            status = json.loads(line)
+        except json.JSONDecodeError:
+            return
+        for vertex in status.get("vertexes") or []:
+            step = self.steps.setdefault(vertex["digest"], {"name": vertex.get("name")})
+            if vertex.get("cached"):
+                step["cached"] = True
+            if vertex.get("error"):
+                step["error"] = True
+            started = _parse_timestamp(vertex.get("started") or "")
+            completed = _parse_timestamp(vertex.get("completed") or "")
+            if started and completed:
+                step["duration"] = round((completed - started).total_seconds(), 3)
+
+    def inspect_image(self, image: str) -> None:
+        """Record size of image and its layers."""
+        try:
+            inspect = subprocess.run(
+                ["docker", "image", "inspect", "--format", "{{.Size}}", image],
+                capture_output=True,
+                text=True,
+                check=True,
+            )
+            history = subprocess.run(
+                [
+                    "docker",
+                    "history",
+                    "--human=false",
+                    "--no-trunc",
+                    "--format",
+                    "{{json .}}",
+                    image,
+                ],
+                capture_output=True,
+                text=True,
+                check=True,
+            )
+        except (FileNotFoundError, subprocess.CalledProcessError):
+            return
+
+        layers = [json.loads(line) for line in history.stdout.splitlines() if line]
+        self.image = {
+            "name": image,
+            "size": int(inspect.stdout.strip()),
+            "layers": [
+                {"created_by": layer["CreatedBy"], "size": int(layer["Size"])}
+                for layer in reversed(layers)
+                if int(layer["Size"]) > 0
+            ],
+        }
+
+    def to_dict(self) -> Dict:
+        return {
+            "spans": self.spans,
+            "steps": [s for s in self.steps.values() if s.get("name")],
+            "image": self.image,
+        }
+
+    def write(self, path: str) -> None:
+        pathlib.Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    def summary(self) -> str:
+        lines = [f"{'phase':<60} {'seconds':>10}"]
+        for span in self.spans:
+            lines.append(f"{span['name']:<60} {span['duration']:>10.2f}")
+        steps = self.to_dict()["steps"]
+        if steps:
+            lines.append("")
+            lines.append(f"{'docker build step':<60} {'seconds':>10}")
+            for step in steps:
+                duration = "cached" if step.get("cached") else step.get("duration", "")
+                lines.append(f"{step['name'][:60]:<60} {duration:>10}")
+        if self.image:
+            lines.append("")
+            lines.append(f"{'layer':<60} {'bytes':>10}")
+            for layer in self.image["layers"]:
+                lines.append(f"{layer['created_by'][-60:]:<60} {layer['size']:>10}")
+            lines.append(
+                f"{'image ' + self.image['name']:<60} {self.image['size']:>10}"
+            )
+        return os.linesep.join(lines)
+
+
+def _parse_timestamp(ts: str) -> Optional[datetime.datetime]:
+    # timestamps have nanosecond precision, which datetime does not support
+    m = re.match(r"(.*T\d\d:\d\d:\d\d)(\.\d+)?(Z|[+-]\d\d:\d\d)$", ts)
+    if not m:
+        return None
+    fraction = (m.group(2) or ".0")[:7]
+    tz = "+00:00" if m.group(3) == "Z" else m.group(3)
+    try:
+        return datetime.datetime.fromisoformat(m.group(1) + fraction + tz)
+    except ValueError:
+        return None
@@ -0,0 +1,203 @@
+import errno
+import hashlib
+import json
+import os
+import pathlib
+import shutil
+import tempfile
+from typing import Dict, Iterable, Tuple, Union
+
+try:
+    import fcntl
+except ImportError:  # not available on windows
+    fcntl = None
+
+MANIFEST_FILE = ".staging.json"
+
+DOCKERIGNORE_FILE = ".dockerignore"
+
+# ioctl for cloning a file on copy-on-write file systems (btrfs, xfs, ...)
+_FICLONE = 0x40049409
+
+# source of a staged file: either a path on the host or literal content
+StagingSource = Union[str, bytes]
+
+
+def stage_files(context_path: str, files: Dict[str, StagingSource]) -> None:
+    """
+    Make ``context_path`` contain exactly ``files``, given as mapping of relative
+    path to source.
+
+    Files already in place (same size, mtime and digest as recorded when staging
+    them) are left untouched, others get reflinked, hardlinked or - as last
+    resort - copied. Files staged before, but not in ``files`` anymore, are
+    removed. Files not staged by this function are never touched.
+    """
+    pathlib.Path(context_path).mkdir(parents=True, exist_ok=True)
+    manifest_path = os.path.join(context_path, MANIFEST_FILE)
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        manifest = {}
+
+    new_manifest = {}
+    for name, source in files.items():
+        dest = os.path.join(context_path, name)
+        pathlib.Path(dest).parent.mkdir(parents=True, exist_ok=True)
+        if isinstance(source, bytes):
+            _write_if_changed(dest, source)
+            new_manifest[name] = {"size": len(source)}
+        else:
+            new_manifest[name] = _stage_file(source, dest, manifest.get(name))
+
+    _remove_stale(context_path, set(manifest) - set(files))
+
+    with open(manifest_path, "w") as f:
+        json.dump(new_manifest, f)
+
+
+def dockerignore(names: Iterable[str]) -> bytes:
+    """.dockerignore excluding everything from the context except ``names``."""
+    return ("*\n" + "".join(f"!{name}\n" for name in sorted(names))).encode()
+
+
+def context_size(files: Dict[str, StagingSource]) -> int:
+    """Bytes of the sources of ``files``, i.e., of the context sent to docker."""
+    return sum(
+        len(source) if isinstance(source, bytes) else os.path.getsize(source)
+        for source in files.values()
+    )
+
+
+def scan_context(context_path: str, names: Iterable[str]) -> Tuple[int, int]:
+    """
+    Bytes of the files of ``context_path`` sent to docker, i.e., ``names``, and of
+    all other files, which get excluded by the .dockerignore.
+    """
+    names = set(names)
+    sent = ignored = 0
+    pending = [(context_path, "")]
+    while pending:
+        path, prefix = pending.pop()
+        with os.scandir(path) as entries:
+            for entry in entries:
+                name = prefix + entry.name
+                if entry.is_dir(follow_symlinks=False):
+                    pending.append((entry.path, name + "/"))
+                elif name in names:
+                    sent += entry.stat().st_size
+                else:
+                    ignored += entry.stat(follow_symlinks=False).st_size
+    return sent, ignored
+
+
+def _stage_file(source: str, dest: str, recorded: Dict = None) -> Dict:
+    source_stat = os.stat(source)
+    entry = {
+        "source_size": source_stat.st_size,
+        "source_mtime": source_stat.st_mtime_ns,
+    }
+
+    if os.path.exists(dest):
+        dest_stat = os.stat(dest)
+        if os.path.samestat(source_stat, dest_stat):
+            return dict(entry, size=dest_stat.st_size, mtime=dest_stat.st_mtime_ns)
+
+        unchanged = (
+            recorded is not None
+            and recorded.get("source_size") == source_stat.st_size
+            and recorded.get("source_mtime") == source_stat.st_mtime_ns
+            and recorded.get("size") == dest_stat.st_size
+            and recorded.get("mtime") == dest_stat.st_mtime_ns
+        )
+        if unchanged or (
+            source_stat.st_size == dest_stat.st_size
+            and file_digest(source) == file_digest(dest)
+        ):
+            return dict(entry, size=dest_stat.st_size, mtime=dest_stat.st_mtime_ns)
+
+        os.remove(dest)
+
+    _link_or_copy(source, dest)
+    dest_stat = os.stat(dest)
+    return dict(entry, size=dest_stat.st_size, mtime=dest_stat.st_mtime_ns)
+
+
+def _link_or_copy(source: str, dest: str) -> None:
+    try:
+        _reflink(source, dest)
+        return
+    except OSError:
+        pass
+
+    try:
+        os.link(source, dest)
+        return
+    except OSError:
+        pass
+
+    shutil.copy2(source, dest)
+
+
+def _reflink(source: str, dest: str) -> None:
+    if fcntl is None:
+        raise OSError(errno.EOPNOTSUPP, "reflink not supported")
+    with open(source, "rb") as source_f, open(dest, "wb") as dest_f:
+        try:
+            fcntl.ioctl(dest_f.fileno(), _FICLONE, source_f.fileno())
+        except OSError:
+            dest_f.close()
+            os.remove(dest)
+            raise
+    shutil.copystat(source, dest)
+
+
+def _write_if_changed(dest: str, content: bytes) -> None:
+    try:
+        with open(dest, "rb") as f:
+            if f.read() == content:
+                return
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        if e.errno != errno.EISDIR:
+            raise
+        shutil.rmtree(dest)
+
+    # replace instead of writing in place, dest may be a hardlink to a source
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(dest))
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, dest)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
+def _remove_stale(context_path: str, names: set) -> None:
+    """Remove the staged files ``names`` and directories left empty by that."""
+    for name in names:
+        path = os.path.join(context_path, name)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        parent = os.path.dirname(name)
+        while parent:
+            try:
+                os.rmdir(os.path.join(context_path, parent))
+            except OSError:
+                # not empty, i.e., still in use
+                break
+            parent = os.path.dirname(parent)
+
+
+def file_digest(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
@@ -0,0 +1,344 @@
+"""
+Helpers run within the builder stage for post-processing the venv. This module is
+copied into the build context and executed by the python of the builder image, so
+it must only use the standard library and support all python versions of the base
+images.
+"""
+
+import argparse
+import importlib.metadata
+import json
+import os
+import py_compile
+import re
+import shutil
+import subprocess
+import sys
+import sysconfig
+from typing import Dict, List, Set
+
+# rules for pruning files not needed at runtime, as globs relative to the venv
+PRUNE_RULES = {
+    "tests": ["**/site-packages/*/tests/**", "**/site-packages/*/test/**"],
+    "record": ["**/*.dist-info/RECORD"],
+    "docs": ["**/site-packages/*/**/*.md", "**/site-packages/*/**/*.rst"],
+    "type-stubs": ["**/*.pyi"],
+    "c-sources": ["**/*.c", "**/*.h", "**/*.pyx", "**/*.pxd"],
+}
+
+# bytecode for other python versions than the one running this
+FOREIGN_BYTECODE_RULE = "foreign-bytecode"
+
+PRUNE_RULES_ALL = list(PRUNE_RULES) + [FOREIGN_BYTECODE_RULE]
+
+# docs are opt-in, packages may read them at runtime, e.g., as templates
+PRUNE_RULES_DEFAULT = [r for r in PRUNE_RULES_ALL if r != "docs"]
+
+# parts of the standard library not needed at runtime, as globs relative to it
+STDLIB_EXCLUDES = [
+    "test/**",
+    "idlelib/**",
+    "tkinter/**",
+    "turtledemo/**",
+    "ensurepip/**",
+    "lib2to3/tests/**",
+    "site-packages/**",
+    # bytecode for python -O and -OO
+    "**/__pycache__/*.opt-?.pyc",
+    # static libpython and the makefile for building extensions
+    "config-*/**",
+]
+
+# libraries glibc loads via dlopen, i.e., which ldd does not report
+DLOPEN_LIBRARIES = [
+    "libnss_files.so*",
+    "libnss_dns.so*",
+    "libresolv.so*",
+    "libgcc_s.so*",
+]
+
+
+def strip_sources(paths: List[str], keep_dists: List[str] = []) -> int:
+    """
+    Remove .py files which have a legacy .pyc next to them (compileall -b), except
+    for files of the distributions in ``keep_dists``. Returns the number of bytes
+    removed.
+
+    Legacy pycs are ignored if the source exists, so those of kept files get
+    replaced by unchecked-hash pycs in __pycache__.
+    """
+    keep = _dist_files(keep_dists)
+    removed = 0
+    for path in paths:
+        for root, dir_names, file_names in os.walk(path):
+            for name in file_names:
+                source = os.path.join(root, name)
+                if not name.endswith(".py") or not os.path.exists(source + "c"):
+                    continue
+                if os.path.realpath(source) in keep:
+                    os.remove(source + "c")
+                    py_compile.compile(
+                        source,
+                        doraise=True,
+                        invalidation_mode=py_compile.PycInvalidationMode.UNCHECKED_HASH,
+                    )
+                else:
+                    removed += os.path.getsize(source)
+                    os.remove(source)
+
+    return removed
+
+
+def prune(
+    path: str,
+    rules: List[str] = PRUNE_RULES_DEFAULT,
+    include: List[str] = [],
+    exclude: List[str] = [],
+    strip: bool = False,
+) -> Dict[str, int]:
+    """
+    Remove files matched by the given rules and ``include`` globs from ``path``,
+    except those matched by ``exclude`` globs. Optionally strip shared objects.
+    Returns the number of bytes saved per rule.
+    """
+    patterns = [(r, _glob_regex(g)) for r in rules for g in PRUNE_RULES.get(r, [])]
+    patterns += [("include", _glob_regex(g)) for g in include]
+    excluded = [_glob_regex(g) for g in exclude]
+    # e.g. mod.cpython-37.pyc or mod.cpython-37.opt-1.pyc, but not of this python
+    foreign_bytecode = re.compile(
+        r"(.*/)?__pycache__/[^/.]+\.(?!"
+        + re.escape(sys.implementation.cache_tag)
+        + r"\.)cpython-\d+(\.opt-\d)?\.pyc"
+    )
+
+    saved = {r: 0 for r in rules + (["include"] if include else [])}
+    if strip:
+        saved["strip"] = 0
+
+    for root, dir_names, file_names in os.walk(path):
+        for name in file_names:
+            file_path = os.path.join(root, name)
+            rel_path = os.path.relpath(file_path, path)
+            if os.path.islink(file_path) or any(
+                e.fullmatch(rel_path) for e in excluded
+            ):
+                continue
+
+            rule = next((r for r, p in patterns if p.fullmatch(rel_path)), None)
+            if rule is None and FOREIGN_BYTECODE_RULE in rules:
+                if foreign_bytecode.fullmatch(rel_path):
+                    rule = FOREIGN_BYTECODE_RULE
+
+            if rule is not None:
+                saved[rule] += os.path.getsize(file_path)
+                os.remove(file_path)
+            elif strip and re.search(r"\.so(\.|$)", name):
+                saved["strip"] += _strip(file_path)
+
+    _remove_empty_dirs(path)
+    return saved
+
+
+def runtime_closure(
+    dest: str,
+    paths: List[str],
+    interpreter: bool = True,
+    exclude: List[str] = STDLIB_EXCLUDES,
+) -> int:
+    """
+    Copy everything needed for running the files in ``paths`` (e.g. the venv) to
+    ``dest``, keeping absolute paths: the python interpreter and its standard
+    library (except ``exclude`` globs), the shared libraries needed by any ELF
+    file and the targets of symlinks pointing outside of ``paths``. Returns the
+    number of bytes copied.
+    """
+    copied: Set[str] = set()
+    size = 0
+    elf_files = []
+
+    roots = [os.path.realpath(p) for p in paths]
+    for path in paths:
+        for root, dir_names, file_names in os.walk(path):
+            for name in dir_names + file_names:
+                file_path = os.path.join(root, name)
+                if os.path.islink(file_path):
+                    target = os.path.realpath(file_path)
+                    if not any(_is_within(target, r) for r in roots):
+                        size += _copy_file(
+                            _link_target(file_path), dest, copied, elf_files
+                        )
+                elif name in file_names and _is_elf(file_path):
+                    elf_files.append(file_path)
+
+    if interpreter:
+        size += _copy_file(os.path.realpath(sys.executable), dest, copied, elf_files)
+        stdlib = sysconfig.get_paths()["stdlib"]
+        excluded = [_glob_regex(g) for g in exclude]
+        for root, dir_names, file_names in os.walk(stdlib):
+            for name in file_names:
+                file_path = os.path.join(root, name)
+                if not any(
+                    e.fullmatch(os.path.relpath(file_path, stdlib)) for e in excluded
+                ):
+                    size += _copy_file(file_path, dest, copied, elf_files)
+
+    libraries = shared_libraries(elf_files)
+    for library in sorted(libraries):
+        size += _copy_file(library, dest, copied)
+    for lib_dir in sorted(
+        {os.path.dirname(os.path.realpath(lib)) for lib in libraries}
+    ):
+        for name in sorted(os.listdir(lib_dir)):
+            if any(_glob_regex(g).fullmatch(name) for g in DLOPEN_LIBRARIES):
+                size += _copy_file(os.path.join(lib_dir, name), dest, copied)
+
+    return size
+
+
+def shared_libraries(elf_files: List[str]) -> Set[str]:
+    """Shared libraries (incl. the dynamic loader) needed by ``elf_files``."""
+    libraries: Set[str] = set()
+    # ldd reports transitive dependencies already, in batches for fewer processes
+    for i in range(0, len(elf_files), 100):
+        res = subprocess.run(
+            ["ldd"] + elf_files[i : i + 100], capture_output=True, text=True
+        )
+        for m in re.finditer(r"^\s*(?:\S+ => )?(/\S+) \(0x", res.stdout, re.M):
+            libraries.add(m.group(1))
+    return libraries
+
+
+def _copy_file(
+    path: str, dest: str, copied: Set[str], elf_files: List[str] = None
+) -> int:
+    """Copy a file to ``dest``, incl. the chain of symlinks leading to it."""
+    size = 0
+    while path not in copied:
+        copied.add(path)
+        # within real directories, e.g., of merged /usr
+        target = os.path.join(
+            dest,
+            os.path.realpath(os.path.dirname(path)).lstrip("/"),
+            os.path.basename(path),
+        )
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if os.path.islink(path):
+            if not os.path.lexists(target):
+                os.symlink(os.readlink(path), target)
+            path = _link_target(path)
+            continue
+        if os.path.isfile(path):
+            shutil.copy2(path, target)
+            size += os.path.getsize(path)
+            if elf_files is not None and _is_elf(path):
+                elf_files.append(path)
+    return size
+
+
+def _link_target(path: str) -> str:
+    return os.path.normpath(os.path.join(os.path.dirname(path), os.readlink(path)))
+
+
+def _is_within(path: str, root: str) -> bool:
+    return path == root or path.startswith(root.rstrip("/") + "/")
+
+
+def _is_elf(path: str) -> bool:
+    with open(path, "rb") as f:
+        return f.read(4) == b"\x7fELF"
+
+
+def _strip(path: str) -> int:
+    size = os.path.getsize(path)
+    res = subprocess.run(
+        ["strip", "--strip-unneeded", path], capture_output=True, check=False
+    )
+    return size - os.path.getsize(path) if res.returncode == 0 else 0
+
+
+def _remove_empty_dirs(path: str) -> None:
+    for root, dir_names, file_names in os.walk(path, topdown=False):
+        if root != path and not os.listdir(root):
+            os.rmdir(root)
+
+
+def _glob_regex(glob: str) -> "re.Pattern":
+    """Translate a glob with support for ``**`` (any number of dirs) to a regex."""
+    regex = ""
+    i = 0
+    while i < len(glob):
+        if glob.startswith("**/", i):
+            regex += "(.*/)?"
+            i += 3
+        elif glob.startswith("**", i):
+            regex += ".*"
+            i += 2
+        elif glob[i] == "*":
+            regex += "[^/]*"
+            i += 1
+        elif glob[i] == "?":
+            regex += "[^/]"
+            i += 1
+        else:
+            regex += re.escape(glob[i])
+            i += 1
+    return re.compile(regex)
+
+
+def _dist_files(dist_names: List[str]) -> Set[str]:
+    files = set()
+    for name in dist_names:
+        dist = importlib.metadata.distribution(name)
+        for f in dist.files or []:
+            files.add(os.path.realpath(str(dist.locate_file(f))))
+    return files
+
+
+def main(args: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(prog="venvtool")
+    commands = parser.add_subparsers(dest="command")
+
+    strip = commands.add_parser("strip-sources", help=strip_sources.__doc__)
+    strip.add_argument("paths", nargs="+")
+    strip.add_argument("--keep-dist", action="append", default=[])
+
+    prune_parser = commands.add_parser("prune", help=prune.__doc__)
+    prune_parser.add_argument("path")
+    prune_parser.add_argument("--rule", action="append", choices=PRUNE_RULES_ALL)
+    prune_parser.add_argument("--include", action="append", default=[])
+    prune_parser.add_argument("--exclude", action="append", default=[])
+    prune_parser.add_argument("--strip", action="store_true")
+
+    closure = commands.add_parser("runtime-closure", help=runtime_closure.__doc__)
+    closure.add_argument("dest")
+    closure.add_argument("paths", nargs="+")
+    closure.add_argument("--no-interpreter", action="store_true")
+
+    parsed = parser.parse_args(args)
+    if parsed.command == "strip-sources":
+        removed = strip_sources(parsed.paths, parsed.keep_dist)
+        print(f"strip-sources: removed {removed} bytes of sources")
+    elif parsed.command == "prune":
+        saved = prune(
+            parsed.path,
+            rules=parsed.rule if parsed.rule is not None else PRUNE_RULES_DEFAULT,
+            include=parsed.include,
+            exclude=parsed.exclude,
+            strip=parsed.strip,
+        )
+        for rule, saved_bytes in saved.items():
+            print(f"prune: {rule:<18} {saved_bytes:>12} bytes")
+        print(f"prune: {'total':<18} {sum(saved.values()):>12} bytes")
+        print(f"prune-report: {json.dumps(saved)}")
+    elif parsed.command == "runtime-closure":
+        size = runtime_closure(
+            parsed.dest, parsed.paths, interpreter=not parsed.no_interpreter
+        )
+        print(f"runtime-closure: copied {size} bytes to {parsed.dest}")
+    else:
+        parser.print_help()
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
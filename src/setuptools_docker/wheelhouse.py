@@ -0,0 +1,292 @@
+import base64
+import hashlib
+import json
+import os
+import pathlib
+import platform
+import re
+import subprocess
+import sys
+import tempfile
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from .docker import render_host_index_url
+from .staging import file_digest
+from .wheels import PLATFORM_ARCHS, normalize_name
+
+LOCK_HEADER = "# generated by bdist_docker, update via --update-lock"
+
+# records the requirements file a lock got resolved from
+LOCK_REQUIREMENTS_PREFIX = "# requirements sha256:"
+
+# records the requirements of the wheel (incl. extras) a lock got resolved from
+LOCK_WHEEL_REQUIREMENTS_PREFIX = "# wheel requirements sha256:"
+
+
+def default_cache_dir() -> str:
+    cache_home = os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache"))
+    return os.path.join(cache_home, "setuptools-docker", "wheels")
+
+
+def python_version_of(base_image: str) -> Optional[str]:
+    """Python version of official python base images, e.g., 3.8 for python:3.8-slim."""
+    m = re.match(r"(?:.*/)?python:(\d+\.\d+)", base_image)
+    return m.group(1) if m else None
+
+
+def host_platform() -> str:
+    """Docker platform of images built on this host, e.g., linux/arm64 on a mac m1."""
+    machine = platform.machine().lower()
+    return "linux/arm64" if machine in ("arm64", "aarch64") else "linux/amd64"
+
+
+def pip_platforms(platform: str, glibc_minor: int = 31) -> List[str]:
+    """
+    pip ``--platform`` tags of wheels installable on a docker ``platform`` with
+    glibc 2.``glibc_minor`` (2.31 for debian bullseye).
+    """
+    if platform not in PLATFORM_ARCHS:
+        raise Exception(f"Unsupported platform: {platform}")
+    arch = PLATFORM_ARCHS[platform]
+
+    # pip only expands the legacy manylinux tags to older ones
+    return [f"manylinux_2_{minor}_{arch}" for minor in range(glibc_minor, 16, -1)] + [
+        f"manylinux2014_{arch}"
+    ]
+
+
+def resolve(
+    requirements: List[str],
+    index_url: Optional[str] = None,
+    python_version: Optional[str] = None,
+    platforms: List[str] = [],
+    pip_extra_args: Optional[str] = None,
+) -> List[Dict]:
+    """
+    Resolve ``requirements`` (pip install arguments) to the wheels to install, using
+    pip's dry run installation report. Returns the report's install items.
+    """
+    with tempfile.TemporaryDirectory() as target_dir:
+        res = subprocess.run(
+            [
+                sys.executable,
+                "-m",
+                "pip",
+                "install",
+                "--dry-run",
+                "--ignore-installed",
+                "--quiet",
+                "--report",
+                "-",
+                "--only-binary",
+                ":all:",
+                # platform specific options are only allowed with --target
+                "--target",
+                target_dir,
+            ]
+            + (["--python-version", python_version] if python_version else [])
+            + [arg for p in platforms for arg in ["--platform", p]]
+            + (pip_extra_args.split() if pip_extra_args else [])
+            + requirements,
+            stdout=subprocess.PIPE,
+            text=True,
+            # credentials must not show up in the process list
+            env=dict(os.environ, PIP_INDEX_URL=index_url) if index_url else None,
+        )
+    res.check_returncode()
+    return json.loads(res.stdout)["install"]
+
+
+def fill_wheelhouse(
+    requirements: List[str],
+    cache_dir: str,
+    index_url: Optional[str] = None,
+    index_username: Optional[str] = None,
+    index_password: Optional[str] = None,
+    python_version: Optional[str] = None,
+    platforms: List[str] = [],
+    pip_extra_args: Optional[str] = None,
+    exclude: List[str] = [],
+    jobs: int = 8,
+) -> Dict[str, str]:
+    """
+    Resolve ``requirements`` on the host and download the wheels concurrently into
+    ``cache_dir``, which is content addressed and can be shared between builds.
+    Distributions named in ``exclude`` are skipped. Returns a mapping of wheel file
+    names to their location in the cache.
+    """
+    index_url = render_host_index_url(index_url, index_username, index_password)
+    items = [
+        item
+        for item in resolve(
+            requirements,
+            index_url=index_url,
+            python_version=python_version,
+            platforms=platforms,
+            pip_extra_args=pip_extra_args,
+        )
+        if normalize_name(item["metadata"]["name"])
+        not in {normalize_name(e) for e in exclude}
+    ]
+
+    # credentials only get sent to the index, not to hosts it links to
+    index_host = urllib.parse.urlparse(index_url).hostname if index_url else None
+
+    def download(item: Dict) -> str:
+        url = item["download_info"]["url"]
+        return _download_cached(
+            url,
+            item["download_info"]
+            .get("archive_info", {})
+            .get("hashes", {})
+            .get("sha256"),
+            cache_dir,
+            auth=(
+                (index_username, index_password)
+                if index_username and urllib.parse.urlparse(url).hostname == index_host
+                else None
+            ),
+        )
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        paths = list(executor.map(download, items))
+
+    return {os.path.basename(p): p for p in paths}
+
+
+def lock_requirements(
+    requirements: List[str],
+    index_url: Optional[str] = None,
+    index_username: Optional[str] = None,
+    index_password: Optional[str] = None,
+    python_version: Optional[str] = None,
+    platforms: List[str] = [],
+    pip_extra_args: Optional[str] = None,
+    exclude: List[str] = [],
+    requirements_file: Optional[str] = None,
+    wheel_requirements: Optional[List[str]] = None,
+) -> str:
+    """
+    Resolve ``requirements`` on the host to a lock, i.e., a requirements file
+    pinning every distribution to a version and the sha256 of its wheel, which can
+    be installed via ``pip install --require-hashes --no-deps``. Distributions named
+    in ``exclude`` are skipped. The digests of ``requirements_file`` and of the
+    ``wheel_requirements`` get recorded, see ``check_lock``.
+    """
+    lines = []
+    for item in resolve(
+        requirements,
+        index_url=render_host_index_url(index_url, index_username, index_password),
+        python_version=python_version,
+        platforms=platforms,
+        pip_extra_args=pip_extra_args,
+    ):
+        name = normalize_name(item["metadata"]["name"])
+        if name in {normalize_name(e) for e in exclude}:
+            continue
+        sha256 = (
+            item["download_info"]
+            .get("archive_info", {})
+            .get("hashes", {})
+            .get("sha256")
+        )
+        if sha256 is None:
+            raise Exception(f"No sha256 hash known for {item['download_info']['url']}")
+        lines.append(f"{name}=={item['metadata']['version']} --hash=sha256:{sha256}")
+
+    header = [LOCK_HEADER]
+    if requirements_file:
+        header.append(LOCK_REQUIREMENTS_PREFIX + file_digest(requirements_file))
+    if wheel_requirements is not None:
+        header.append(
+            LOCK_WHEEL_REQUIREMENTS_PREFIX + _requirements_digest(wheel_requirements)
+        )
+    return "".join(line + "\n" for line in header + sorted(lines))
+
+
+def check_lock(
+    lock_file: str,
+    requirements_file: Optional[str] = None,
+    wheel_requirements: Optional[List[str]] = None,
+) -> None:
+    """
+    Raise if ``lock_file`` was not resolved from ``requirements_file`` and the
+    ``wheel_requirements`` as they are. Wheels get installed without dependencies
+    from a lock, i.e., new requirements would be missing in the image.
+    """
+    recorded = {}
+    with open(lock_file) as f:
+        for line in f:
+            for prefix in [LOCK_REQUIREMENTS_PREFIX, LOCK_WHEEL_REQUIREMENTS_PREFIX]:
+                if line.startswith(prefix):
+                    recorded[prefix] = line[len(prefix) :].strip()
+
+    for prefix, expected, source in [
+        (
+            LOCK_REQUIREMENTS_PREFIX,
+            file_digest(requirements_file) if requirements_file else None,
+            requirements_file or "requirements",
+        ),
+        (
+            LOCK_WHEEL_REQUIREMENTS_PREFIX,
+            (
+                _requirements_digest(wheel_requirements)
+                if wheel_requirements is not None
+                else None
+            ),
+            "requirements of the wheel",
+        ),
+    ]:
+        if recorded.get(prefix) != expected:
+            raise Exception(
+                f"lock file {lock_file} is outdated, it was not resolved from the "
+                f"current {source}, update via --update-lock"
+            )
+
+
+def _requirements_digest(requirements: List[str]) -> str:
+    return hashlib.sha256("\n".join(sorted(requirements)).encode()).hexdigest()
+
+
+def _download_cached(
+    url: str,
+    sha256: Optional[str],
+    cache_dir: str,
+    auth: Optional[Tuple[str, Optional[str]]] = None,
+) -> str:
+    file_name = urllib.parse.unquote(os.path.basename(urllib.parse.urlparse(url).path))
+    if sha256:
+        path = os.path.join(cache_dir, sha256[:2], sha256, file_name)
+        if os.path.exists(path):
+            return path
+
+    request = urllib.request.Request(url)
+    if auth:
+        credentials = base64.b64encode(f"{auth[0]}:{auth[1] or ''}".encode()).decode()
+        # not sent along redirects, e.g., to a cdn
+        request.add_unredirected_header("Authorization", f"Basic {credentials}")
+
+    pathlib.Path(cache_dir).mkdir(parents=True, exist_ok=True)
+    h = hashlib.sha256()
+    with tempfile.NamedTemporaryFile(dir=cache_dir, delete=False) as tmp_f:
+        try:
+            with urllib.request.urlopen(request) as response:
+                for chunk in iter(lambda: response.read(1024 * 1024), b""):
+                    h.update(chunk)
+                    tmp_f.write(chunk)
+        except BaseException:
+            tmp_f.close()
+            os.remove(tmp_f.name)
+            raise
+
+    if sha256 and h.hexdigest() != sha256:
+        os.remove(tmp_f.name)
+        raise Exception(f"Hash mismatch for {url}")
+
+    path = os.path.join(cache_dir, h.hexdigest()[:2], h.hexdigest(), file_name)
+    pathlib.Path(path).parent.mkdir(parents=True, exist_ok=True)
+    os.replace(tmp_f.name, path)
+    return path
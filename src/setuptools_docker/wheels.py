@@ -0,0 +1,135 @@
+import email.parser
+import glob
+import os
+import re
+import zipfile
+from typing import List, Optional
+
+# markers which always evaluate to true/false, used for replacing extra markers
+_TRUE_MARKER = 'python_version >= "0"'
+_FALSE_MARKER = 'python_version < "0"'
+
+# machine names used in wheel platform tags for docker platforms
+PLATFORM_ARCHS = {
+    "linux/amd64": "x86_64",
+    "linux/arm64": "aarch64",
+    "linux/arm64/v8": "aarch64",
+    "linux/arm/v7": "armv7l",
+    "linux/ppc64le": "ppc64le",
+    "linux/s390x": "s390x",
+    "linux/386": "i686",
+}
+
+
+def wheel_metadata(wheel_file: str) -> email.message.Message:
+    with zipfile.ZipFile(wheel_file) as whl:
+        for name in whl.namelist():
+            if re.fullmatch(r"[^/]+\.dist-info/METADATA", name):
+                return email.parser.Parser().parsestr(whl.read(name).decode())
+
+    raise Exception(f"No metadata found in wheel: {wheel_file}")
+
+
+def wheel_dist_name(wheel_file: str) -> str:
+    return wheel_metadata(wheel_file)["Name"]
+
+
+def wheel_requirements(wheel_file: str, extras: List[str] = []) -> List[str]:
+    """
+    Requirements of a wheel including the given extras. Extra markers get resolved,
+    all other environment markers are kept for evaluation by pip within the image.
+    """
+    selected = {normalize_name(e) for e in extras}
+
+    def resolve_extra(m: re.Match) -> str:
+        return _TRUE_MARKER if normalize_name(m.group(1)) in selected else _FALSE_MARKER
+
+    requirements = []
+    for requirement in wheel_metadata(wheel_file).get_all("Requires-Dist") or []:
+        requirement = re.sub(
+            r"""extra\s*==\s*["']([^"']+)["']""", resolve_extra, requirement
+        )
+        if _FALSE_MARKER in requirement and " or " not in requirement.split(";", 1)[1]:
+            continue
+        requirements.append(requirement)
+
+    return requirements
+
+
+def normalize_name(name: str) -> str:
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+
+def normalize_platform(platform: str) -> str:
+    """Docker platform as in ``TARGETPLATFORM``, e.g., linux/arm64 for linux/arm64/v8."""
+    platform = platform.lower()
+    # default variants get dropped, as by containerd
+    return {"linux/arm64/v8": "linux/arm64", "linux/amd64/v1": "linux/amd64"}.get(
+        platform, platform
+    )
+
+
+def platform_wheel(
+    wheel_file: str, platform: str, python_version: Optional[str] = None
+) -> str:
+    """
+    The wheel to install on a docker ``platform``: ``wheel_file`` if it is pure,
+    otherwise the wheel of the same distribution and version next to it built for
+    the platform's architecture, e.g., by cibuildwheel, and for ``python_version``
+    (e.g. 3.8) of the image, if known.
+    """
+    if wheel_file.endswith("-any.whl"):
+        return wheel_file
+
+    platform = normalize_platform(platform)
+    if platform not in PLATFORM_ARCHS:
+        raise Exception(f"Unsupported platform: {platform}")
+    arch = PLATFORM_ARCHS[platform]
+
+    name_version = "-".join(os.path.basename(wheel_file).split("-")[:2])
+    for candidate in sorted(
+        glob.glob(os.path.join(os.path.dirname(wheel_file), f"{name_version}-*.whl"))
+    ):
+        python_tags, abi_tags, platform_tags = [
+            t.split(".") for t in candidate[: -len(".whl")].rsplit("-", 3)[1:]
+        ]
+        if any(
+            t.startswith(("manylinux", "linux")) and t.endswith("_" + arch)
+            for t in platform_tags
+        ) and (
+            python_version is None
+            or _supports_python(python_tags, abi_tags, python_version)
+        ):
+            return candidate
+
+    raise Exception(
+        f"No wheel for {platform}"
+        + (f" and python {python_version}" if python_version else "")
+        + f" found next to {wheel_file}"
+    )
+
+
+def _supports_python(
+    python_tags: List[str], abi_tags: List[str], python_version: str
+) -> bool:
+    """Whether CPython ``python_version`` supports one of the tag combinations."""
+    major, minor = (int(v) for v in python_version.split(".")[:2])
+    cp = f"cp{major}{minor}"
+    for python_tag in python_tags:
+        m = re.fullmatch(r"(cp|py)(\d)(\d*)", python_tag)
+        if not m or int(m.group(2)) != major:
+            continue
+        tag_minor = int(m.group(3)) if m.group(3) else None
+        for abi_tag in abi_tags:
+            if abi_tag == "abi3" and m.group(1) == "cp":
+                # stable abi of the tagged or any older python
+                if tag_minor is not None and tag_minor <= minor:
+                    return True
+            elif abi_tag == "none":
+                if python_tag == cp or (
+                    m.group(1) == "py" and (tag_minor is None or tag_minor <= minor)
+                ):
+                    return True
+            elif abi_tag.startswith(cp) and python_tag == cp:
+                return True
+    return False
@@ -0,0 +1,91 @@
+import os
+import subprocess
+import sys
+import zipfile
+
+import pytest
+
+PACKAGE_DIR = os.path.join(os.path.dirname(__file__), "..", "src", "setuptools_docker")
+
+# entrypoints running the init scripts, by the command running them
+INIT_ENTRYPOINTS = {
+    "docker-entrypoint.sh": ["bash", os.path.join(PACKAGE_DIR, "docker-entrypoint.sh")],
+    "launcher.py": [sys.executable, "-S", os.path.join(PACKAGE_DIR, "launcher.py")],
+}
+
+
+@pytest.fixture()
+def init_dir(tmp_path):
+    path = tmp_path / "init.d"
+    path.mkdir()
+    return path
+
+
+@pytest.fixture()
+def write_script(init_dir):
+    def write(name, content, executable=True):
+        path = init_dir / name
+        path.write_text("#!/bin/bash\n" + content + "\n")
+        if executable:
+            path.chmod(0o755)
+        return path
+
+    return write
+
+
+def _entrypoint_runner(entrypoint, init_dir):
+    def run(*command, **env):
+        return subprocess.run(
+            INIT_ENTRYPOINTS[entrypoint] + list(command),
+            env=dict(os.environ, **dict({"INIT_DIR": str(init_dir)}, **env)),
+            capture_output=True,
+            text=True,
+        )
+
+    return run
+
+
+@pytest.fixture()
+def run_entrypoint(init_dir):
+    return _entrypoint_runner("docker-entrypoint.sh", init_dir)
+
+
+@pytest.fixture()
+def run_launcher(init_dir):
+    return _entrypoint_runner("launcher.py", init_dir)
+
+
+@pytest.fixture(params=list(INIT_ENTRYPOINTS))
+def run_init(request, init_dir):
+    """Runs the init scripts of ``init_dir`` via either entrypoint."""
+    return _entrypoint_runner(request.param, init_dir)
+
+
+@pytest.fixture()
+def make_wheel():
+    """
+    Writes a minimal wheel into a directory and returns its path, e.g.,
+    ``make_wheel(tmp_path, "dep", "1.0", requires=["other"])``. The wheel contains
+    ``files`` (by default an empty package) and is tagged ``<python_tag>-none-any``.
+    """
+
+    def make(directory, name, version, requires=[], files=None, python_tag="py3"):
+        dist = name.replace("-", "_")
+        path = directory / f"{dist}-{version}-{python_tag}-none-any.whl"
+        with zipfile.ZipFile(path, "w") as whl:
+            for file_name, content in (files or {f"{dist}/__init__.py": ""}).items():
+                whl.writestr(file_name, content)
+            whl.writestr(
+                f"{dist}-{version}.dist-info/METADATA",
+                f"Metadata-Version: 2.1\nName: {name}\nVersion: {version}\n"
+                + "".join(f"Requires-Dist: {r}\n" for r in requires),
+            )
+            whl.writestr(
+                f"{dist}-{version}.dist-info/WHEEL",
+                "Wheel-Version: 1.0\nGenerator: test\nRoot-Is-Purelib: true\n"
+                f"Tag: {python_tag}-none-any\n",
+            )
+            whl.writestr(f"{dist}-{version}.dist-info/RECORD", "")
+        return str(path)
+
+    return make
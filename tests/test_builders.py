@@ -0,0 +1,96 @@
+import json
+import os
+
+import pytest
+from setuptools import Distribution
+
+from setuptools_docker.builders import Builder, RecordingBuilder
+from setuptools_docker.command import bdist_docker
+
+
+@pytest.fixture()
+def recording_command(tmp_path):
+    def command(**options):
+        dist = Distribution(
+            {
+                "name": "example",
+                "version": "1.0",
+                "cmdclass": {"bdist_docker": bdist_docker},
+            }
+        )
+        dist.command_options["build"] = {"build_base": ("setup.cfg", str(tmp_path))}
+        dist.command_options["bdist_docker"] = {
+            "image_builder": ("setup.cfg", "recording"),
+            **{k: ("setup.cfg", v) for k, v in options.items()},
+        }
+        cmd = dist.get_command_obj("bdist_docker")
+        cmd.ensure_finalized()
+        return cmd
+
+    return command
+
+
+@pytest.fixture()
+def wheel_file(tmp_path, make_wheel):
+    return make_wheel(tmp_path, "example", "1.0")
+
+
+def test_recording_builder(recording_command, wheel_file):
+    cmd = recording_command(environment_vars="A=1 B=2")
+    assert isinstance(cmd.image_builder, RecordingBuilder)
+
+    cmd.build(wheel_file)
+
+    [(call, args)] = cmd.image_builder.calls
+    assert call == "build"
+    assert args["image"] == "example:1.0"
+    assert args["context_path"] == cmd.build_context
+    assert args["files"]["example-1.0-py3-none-any.whl"] == os.path.getsize(wheel_file)
+    assert "Dockerfile" in args["files"]
+
+    # unchanged inputs, the built image gets reused
+    second = recording_command(environment_vars="A=1 B=2")
+    second.image_builder.images = cmd.image_builder.images
+    second.build(wheel_file)
+    assert [call for call, _ in second.image_builder.calls] == ["tag"]
+
+
+def test_recording_builder_streamed(recording_command, wheel_file):
+    cmd = recording_command(stream_context="1", pip_cache_docker="0")
+
+    cmd.build(wheel_file)
+
+    [(call, args)] = cmd.image_builder.calls
+    assert call == "build_streamed"
+    assert "example-1.0-py3-none-any.whl" in args["files"]
+    assert args["tar_size"] > os.path.getsize(wheel_file)
+    assert cmd.image_builder.image_id("example:1.0").startswith("sha256:")
+
+
+def test_report_of_failed_build(recording_command, wheel_file, tmp_path):
+    report_file = tmp_path / "report.json"
+    cmd = recording_command(build_report=str(report_file))
+
+    def build(*args, **kwargs):
+        raise Exception("build failed")
+
+    cmd.image_builder.build = build
+    with pytest.raises(Exception, match="build failed"):
+        cmd.build(wheel_file)
+
+    report = json.loads(report_file.read_text())
+    assert "bdist_docker" in [s["name"] for s in report["spans"]]
+
+
+def test_invalid_image_builder(recording_command):
+    with pytest.raises(Exception, match="Invalid image builder"):
+        recording_command(image_builder="podman")
+
+
+def test_incomplete_builder():
+    class BuildOnlyBuilder(Builder):
+        def build(self, context_path, image_name, image_tag, **kwargs):
+            pass
+
+    with pytest.raises(TypeError, match="abstract"):
+        BuildOnlyBuilder()
@@ -0,0 +1,40 @@
+from setuptools_docker.cache import BuildCache
+
+
+def test_key_changes_with_inputs(tmp_path):
+    wheel = tmp_path / "app-1.0-py3-none-any.whl"
+    wheel.write_bytes(b"wheel")
+    files = {wheel.name: str(wheel), "Dockerfile": b"FROM python"}
+    cache = BuildCache(str(tmp_path / "cache"))
+    key = cache.key(files, {"user_id": 1100})
+
+    assert key == cache.key(files, {"user_id": 1100})
+    assert key != cache.key(files, {"user_id": None})
+    assert key != cache.key(dict(files, Dockerfile=b"FROM alpine"), {"user_id": 1100})
+
+    wheel.write_bytes(b"changed wheel")
+    assert key != cache.key(files, {"user_id": 1100})
+
+
+def test_lookup_and_store(tmp_path):
+    cache = BuildCache(str(tmp_path / "cache"))
+    assert cache.lookup("key") is None
+
+    cache.store("key", "sha256:abc")
+    assert cache.lookup("key") == "sha256:abc"
+    assert BuildCache(str(tmp_path / "cache")).lookup("key") == "sha256:abc"
+
+    cache.invalidate("key")
+    assert cache.lookup("key") is None
+
+
+def test_lru_eviction(tmp_path):
+    cache = BuildCache(str(tmp_path / "cache"), max_entries=2)
+    cache.store("a", "image-a")
+    cache.store("b", "image-b")
+    cache.lookup("a")
+    cache.store("c", "image-c")
+
+    assert cache.lookup("a") == "image-a"
+    assert cache.lookup("b") is None
+    assert cache.lookup("c") == "image-c"
@@ -1,6 +1,17 @@
+import json
+import os
+from distutils.errors import DistutilsExecError, DistutilsOptionError
+
 import pytest
+from setuptools import Distribution
 
-from setuptools_docker.command import _parse_envvars, _parse_list
+from setuptools_docker.command import (
+    _parse_envvars,
+    _parse_extra_files,
+    _parse_list,
+    bdist_docker,
+    bdist_docker_batch,
+)
 
 
 @pytest.mark.parametrize(
@@ -49,3 +60,223 @@ def test_envars_parsing_e2e():
 
     """
     assert _parse_envvars(_parse_list(s)) == [("BLA", '"!@#$%^&*()=')]
+
+
+@pytest.fixture()
+def variants_distribution(tmp_path):
+    dist = Distribution(
+        {
+            "name": "example",
+            "version": "1.0",
+            "cmdclass": {
+                "bdist_docker": bdist_docker,
+                "bdist_docker_batch": bdist_docker_batch,
+            },
+        }
+    )
+    dist.command_options["build"] = {"build_base": ("setup.cfg", str(tmp_path))}
+    dist.command_options["bdist_docker"] = {
+        "user_id": ("setup.cfg", "1100"),
+        "base_image": ("setup.cfg", "python:3.8-slim-bullseye"),
+    }
+    dist.command_options["bdist_docker:slim"] = {}
+    dist.command_options["bdist_docker:alpine"] = {
+        "base_image": ("setup.cfg", "python:3.8-alpine"),
+        "pip_cache_docker": ("setup.cfg", "false"),
+    }
+    return dist
+
+
+def test_batch_variant_options(variants_distribution, tmp_path):
+    cmd = bdist_docker_batch(variants_distribution)
+    cmd.ensure_finalized()
+    assert cmd.variants == ["slim", "alpine"]
+
+    alpine = cmd._variant_command("alpine")
+    assert alpine.base_image == "python:3.8-alpine"
+    assert alpine.user_id == "1100"
+    assert not alpine.pip_cache_docker
+    assert alpine.image_tag == "1.0-alpine"
+    assert alpine.build_context == str(tmp_path / "docker-variants" / "alpine")
+    # wheels get resolved for the image, not for the host
+    assert alpine.wheelhouse_platforms[0].startswith("manylinux_2_31_")
+
+
+def test_batch_shared_options(variants_distribution, tmp_path):
+    variants_distribution.command_options["bdist_docker"].update(
+        {
+            "build_context": ("setup.cfg", str(tmp_path / "context")),
+            "image_tag": ("setup.cfg", "edge"),
+        }
+    )
+    cmd = bdist_docker_batch(variants_distribution)
+    cmd.ensure_finalized()
+
+    slim = cmd._variant_command("slim")
+    alpine = cmd._variant_command("alpine")
+    assert (slim.image_tag, alpine.image_tag) == ("edge-slim", "edge-alpine")
+    assert slim.build_context == str(tmp_path / "context" / "slim")
+    assert alpine.build_context == str(tmp_path / "context" / "alpine")
+
+
+def test_batch_variants_sharing_tag(variants_distribution, monkeypatch):
+    for variant in ["slim", "alpine"]:
+        variants_distribution.command_options[f"bdist_docker:{variant}"][
+            "image_tag"
+        ] = ("setup.cfg", "edge")
+    monkeypatch.setattr(bdist_docker_batch, "run_command", lambda self, cmd: None)
+
+    cmd = bdist_docker_batch(variants_distribution)
+    cmd.ensure_finalized()
+    with pytest.raises(DistutilsOptionError, match="image_tag"):
+        cmd.run()
+
+
+def test_batch_failing_variant(variants_distribution, monkeypatch):
+    built = []
+
+    def build(self, wheel_file, log_prefix=None):
+        built.append(log_prefix)
+        if self.base_image.endswith("alpine"):
+            raise Exception("build failed")
+
+    monkeypatch.setattr(bdist_docker, "build", build)
+    monkeypatch.setattr(bdist_docker_batch, "run_command", lambda self, cmd: None)
+
+    cmd = bdist_docker_batch(variants_distribution)
+    cmd.ensure_finalized()
+    with pytest.raises(DistutilsExecError, match="alpine"):
+        cmd.run()
+    assert sorted(built) == ["alpine", "slim"]
+
+
+def test_cache_options(variants_distribution, tmp_path):
+    variants_distribution.command_options["bdist_docker"].update(
+        {
+            "cache_from": ("setup.cfg", "local registry"),
+            "cache_to": ("setup.cfg", "local"),
+        }
+    )
+    cmd = variants_distribution.get_command_obj("bdist_docker")
+    cmd.ensure_finalized()
+
+    cache_dir = tmp_path / "buildkit-cache" / "example"
+    assert cmd.cache_from == [
+        f"type=local,src={cache_dir}",
+        "type=registry,ref=example:buildcache",
+    ]
+    assert cmd.cache_to == f"type=local,dest={cache_dir},mode=max"
+
+
+def test_extra_files_parsing():
+    assert _parse_extra_files(["conf/app.ini:/etc/app.ini"]) == [
+        ("conf/app.ini", "/etc/app.ini")
+    ]
+    with pytest.raises(Exception):
+        _parse_extra_files(["conf/app.ini"])
+
+
+def test_plan_output(variants_distribution, tmp_path):
+    wheel_file = tmp_path / "example-1.0-py3-none-any.whl"
+    wheel_file.write_bytes(b"wheel")
+    plan_output = tmp_path / "plan" / "plan.json"
+    variants_distribution.command_options["bdist_docker"]["plan_output"] = (
+        "setup.cfg",
+        str(plan_output),
+    )
+    cmd = variants_distribution.get_command_obj("bdist_docker")
+    cmd.ensure_finalized()
+
+    cmd.build(str(wheel_file))
+
+    plan = json.loads(plan_output.read_text())
+    assert plan["key"] == cmd.plan(str(wheel_file)).key()
+    assert "Dockerfile" in [f["name"] for f in plan["files"]]
+    assert "USER 1100" in cmd.plan(str(wheel_file)).dockerfile
+
+
+@pytest.mark.parametrize(
+    "options, error",
+    [
+        (
+            {"stream_context": "1", "native_build": "1", "pip_cache_docker": "0"},
+            "does not support native-build",
+        ),
+        ({"native_build": "1", "pip_cache_docker": "false"}, "pip-cache-docker"),
+    ],
+)
+def test_native_build_conflicts(variants_distribution, options, error):
+    variants_distribution.command_options["bdist_docker"].update(
+        {k: ("setup.cfg", v) for k, v in options.items()}
+    )
+    cmd = variants_distribution.get_command_obj("bdist_docker")
+    with pytest.raises(Exception, match=error):
+        cmd.ensure_finalized()
+
+
+@pytest.mark.parametrize(
+    "option, value",
+    [
+        ("layering", "split"),
+        ("compile_bytecode", "1"),
+        ("prune_venv", "1"),
+        ("runtime_profile", "throughput"),
+        ("extra_files", "app.ini:/etc/app.ini"),
+        ("installer", "uv"),
+        ("platforms", "linux/arm64"),
+    ],
+)
+def test_oci_unsupported_options(variants_distribution, option, value):
+    variants_distribution.command_options["bdist_docker"].update(
+        {
+            "backend": ("setup.cfg", "oci"),
+            "base_image_layout": ("setup.cfg", "build/base"),
+            option: ("setup.cfg", value),
+        }
+    )
+    cmd = variants_distribution.get_command_obj("bdist_docker")
+    with pytest.raises(DistutilsOptionError, match=option.replace("_", "-")):
+        cmd.ensure_finalized()
+
+
+def test_plan_without_side_effects(variants_distribution, tmp_path):
+    wheel_file = tmp_path / "example-1.0-py3-none-any.whl"
+    wheel_file.write_bytes(b"wheel")
+    lock_file = tmp_path / "requirements.lock"
+    variants_distribution.command_options["bdist_docker"].update(
+        {
+            "lock_file": ("setup.cfg", str(lock_file)),
+            # resolving would fail, as this index does not exist
+            "index_url": ("setup.cfg", "http://127.0.0.1:9/simple"),
+        }
+    )
+    cmd = variants_distribution.get_command_obj("bdist_docker")
+    cmd.wheelhouse = True
+    cmd.ensure_finalized()
+
+    plan = cmd.plan(str(wheel_file))
+
+    assert plan.planned == ("requirements.lock", "wheelhouse")
+    assert "--no-index --find-links wheelhouse" in plan.dockerfile
+    assert "--require-hashes" in plan.dockerfile
+    assert not lock_file.exists()
+    assert sorted(os.listdir(tmp_path)) == ["example-1.0-py3-none-any.whl"]
+
+
+@pytest.mark.parametrize("warn", [False, True])
+def test_context_budget(variants_distribution, warn):
+    variants_distribution.command_options["bdist_docker"]["context_budget"] = (
+        "setup.cfg",
+        "1K",
+    )
+    cmd = variants_distribution.get_command_obj("bdist_docker")
+    cmd.context_budget_warn = warn
+    cmd.ensure_finalized()
+
+    assert cmd.context_budget == 1024
+    cmd._check_context_size(1024)
+    if warn:
+        cmd._check_context_size(1025)
+    else:
+        with pytest.raises(Exception, match="exceeds budget"):
+            cmd._check_context_size(1025)
@@ -7,8 +7,17 @@ import docker
 import requests
 import time
 import socket
-
-from setuptools_docker.docker import _render_index_url, prepare_context, build_image
+import subprocess
+
+from setuptools_docker.docker import (
+    _build_command,
+    _template,
+    _render_index_url,
+    build_image,
+    cache_spec,
+    prepare_context,
+    render_context,
+)
 from requests.exceptions import ConnectionError
 
 
@@ -105,7 +114,229 @@ def test_render_index_url(url, user, pw, expected_url):
     assert res_url == expected_url
 
 
-def build_and_inspect_test_image(docker_client, target=None, **kwargs):
+@pytest.mark.parametrize(
+    "spec, export, expected",
+    [
+        ("registry", False, "type=registry,ref=ghcr.io/org/app:buildcache"),
+        ("registry", True, "type=registry,ref=ghcr.io/org/app:buildcache,mode=max"),
+        ("local", False, "type=local,src=build/cache"),
+        ("local", True, "type=local,dest=build/cache,mode=max"),
+        ("inline", False, "type=registry,ref=ghcr.io/org/app:1.0"),
+        ("inline", True, "type=inline"),
+        ("type=gha,scope=app", True, "type=gha,scope=app"),
+        ("ghcr.io/org/app:cache", False, "ghcr.io/org/app:cache"),
+    ],
+)
+def test_cache_spec(spec, export, expected):
+    assert cache_spec(spec, "ghcr.io/org/app", "1.0", "build/cache", export) == expected
+
+
+def test_cache_spec_invalid():
+    with pytest.raises(Exception):
+        cache_spec("mode=max", "app", "1.0", "build/cache")
+
+
+@pytest.mark.parametrize(
+    "cache_from, cache_to, expected",
+    [
+        ([], None, ["docker", "build"]),
+        (
+            ["type=local,src=c", "app:1.0"],
+            "type=inline",
+            [
+                "docker",
+                "buildx",
+                "build",
+                "--load",
+                "--cache-from",
+                "type=local,src=c",
+                "--cache-from",
+                "app:1.0",
+                "--cache-to",
+                "type=inline",
+            ],
+        ),
+    ],
+)
+def test_build_command(cache_from, cache_to, expected):
+    assert _build_command(cache_from, cache_to) == expected
+
+
+def test_build_command_platforms():
+    assert _build_command([], None, ["linux/amd64", "linux/arm64"], push=True) == [
+        "docker",
+        "buildx",
+        "build",
+        "--push",
+        "--platform",
+        "linux/amd64,linux/arm64",
+    ]
+
+
+@pytest.mark.parametrize(
+    "jobs, expected_makeflags",
+    [(None, 'MAKEFLAGS="-j$(nproc)"'), (4, 'MAKEFLAGS="-j4"')],
+)
+def test_native_build(test_wheel_path, jobs, expected_makeflags):
+    context_files, _ = render_context(
+        test_wheel_path, native_build=True, native_build_jobs=jobs
+    )
+    dockerfile = context_files["Dockerfile"].decode()
+
+    assert "ccache" in dockerfile
+    assert "--mount=type=cache,target=/root/.cache/ccache" in dockerfile
+    assert "--mount=type=cache,target=/root/.cache/pip" in dockerfile
+    assert expected_makeflags in dockerfile
+
+
+def test_native_build_without_pip_cache(test_wheel_path):
+    with pytest.raises(Exception, match="requires pip_cache"):
+        render_context(test_wheel_path, pip_cache=False, native_build=True)
+
+
+@pytest.mark.parametrize(
+    "profile, expected, unexpected",
+    [
+        ("default", [], ["LD_PRELOAD", "MALLOC_"]),
+        ("throughput", ["libjemalloc2", 'LD_PRELOAD="/usr/local/lib/libjemalloc'], []),
+        ("low-memory", ['MALLOC_ARENA_MAX="2"'], ["LD_PRELOAD"]),
+    ],
+)
+def test_runtime_profile(test_wheel_path, profile, expected, unexpected):
+    context_files, _ = render_context(test_wheel_path, runtime_profile=profile)
+    runtime_stage = context_files["Dockerfile"].decode().split("FROM python")[-1]
+
+    for s in expected:
+        assert s in runtime_stage
+    for s in unexpected:
+        assert s not in runtime_stage
+
+
+def test_runtime_profile_invalid(test_wheel_path):
+    with pytest.raises(Exception, match="runtime profile"):
+        render_context(test_wheel_path, runtime_profile="fast")
+
+
+@pytest.mark.parametrize(
+    "installer,expected,unexpected",
+    [
+        ("pip", ["pip install", "target=/root/.cache/pip"], ["uv", "--compile"]),
+        (
+            "uv",
+            [
+                "COPY --from=ghcr.io/astral-sh/uv:",
+                "UV_LINK_MODE=copy",
+                "target=/root/.cache/uv",
+                "uv pip install",
+                "--compile-bytecode",
+                "-i https://user:$(cat /run/secrets/INDEX_PASSWORD)@pypi.example.com",
+            ],
+            ["RUN pip install"],
+        ),
+    ],
+)
+def test_installer(test_wheel_path, installer, expected, unexpected):
+    context_files, secrets = render_context(
+        test_wheel_path,
+        installer=installer,
+        index_url="https://pypi.example.com/simple",
+        index_username="user",
+        index_password="secret",
+    )
+    dockerfile = context_files["Dockerfile"].decode()
+
+    assert secrets == {"INDEX_PASSWORD": "secret"}
+    for s in expected:
+        assert s in dockerfile
+    for s in unexpected:
+        assert s not in dockerfile
+
+
+def test_index_proxy_url(test_wheel_path):
+    context_files, secrets = render_context(
+        test_wheel_path,
+        index_url="https://pypi.example.com/simple",
+        index_username="user",
+        index_password="secret",
+        index_proxy_url="http://127.0.0.1:4321/simple/",
+    )
+    dockerfile = context_files["Dockerfile"].decode()
+
+    # the varying url of the proxy is no part of the Dockerfile
+    assert secrets == {"INDEX_URL": "http://127.0.0.1:4321/simple/"}
+    assert "--mount=type=secret,id=INDEX_URL" in dockerfile
+    assert "-i $(cat /run/secrets/INDEX_URL)" in dockerfile
+    assert "pypi.example.com" not in dockerfile
+    assert "INDEX_PASSWORD" not in dockerfile
+
+
+def test_minimal_runtime(test_wheel_path):
+    context_files, _ = render_context(
+        test_wheel_path, minimal_runtime=True, user_id=1000, command=["-m", "app"]
+    )
+    dockerfile = context_files["Dockerfile"].decode()
+    runtime_stage = dockerfile.split("FROM gcr.io/distroless/static-debian11")[-1]
+
+    assert "launcher.py" in context_files
+    assert "docker-entrypoint.sh" not in context_files
+    assert "venvtool.py runtime-closure /runtime-closure /app" in dockerfile
+    assert "COPY --from=runtime-closure /runtime-closure/ /" in runtime_stage
+    assert "RUN " not in runtime_stage
+    assert "USER 1000" in runtime_stage
+    assert (
+        'ENTRYPOINT ["/app/venv/bin/python", "-S", "/app/launcher.py", "python"]'
+        in runtime_stage
+    )
+
+
+def test_minimal_runtime_os_packages(test_wheel_path):
+    with pytest.raises(Exception, match="minimal-runtime"):
+        render_context(
+            test_wheel_path, minimal_runtime=True, runtime_profile="throughput"
+        )
+
+
+def test_template_compiled_once():
+    assert _template() is _template()
+
+
+def test_custom_template(tmp_path, test_wheel_path):
+    template = tmp_path / "custom.j2"
+    template.write_text(
+        "\n".join(
+            [
+                '{% extends "Dockerfile.j2" %}',
+                "{% block stages %}",
+                "FROM node:18 AS assets",
+                "{% endblock %}",
+                "{% block runtime_setup %}",
+                "COPY --from=assets /assets /app/assets",
+                "{% endblock %}",
+            ]
+        )
+    )
+    extra_file = tmp_path / "app.conf"
+    extra_file.write_text("")
+
+    context_files, _ = render_context(
+        test_wheel_path,
+        template=str(template),
+        extra_files=[(str(extra_file), "/etc/app.conf")],
+    )
+    dockerfile = context_files["Dockerfile"].decode()
+
+    assert context_files["extra-files/0/app.conf"] == str(extra_file)
+    assert "COPY extra-files/0/app.conf /etc/app.conf" in dockerfile
+    assert dockerfile.index("FROM node:18 AS assets") < dockerfile.index(
+        "FROM python:3.8-slim-bullseye"
+    )
+    assert dockerfile.index("COPY --from=assets") < dockerfile.index("ENTRYPOINT")
+    assert _template(str(template)) is _template(str(template))
+
+
+def build_and_inspect_test_image(
+    docker_client, target=None, cache_from=[], cache_to=None, **kwargs
+):
     secrets = prepare_context(**kwargs)
     build_image(
         context_path=kwargs.get("context_path"),
@@ -114,6 +345,8 @@ def build_and_inspect_test_image(docker_client, target=None, **kwargs):
         target=target,
         secrets=secrets,
         extra_docker_args=["--network", "host"],
+        cache_from=cache_from,
+        cache_to=cache_to,
     )
 
     return docker_client.inspect_image("setuptools-docker-unittest:latest")
@@ -317,3 +550,43 @@ def test_private_registry(test_context_dir, test_wheel_path, docker_client, pypi
 
     assert "gunicorn" in output
     assert "gevent" in output
+
+
+def _buildx_driver():
+    try:
+        res = subprocess.run(
+            ["docker", "buildx", "inspect"], capture_output=True, text=True
+        )
+    except FileNotFoundError:
+        return None
+    for line in res.stdout.splitlines():
+        if line.startswith("Driver:"):
+            return line.split(":", 1)[1].strip()
+    return None
+
+
+@pytest.mark.skipif(
+    _buildx_driver() in (None, "docker"),
+    reason="cache export to local needs a buildx builder like docker-container",
+)
+def test_local_build_cache(tmp_dir, test_context_dir, test_wheel_path, docker_client):
+    cache_dir = os.path.join(tmp_dir, "buildkit-cache")
+
+    build_and_inspect_test_image(
+        docker_client,
+        context_path=test_context_dir,
+        wheel_file=test_wheel_path,
+        cache_to=f"type=local,dest={cache_dir},mode=max",
+    )
+    assert os.path.exists(os.path.join(cache_dir, "index.json"))
+
+    image_info = build_and_inspect_test_image(
+        docker_client,
+        context_path=test_context_dir,
+        wheel_file=test_wheel_path,
+        cache_from=[f"type=local,src={cache_dir}"],
+    )
+    assert image_info["Config"]["Entrypoint"] == [
+        "/app/docker-entrypoint.sh",
+        "python",
+    ]
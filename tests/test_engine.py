@@ -0,0 +1,89 @@
+import io
+import json
+import tarfile
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from setuptools_docker.engine import build_image_streamed, iter_context_tar
+
+
+class FakeEngineHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = b""
+        while True:
+            size = int(self.rfile.readline().strip(), 16)
+            body += self.rfile.read(size)
+            self.rfile.readline()
+            if size == 0:
+                break
+
+        self.server.requests.append((self.path, self.headers, body))
+        failing = "fail" in self.path
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(json.dumps({"stream": "Step 1/1 : FROM python\n"}).encode())
+        self.wfile.write(b"\r\n")
+        if failing:
+            self.wfile.write(json.dumps({"error": "step failed"}).encode())
+        else:
+            self.wfile.write(json.dumps({"aux": {"ID": "sha256:abc"}}).encode())
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture()
+def fake_engine():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeEngineHandler)
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+
+
+def test_iter_context_tar(tmp_path):
+    wheel = tmp_path / "app.whl"
+    wheel.write_bytes(b"w" * 1000)
+    data = b"".join(iter_context_tar({"app.whl": str(wheel), "Dockerfile": b"FROM x"}))
+
+    with tarfile.open(fileobj=io.BytesIO(data)) as tar:
+        assert tar.getnames() == ["Dockerfile", "app.whl"]
+        assert tar.extractfile("app.whl").read() == b"w" * 1000
+        assert tar.extractfile("Dockerfile").read() == b"FROM x"
+
+
+def test_build_image_streamed(tmp_path, fake_engine, capsys):
+    wheel = tmp_path / "app.whl"
+    wheel.write_bytes(b"wheel")
+    docker_host = f"tcp://127.0.0.1:{fake_engine.server_port}"
+
+    built_image = build_image_streamed(
+        {"app.whl": str(wheel), "Dockerfile": b"FROM python"},
+        image_name="app",
+        image_tag="1.0",
+        docker_host=docker_host,
+        log_prefix="app",
+    )
+
+    assert built_image == "sha256:abc"
+    assert "[app] Step 1/1 : FROM python" in capsys.readouterr().out
+    path, headers, body = fake_engine.requests[0]
+    assert urllib.parse.parse_qs(urllib.parse.urlparse(path).query)["t"] == ["app:1.0"]
+    assert headers["Content-Type"] == "application/x-tar"
+    with tarfile.open(fileobj=io.BytesIO(body)) as tar:
+        assert tar.getnames() == ["Dockerfile", "app.whl"]
+
+
+def test_build_image_streamed_error(fake_engine):
+    with pytest.raises(Exception, match="step failed"):
+        build_image_streamed(
+            {"Dockerfile": b"FROM python"},
+            image_name="fail",
+            image_tag="1.0",
+            docker_host=f"tcp://127.0.0.1:{fake_engine.server_port}",
+        )
@@ -0,0 +1,16 @@
+def test_sourced_scripts_export_variables(run_entrypoint, write_script):
+    write_script("10-env.sh", "export GREETING=hello", executable=False)
+    write_script("10-other.sh", "true")
+
+    res = run_entrypoint("bash", "-c", "echo $GREETING")
+    assert res.returncode == 0
+    assert res.stdout.splitlines()[-1] == "hello"
+
+
+def test_other_files_ignored(run_entrypoint, write_script):
+    write_script("readme.txt", "exit 1")
+
+    res = run_entrypoint("true")
+
+    assert res.returncode == 0
+    assert "ignoring" in res.stderr
@@ -0,0 +1,244 @@
+import base64
+import hashlib
+import os
+import pathlib
+import re
+import subprocess
+import sys
+import threading
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from setuptools_docker.indexproxy import IndexProxy
+
+CREDENTIALS = "Basic " + base64.b64encode(b"user:secret").decode()
+
+
+class FakeIndexHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        if self.server.status is not None:
+            self._send(self.server.status, b"")
+            return
+        if self.headers["Authorization"] != CREDENTIALS:
+            self._send(401, b"")
+            return
+
+        if self.path == "/simple/cdn/":
+            # files hosted elsewhere, linked directly or redirected to
+            cdn_url = self.server.cdn.url
+            links = (
+                f'<a href="{cdn_url}/cdn-1.0.tar.gz">cdn-1.0.tar.gz</a>'
+                '<a href="/redirect/cdn-2.0.tar.gz">cdn-2.0.tar.gz</a>'
+            )
+            self._send(200, f"<html><body>{links}</body></html>".encode())
+            return
+
+        if self.path == "/simple/quoted/":
+            links = (
+                "<a href='../../packages/big-1.0.tar.gz'>big-1.0.tar.gz</a>"
+                "<a HREF=../../packages/big-2.0.tar.gz>big-2.0.tar.gz</a>"
+            )
+            self._send(200, f"<html><body>{links}</body></html>".encode())
+            return
+
+        m = re.fullmatch(r"/redirect/([^/]+)", self.path)
+        if m:
+            self.send_response(302)
+            self.send_header("Location", f"{self.server.cdn.url}/{m.group(1)}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        m = re.fullmatch(r"/simple/([^/]+)/", self.path)
+        if m and m.group(1) in self.server.projects:
+            links = "".join(
+                f'<a href="../../packages/{name}#sha256={_sha256(content)}">{name}</a>'
+                for name, content in self.server.projects[m.group(1)].items()
+            )
+            self._send(200, f"<html><body>{links}</body></html>".encode())
+            return
+
+        m = re.fullmatch(r"/packages/([^/]+)", self.path)
+        files = {n: c for p in self.server.projects.values() for n, c in p.items()}
+        if m and m.group(1) in files:
+            self._send(200, files[m.group(1)])
+            return
+        self._send(404, b"")
+
+    def _send(self, status, body):
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeCdnHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.requests.append((self.path, self.headers["Authorization"]))
+        body = b"cdn"
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def _sha256(content):
+    return hashlib.sha256(content).hexdigest()
+
+
+@pytest.fixture()
+def fake_index(tmp_path, make_wheel):
+    wheel = pathlib.Path(make_wheel(tmp_path, "hello", "0.1"))
+    cdn = ThreadingHTTPServer(("127.0.0.1", 0), FakeCdnHandler)
+    cdn.requests = []
+    cdn.url = f"http://127.0.0.1:{cdn.server_port}"
+    threading.Thread(target=cdn.serve_forever, daemon=True).start()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeIndexHandler)
+    server.requests = []
+    server.status = None
+    server.cdn = cdn
+    server.projects = {
+        "hello": {wheel.name: wheel.read_bytes()},
+        "big": {"big-1.0.tar.gz": b"x" * 1000, "big-2.0.tar.gz": b"y" * 1000},
+    }
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    cdn.shutdown()
+
+
+def proxy_for(fake_index, tmp_path, **kwargs):
+    return IndexProxy(
+        f"http://127.0.0.1:{fake_index.server_port}/simple",
+        str(tmp_path / "cache"),
+        username="user",
+        password="secret",
+        **kwargs,
+    )
+
+
+def get(url):
+    with urllib.request.urlopen(url) as response:
+        return response.read()
+
+
+def test_pip_download_via_proxy(fake_index, tmp_path):
+    with proxy_for(fake_index, tmp_path) as proxy_url:
+        for dest in ["first", "second"]:
+            subprocess.run(
+                [sys.executable, "-m", "pip", "download", "--no-deps", "-q"]
+                + ["--no-cache-dir", "-i", proxy_url, "-d", str(tmp_path / dest)]
+                + ["hello"],
+                check=True,
+            )
+            assert os.listdir(tmp_path / dest) == ["hello-0.1-py3-none-any.whl"]
+
+    # the file got downloaded from the index once, the proxy had the credentials
+    assert fake_index.requests.count("/packages/hello-0.1-py3-none-any.whl") == 1
+
+
+def test_links_rewritten(fake_index, tmp_path):
+    with proxy_for(fake_index, tmp_path) as proxy_url:
+        page = get(proxy_url + "big/").decode()
+        links = re.findall(r'href="([^"]+)"', page)
+
+        assert len(links) == 2
+        assert all(link.startswith("/files/") for link in links)
+        assert links[0].endswith("/big-1.0.tar.gz#sha256=" + _sha256(b"x" * 1000))
+        assert get(proxy_url.replace("/simple/", "") + links[0]) == b"x" * 1000
+
+        with pytest.raises(urllib.error.HTTPError) as e:
+            get(proxy_url + "unknown/")
+        assert e.value.code == 404
+
+
+def test_eviction(fake_index, tmp_path):
+    with proxy_for(fake_index, tmp_path, max_size=1500) as proxy_url:
+        base_url = proxy_url.replace("/simple/", "")
+        links = re.findall(r'href="([^"#]+)', get(proxy_url + "big/").decode())
+        get(base_url + links[0])
+        get(base_url + links[1])
+
+    # least recently used file got evicted
+    files_dir = tmp_path / "cache" / "files"
+    assert [f.read_bytes() for f in files_dir.iterdir()] == [b"y" * 1000]
+
+
+def test_stale_page_served_if_index_unavailable(fake_index, tmp_path):
+    with proxy_for(fake_index, tmp_path) as proxy_url:
+        page = get(proxy_url + "hello/")
+
+    fake_index.shutdown()
+    fake_index.server_close()
+    # outdated
+    os.utime(tmp_path / "cache" / "pages" / "hello.html", (0, 0))
+
+    with proxy_for(fake_index, tmp_path) as proxy_url:
+        assert get(proxy_url + "hello/") == page
+
+
+@pytest.mark.parametrize("status", [502, 503])
+def test_stale_page_served_on_server_error(fake_index, tmp_path, status):
+    with proxy_for(fake_index, tmp_path) as proxy_url:
+        page = get(proxy_url + "hello/")
+
+    fake_index.status = status
+    os.utime(tmp_path / "cache" / "pages" / "hello.html", (0, 0))
+
+    with proxy_for(fake_index, tmp_path) as proxy_url:
+        assert get(proxy_url + "hello/") == page
+        # client errors are passed on
+        fake_index.status = 404
+        os.utime(tmp_path / "cache" / "pages" / "hello.html", (0, 0))
+        with pytest.raises(urllib.error.HTTPError) as e:
+            get(proxy_url + "hello/")
+        assert e.value.code == 404
+
+
+def test_quoting_of_links(fake_index, tmp_path):
+    with proxy_for(fake_index, tmp_path) as proxy_url:
+        base_url = proxy_url.replace("/simple/", "")
+        page = get(proxy_url + "quoted/").decode()
+        links = re.findall(r'href="([^"]+)"', page)
+
+        assert len(links) == 2
+        assert [get(base_url + link) for link in links] == [b"x" * 1000, b"y" * 1000]
+
+
+def test_credentials_only_sent_to_index(fake_index, tmp_path):
+    with proxy_for(fake_index, tmp_path) as proxy_url:
+        base_url = proxy_url.replace("/simple/", "")
+        links = re.findall(r'href="([^"#]+)', get(proxy_url + "cdn/").decode())
+        assert [get(base_url + link) for link in links] == [b"cdn", b"cdn"]
+
+    assert fake_index.cdn.requests == [
+        ("/cdn-1.0.tar.gz", None),
+        ("/cdn-2.0.tar.gz", None),
+    ]
+
+
+def test_only_linked_files_served(fake_index, tmp_path):
+    with proxy_for(fake_index, tmp_path) as proxy_url:
+        base_url = proxy_url.replace("/simple/", "")
+        for url in [
+            fake_index.cdn.url + "/secret",
+            f"http://127.0.0.1:{fake_index.server_port}/packages/big-1.0.tar.gz",
+        ]:
+            token = base64.urlsafe_b64encode(url.encode()).decode()
+            with pytest.raises(urllib.error.HTTPError) as e:
+                get(f"{base_url}/files/{token}/file.tar.gz")
+            assert e.value.code == 404
+
+    assert fake_index.cdn.requests == []
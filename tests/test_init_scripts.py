@@ -0,0 +1,80 @@
+import json
+import time
+
+
+def test_no_init_scripts(run_init, tmp_path):
+    res = run_init("echo", "hello", INIT_DIR=str(tmp_path / "missing"))
+    assert res.returncode == 0
+    assert res.stdout == "hello\n"
+
+
+def test_phases_run_concurrently_and_in_order(run_init, write_script, tmp_path):
+    out = tmp_path / "out"
+    write_script("10-a.sh", f"sleep 0.5; echo a >> {out}")
+    write_script("10-b.sh", f"sleep 0.5; echo b >> {out}")
+    write_script("20-c.sh", f"echo c >> {out}")
+
+    start = time.monotonic()
+    res = run_init("true", INIT_PARALLEL="1")
+
+    assert res.returncode == 0
+    assert time.monotonic() - start < 0.95
+    assert sorted(out.read_text().split()[:2]) == ["a", "b"]
+    assert out.read_text().split()[2] == "c"
+
+
+def test_phases_run_sequentially_by_default(run_init, write_script, tmp_path):
+    out = tmp_path / "out"
+    write_script("10-a.sh", f"sleep 0.2; echo a >> {out}")
+    write_script("10-b.sh", f"echo b >> {out}")
+
+    assert run_init("true").returncode == 0
+    assert out.read_text().split() == ["a", "b"]
+
+
+def test_scripts_without_phase_run_sequentially(run_init, write_script, tmp_path):
+    out = tmp_path / "out"
+    write_script("b.sh", f"echo b >> {out}")
+    write_script("a.sh", f"sleep 0.2; echo a >> {out}")
+
+    assert run_init("true", INIT_PARALLEL="1").returncode == 0
+    assert out.read_text().split() == ["a", "b"]
+
+
+def test_fail_fast(run_init, write_script, tmp_path):
+    out = tmp_path / "out"
+    write_script("10-fails.sh", "sleep 0.1; exit 3")
+    write_script("10-slow.sh", f"sleep 5; echo slow >> {out}")
+    write_script("20-next.sh", f"echo next >> {out}")
+
+    start = time.monotonic()
+    res = run_init("echo", "started", INIT_PARALLEL="1")
+
+    assert res.returncode == 3
+    assert time.monotonic() - start < 4
+    assert "started" not in res.stdout
+    assert not out.exists()
+
+
+def test_json_log(run_init, write_script):
+    write_script("10-a.sh", "true")
+
+    res = run_init("true", INIT_LOG_FORMAT="json")
+
+    assert res.returncode == 0
+    (line,) = res.stdout.splitlines()
+    record = json.loads(line)
+    assert record["event"] == "init_script"
+    assert record["script"].endswith("10-a.sh")
+    assert record["phase"] == "10"
+    assert record["exit_code"] == 0
+    assert record["duration_ms"] >= 0
+
+
+def test_json_log_escapes_script(run_init, write_script):
+    write_script('10-say "hi"\\.sh', "true")
+
+    res = run_init("true", INIT_LOG_FORMAT="json")
+
+    assert res.returncode == 0
+    assert json.loads(res.stdout)["script"].endswith('10-say "hi"\\.sh')
@@ -0,0 +1,12 @@
+import json
+
+
+def test_not_executable(run_launcher, write_script):
+    write_script("10-env.sh", "", executable=False)
+
+    res = run_launcher("true", INIT_LOG_FORMAT="json")
+
+    assert res.returncode == 1
+    record = json.loads(res.stdout)
+    assert record["script"].endswith("10-env.sh")
+    assert record["error"] == "not executable"
@@ -0,0 +1,234 @@
+import gzip
+import hashlib
+import io
+import json
+import os
+import sys
+import tarfile
+
+import pytest
+
+from setuptools_docker.oci import (
+    MEDIA_TYPE_CONFIG,
+    MEDIA_TYPE_MANIFEST,
+    build_oci_image,
+    read_blob,
+    write_image_layout,
+    write_json_blob,
+    write_layer_blob,
+)
+from setuptools_docker.wheelhouse import pip_platforms
+
+
+@pytest.fixture()
+def base_layout(tmp_path):
+    layout = tmp_path / "base"
+    blobs_dir = layout / "blobs" / "sha256"
+    blobs_dir.mkdir(parents=True)
+
+    layer, diff_id = write_layer_blob(str(blobs_dir), {"etc/os-release": b"ID=test\n"})
+    config = write_json_blob(
+        str(blobs_dir),
+        {
+            "architecture": "amd64",
+            "os": "linux",
+            "config": {"Env": ["PATH=/usr/bin", "LANG=C.UTF-8"], "WorkingDir": "/"},
+            "rootfs": {"type": "layers", "diff_ids": [diff_id]},
+        },
+        MEDIA_TYPE_CONFIG,
+    )
+    manifest = write_json_blob(
+        str(blobs_dir),
+        {
+            "schemaVersion": 2,
+            "mediaType": MEDIA_TYPE_MANIFEST,
+            "config": config,
+            "layers": [layer],
+        },
+        MEDIA_TYPE_MANIFEST,
+    )
+    (layout / "index.json").write_text(
+        json.dumps({"schemaVersion": 2, "manifests": [manifest]})
+    )
+    return str(layout)
+
+
+@pytest.fixture()
+def test_wheel(tmp_path, make_wheel):
+    return make_wheel(
+        tmp_path, "hello", "0.1", files={"hello/__init__.py": "print('hello')\n"}
+    )
+
+
+def read_image(layout):
+    with open(os.path.join(layout, "index.json")) as f:
+        index = json.load(f)
+    manifest = json.loads(read_blob(layout, index["manifests"][0]["digest"]))
+    config = json.loads(read_blob(layout, manifest["config"]["digest"]))
+    return index, manifest, config
+
+
+def layer_names(layout, descriptor):
+    data = gzip.decompress(read_blob(layout, descriptor["digest"]))
+    with tarfile.open(fileobj=io.BytesIO(data)) as tar:
+        return [(m.name, m.mtime, m.uid) for m in tar.getmembers()]
+
+
+def test_layer_is_reproducible(tmp_path):
+    src = tmp_path / "file.txt"
+    src.write_text("content")
+    digests = set()
+    for i in range(2):
+        os.utime(src, (i * 1000, i * 1000))
+        blobs_dir = tmp_path / f"blobs{i}"
+        blobs_dir.mkdir()
+        descriptor, _ = write_layer_blob(
+            str(blobs_dir), {"b/file.txt": str(src), "a": b"x"}
+        )
+        digests.add(descriptor["digest"])
+        data = (blobs_dir / descriptor["digest"].split(":")[1]).read_bytes()
+        assert hashlib.sha256(data).hexdigest() == descriptor["digest"].split(":")[1]
+
+    assert len(digests) == 1
+
+
+def test_failed_layer_leaves_no_temp_file(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        write_layer_blob(str(tmp_path), {"app/missing": str(tmp_path / "missing")})
+    assert os.listdir(tmp_path) == []
+
+
+def test_write_image_layout(tmp_path, base_layout):
+    output = str(tmp_path / "out")
+    write_image_layout(
+        output,
+        base_layout,
+        [{"app/docker-entrypoint.sh": b"#!/bin/bash\n"}],
+        ref_name="test:latest",
+        config_overrides={"Entrypoint": ["/app/docker-entrypoint.sh"]},
+    )
+
+    index, manifest, config = read_image(output)
+    assert index["manifests"][0]["annotations"] == {
+        "org.opencontainers.image.ref.name": "test:latest"
+    }
+    assert len(manifest["layers"]) == 2
+    assert len(config["rootfs"]["diff_ids"]) == 2
+    assert config["config"]["WorkingDir"] == "/"
+    assert config["config"]["Entrypoint"] == ["/app/docker-entrypoint.sh"]
+    assert layer_names(output, manifest["layers"][1]) == [
+        ("app", 0, 0),
+        ("app/docker-entrypoint.sh", 0, 0),
+    ]
+
+
+def test_build_oci_image(tmp_path, base_layout, test_wheel):
+    init_script = tmp_path / "init.sh"
+    init_script.write_text("echo init")
+    output = str(tmp_path / "image")
+
+    build_oci_image(
+        output=output,
+        base_layout=base_layout,
+        wheel_file=test_wheel,
+        image_name="hello",
+        image_tag="0.1",
+        init_scripts=[str(init_script)],
+        user_id=1100,
+        env_vars=[("FIZZ", "BUZZ")],
+        pip_extra_args="--no-index",
+    )
+
+    _, manifest, config = read_image(output)
+    assert len(manifest["layers"]) == 4
+    app_files = [n for n, _, _ in layer_names(output, manifest["layers"][2])]
+    assert "app/init.d/init.sh" in app_files
+    packages = [n for n, _, _ in layer_names(output, manifest["layers"][3])]
+    assert "app/packages/hello/__init__.py" in packages
+    assert "FIZZ=BUZZ" in config["config"]["Env"]
+    assert "LANG=C.UTF-8" in config["config"]["Env"]
+    assert "PATH=/usr/bin" not in config["config"]["Env"]
+    assert config["config"]["User"] == "1100"
+
+    archive = str(tmp_path / "image.tar")
+    digest = build_oci_image(
+        output=archive,
+        base_layout=base_layout,
+        wheel_file=test_wheel,
+        image_name="hello",
+        image_tag="0.1",
+        init_scripts=[str(init_script)],
+        user_id=1100,
+        env_vars=[("FIZZ", "BUZZ")],
+        pip_extra_args="--no-index",
+    )
+    with tarfile.open(archive) as tar:
+        assert "index.json" in tar.getnames()
+        assert f"blobs/sha256/{digest.split(':')[1]}" in tar.getnames()
+
+
+def test_dependency_layer_stable(tmp_path, base_layout, make_wheel):
+    dependency_dir = tmp_path / "dep"
+    dependency_dir.mkdir()
+    make_wheel(dependency_dir, "dep", "1.0")
+    requirements = tmp_path / "requirements.txt"
+    requirements.write_text("dep\n")
+
+    manifests = []
+    for i, content in enumerate(["v1", "v2"]):
+        wheel_dir = tmp_path / f"wheel{i}"
+        wheel_dir.mkdir()
+        wheel = make_wheel(
+            wheel_dir, "hello", "0.1", files={"hello/__init__.py": content}
+        )
+        output = str(tmp_path / f"image{i}")
+        build_oci_image(
+            output=output,
+            base_layout=base_layout,
+            wheel_file=wheel,
+            image_name="hello",
+            image_tag="0.1",
+            requirements_file=str(requirements),
+            pip_extra_args=f"--no-index --find-links {dependency_dir}",
+        )
+        manifests.append(read_image(output)[1])
+
+    deps_layers = [m["layers"][1]["digest"] for m in manifests]
+    app_layers = [m["layers"][3]["digest"] for m in manifests]
+    assert deps_layers[0] == deps_layers[1]
+    assert app_layers[0] != app_layers[1]
+
+
+def test_dependencies_for_base_image_python(
+    tmp_path, base_layout, test_wheel, make_wheel
+):
+    # the base image runs another python than the host
+    host = sys.version_info
+    base_python = "3.8" if (host.major, host.minor) != (3, 8) else "3.9"
+    find_links = tmp_path / "wheels"
+    find_links.mkdir()
+    for version, python_tag in [
+        ("1.0", f"cp{base_python.replace('.', '')}"),
+        ("2.0", f"cp{host.major}{host.minor}"),
+    ]:
+        make_wheel(find_links, "dep", version, python_tag=python_tag)
+    requirements = tmp_path / "requirements.txt"
+    requirements.write_text("dep\n")
+
+    output = str(tmp_path / "image")
+    build_oci_image(
+        output=output,
+        base_layout=base_layout,
+        wheel_file=test_wheel,
+        image_name="hello",
+        image_tag="0.1",
+        requirements_file=str(requirements),
+        pip_extra_args=f"--no-index --find-links {find_links}",
+        python_version=base_python,
+        platforms=pip_platforms("linux/amd64"),
+    )
+
+    _, manifest, _ = read_image(output)
+    site_packages = [n for n, _, _ in layer_names(output, manifest["layers"][1])]
+    assert "app/site-packages/dep-1.0.dist-info" in site_packages
+    assert "app/site-packages/dep-2.0.dist-info" not in site_packages
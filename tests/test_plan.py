@@ -0,0 +1,80 @@
+import os
+
+import pytest
+
+from setuptools_docker.plan import build_plan, parse_dockerfile
+
+
+@pytest.fixture()
+def wheel_file(tmp_path, make_wheel):
+    return make_wheel(tmp_path, "app", "1.0")
+
+
+def test_parse_dockerfile():
+    stages = parse_dockerfile(
+        "\n".join(
+            [
+                "ARG BASE=python",
+                "FROM --platform=linux/amd64 python:3.8 AS builder",
+                "# comment",
+                "RUN --mount=type=cache,target=/root/.cache/pip \\",
+                "    --mount=type=secret,id=INDEX_PASSWORD pip install \\",
+                "    app.whl",
+                "ENV A=b",
+                "FROM python:3.8-slim",
+                "COPY --from=builder /app/venv /app/venv",
+            ]
+        )
+    )
+
+    builder, final = stages
+    assert (builder.base, builder.name) == ("python:3.8", "builder")
+    (run,) = builder.layers
+    assert run.arguments.endswith("pip install app.whl")
+    assert run.cache_mounts == ("/root/.cache/pip",)
+    assert run.secrets == ("INDEX_PASSWORD",)
+    assert [i.command for i in builder.instructions] == ["RUN", "ENV"]
+    assert (final.base, final.name) == ("python:3.8-slim", None)
+    assert final.dependencies() == ["python:3.8-slim", "builder"]
+
+
+def test_build_plan(wheel_file, tmp_path):
+    plan = build_plan(
+        wheel_file, index_url="https://pypi.example.com", index_password="pw-4711"
+    )
+
+    assert [s.name for s in plan.stages] == ["builder", None]
+    assert plan.context_files()["Dockerfile"].decode() == plan.dockerfile
+    assert plan.context_files()["app-1.0-py3-none-any.whl"] == wheel_file
+    assert plan.secrets == {"INDEX_PASSWORD": "pw-4711"}
+    assert any("/root/.cache/pip" in l.cache_mounts for l in plan.stages[0].layers)
+
+    as_dict = plan.to_dict()
+    assert as_dict["secrets"] == ["INDEX_PASSWORD"]
+    assert "pw-4711" not in str(as_dict)
+
+    # planning does not touch the file system
+    assert os.listdir(tmp_path) == ["app-1.0-py3-none-any.whl"]
+
+
+def test_diff(wheel_file, tmp_path):
+    plan = build_plan(wheel_file)
+    assert plan.key() == build_plan(wheel_file).key()
+    assert plan.diff(build_plan(wheel_file)) == {"files": [], "stages": []}
+
+    # a changed wheel invalidates the builder and, depending on it, the final stage
+    with open(wheel_file, "wb") as f:
+        f.write(b"changed")
+    changed = build_plan(wheel_file)
+    assert changed.key() != plan.key()
+    assert plan.diff(changed) == {
+        "files": ["app-1.0-py3-none-any.whl"],
+        "stages": ["builder", "1"],
+    }
+
+    # a changed runtime stage does not affect the builder
+    assert plan.diff(build_plan(wheel_file, user_id=1100))["stages"] == ["builder", "1"]
+    assert build_plan(wheel_file).diff(build_plan(wheel_file, user_id=1100)) == {
+        "files": [],
+        "stages": ["1"],
+    }
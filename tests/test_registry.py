@@ -0,0 +1,240 @@
+import hashlib
+import io
+import json
+import re
+import tarfile
+import threading
+import urllib.parse
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from setuptools_docker.oci import (
+    MEDIA_TYPE_CONFIG,
+    MEDIA_TYPE_MANIFEST,
+    write_json_blob,
+    write_layer_blob,
+)
+from setuptools_docker.registry import parse_repository, push_image_layout
+
+
+class FakeRegistryHandler(BaseHTTPRequestHandler):
+    def do_HEAD(self):
+        if not self._authorized():
+            return
+        m = re.fullmatch(r"/v2/(.+)/blobs/(sha256:\w+)", self.path)
+        self._respond(200 if (m.group(1), m.group(2)) in self.server.blobs else 404)
+
+    def do_POST(self):
+        if not self._authorized():
+            return
+        url = urllib.parse.urlparse(self.path)
+        repository = re.fullmatch(r"/v2/(.+)/blobs/uploads/", url.path).group(1)
+        query = urllib.parse.parse_qs(url.query)
+        if "mount" in query:
+            source = (query["from"][0], query["mount"][0])
+            if source in self.server.blobs:
+                self.server.blobs[(repository, source[1])] = self.server.blobs[source]
+                self._respond(201)
+                return
+        location = f"/v2/{repository}/blobs/uploads/{uuid.uuid4()}"
+        self.server.sessions.add(location)
+        self._respond(202, {"Location": location})
+
+    def do_DELETE(self):
+        if not self._authorized():
+            return
+        self.server.sessions.discard(self.path)
+        self._respond(204)
+
+    def do_PUT(self):
+        if not self._authorized():
+            return
+        url = urllib.parse.urlparse(self.path)
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        m = re.fullmatch(r"/v2/(.+)/manifests/(.+)", url.path)
+        if m:
+            self.server.manifests[(m.group(1), m.group(2))] = (
+                body,
+                self.headers["Content-Type"],
+            )
+            self._respond(201)
+            return
+
+        repository = re.fullmatch(r"/v2/(.+)/blobs/uploads/.+", url.path).group(1)
+        assert url.path in self.server.sessions
+        self.server.sessions.remove(url.path)
+        digest = urllib.parse.parse_qs(url.query)["digest"][0]
+        assert digest == "sha256:" + hashlib.sha256(body).hexdigest()
+        self.server.blobs[(repository, digest)] = body
+        self.server.uploads.append(digest)
+        self._respond(201)
+
+    def do_GET(self):
+        # token endpoint
+        self.server.token_requests.append(self.path)
+        body = json.dumps({"token": self.server.token}).encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _authorized(self):
+        token = self.server.token
+        if token is None or self.headers["Authorization"] == f"Bearer {token}":
+            return True
+        if self.headers["Content-Length"]:
+            self.rfile.read(int(self.headers["Content-Length"]))
+        realm = f"http://127.0.0.1:{self.server.server_port}/token"
+        self._respond(
+            401, {"WWW-Authenticate": f'Bearer realm="{realm}",service="fake"'}
+        )
+        return False
+
+    def _respond(self, status, headers={}):
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture()
+def fake_registry():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeRegistryHandler)
+    server.blobs = {}
+    server.manifests = {}
+    server.uploads = []
+    server.sessions = set()
+    server.token = None
+    server.token_requests = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+
+
+@pytest.fixture()
+def layout(tmp_path):
+    layout = tmp_path / "image"
+    blobs_dir = layout / "blobs" / "sha256"
+    blobs_dir.mkdir(parents=True)
+
+    deps, deps_diff_id = write_layer_blob(str(blobs_dir), {"app/deps": b"deps\n"})
+    app, app_diff_id = write_layer_blob(str(blobs_dir), {"app/main": b"main\n"})
+    config = write_json_blob(
+        str(blobs_dir),
+        {
+            "architecture": "amd64",
+            "os": "linux",
+            "rootfs": {"type": "layers", "diff_ids": [deps_diff_id, app_diff_id]},
+        },
+        MEDIA_TYPE_CONFIG,
+    )
+    manifest = write_json_blob(
+        str(blobs_dir),
+        {
+            "schemaVersion": 2,
+            "mediaType": MEDIA_TYPE_MANIFEST,
+            "config": config,
+            "layers": [deps, app],
+        },
+        MEDIA_TYPE_MANIFEST,
+    )
+    (layout / "index.json").write_text(
+        json.dumps({"schemaVersion": 2, "manifests": [manifest]})
+    )
+    return str(layout), {
+        "config": config["digest"],
+        "deps": deps["digest"],
+        "app": app["digest"],
+        "manifest": manifest["digest"],
+    }
+
+
+@pytest.mark.parametrize(
+    "image_name,expected",
+    [
+        ("python", ("registry-1.docker.io", "library/python")),
+        ("org/app", ("registry-1.docker.io", "org/app")),
+        ("ghcr.io/org/app", ("ghcr.io", "org/app")),
+        ("localhost:5000/app", ("localhost:5000", "app")),
+    ],
+)
+def test_parse_repository(image_name, expected):
+    assert parse_repository(image_name) == expected
+
+
+def test_push_image_layout(fake_registry, layout):
+    layout_dir, digests = layout
+    registry = f"127.0.0.1:{fake_registry.server_port}"
+
+    results = push_image_layout(layout_dir, f"{registry}/app", ["1.0", "latest"])
+
+    assert set(results.values()) == {"uploaded"}
+    assert sorted(fake_registry.uploads) == sorted(
+        [digests["config"], digests["deps"], digests["app"]]
+    )
+    for tag in ["1.0", "latest"]:
+        manifest, media_type = fake_registry.manifests[("app", tag)]
+        assert media_type == MEDIA_TYPE_MANIFEST
+        assert "sha256:" + hashlib.sha256(manifest).hexdigest() == digests["manifest"]
+
+    # all blobs exist already
+    fake_registry.uploads.clear()
+    results = push_image_layout(layout_dir, f"{registry}/app", ["1.1"])
+    assert set(results.values()) == {"exists"}
+    assert fake_registry.uploads == []
+    assert ("app", "1.1") in fake_registry.manifests
+
+
+def test_push_image_layout_mount(fake_registry, layout, tmp_path):
+    layout_dir, digests = layout
+    registry = f"127.0.0.1:{fake_registry.server_port}"
+    fake_registry.blobs[("base/service", digests["deps"])] = b"deps"
+    fake_registry.token = "secret-token"
+
+    archive = tmp_path / "image.tar"
+    with tarfile.open(archive, "w") as tar:
+        tar.add(layout_dir, arcname=".")
+
+    results = push_image_layout(
+        str(archive),
+        f"{registry}/app",
+        ["1.0"],
+        username="user",
+        password="pw",
+        mount_from=[f"{registry}/other", f"{registry}/base/service"],
+        jobs=2,
+    )
+
+    assert results == {
+        digests["config"]: "uploaded",
+        digests["deps"]: "mounted",
+        digests["app"]: "uploaded",
+    }
+    assert digests["deps"] not in fake_registry.uploads
+    # uploads started instead of mounts got used or cancelled
+    assert fake_registry.sessions == set()
+    assert ("app", "1.0") in fake_registry.manifests
+    assert any(
+        "scope=repository%3Abase%2Fservice%3Apull" in r
+        for r in fake_registry.token_requests
+    )
+
+
+def test_push_image_layout_unsafe_archive(fake_registry, tmp_path):
+    archive = tmp_path / "image.tar"
+    with tarfile.open(archive, "w") as tar:
+        info = tarfile.TarInfo("../outside")
+        tar.addfile(info, io.BytesIO(b""))
+
+    with pytest.raises(Exception):
+        push_image_layout(
+            str(archive), f"127.0.0.1:{fake_registry.server_port}/app", ["1.0"]
+        )
+    assert not (tmp_path.parent / "outside").exists()
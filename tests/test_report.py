@@ -0,0 +1,115 @@
+import json
+
+from setuptools_docker.report import BuildReport
+
+
+def test_span():
+    report = BuildReport()
+    with report.span("outer"):
+        with report.span("inner"):
+            pass
+
+    assert [s["name"] for s in report.spans] == ["inner", "outer"]
+    assert report.spans[1]["duration"] >= report.spans[0]["duration"]
+
+
+def test_parse_plain_progress():
+    report = BuildReport()
+    for line in [
+        "#1 [internal] load build definition from Dockerfile",
+        "#1 transferring dockerfile: 1.2kB done",
+        "#1 DONE 0.1s",
+        "#5 [builder 2/6] RUN apt-get update",
+        "#5 CACHED",
+        "#7 [builder 4/6] RUN pip install app.whl",
+        "#7 0.512 Collecting furl",
+        "#7 DONE 12.3s",
+        "#8 [stage-1 3/4] RUN false",
+        "#8 ERROR: process did not complete successfully",
+        "some other output",
+    ]:
+        report.parse_progress(line)
+
+    assert report.to_dict()["steps"] == [
+        {"name": "[internal] load build definition from Dockerfile", "duration": 0.1},
+        {"name": "[builder 2/6] RUN apt-get update", "cached": True},
+        {"name": "[builder 4/6] RUN pip install app.whl", "duration": 12.3},
+        {"name": "[stage-1 3/4] RUN false", "error": True},
+    ]
+
+
+def test_parse_rawjson_progress():
+    report = BuildReport()
+    report.parse_progress(
+        json.dumps(
+            {
+                "vertexes": [
+                    {
+                        "digest": "sha256:a",
+                        "name": "[builder 4/6] RUN pip install app.whl",
+                        "started": "2021-01-01T10:00:00.123456789Z",
+                    }
+                ]
+            }
+        )
+    )
+    report.parse_progress(
+        json.dumps(
+            {
+                "vertexes": [
+                    {
+                        "digest": "sha256:a",
+                        "name": "[builder 4/6] RUN pip install app.whl",
+                        "started": "2021-01-01T10:00:00.123456789Z",
+                        "completed": "2021-01-01T10:00:02.623456789Z",
+                    },
+                    {"digest": "sha256:b", "name": "[builder 2/6]", "cached": True},
+                ]
+            }
+        )
+    )
+
+    assert report.to_dict()["steps"] == [
+        {"name": "[builder 4/6] RUN pip install app.whl", "duration": 2.5},
+        {"name": "[builder 2/6]", "cached": True},
+    ]
+
+
+def test_parse_rawjson_invalid_timestamp():
+    report = BuildReport()
+    report.parse_progress(
+        json.dumps(
+            {
+                "vertexes": [
+                    {
+                        "digest": "sha256:a",
+                        "name": "[builder 4/6] RUN pip install app.whl",
+                        "started": "2021-01-01 10:00:00",
+                        "completed": "2021-01-01T10:00:02.623456789Z",
+                    }
+                ]
+            }
+        )
+    )
+
+    assert report.to_dict()["steps"] == [
+        {"name": "[builder 4/6] RUN pip install app.whl"}
+    ]
+
+
+def test_write(tmp_path):
+    report = BuildReport()
+    with report.span("build_image"):
+        report.parse_progress("#3 [builder 1/6] FROM python:3.8")
+        report.parse_progress("#3 DONE 1.0s")
+
+    path = tmp_path / "reports" / "build.json"
+    report.write(str(path))
+
+    written = json.loads(path.read_text())
+    assert [s["name"] for s in written["spans"]] == ["build_image"]
+    assert written["steps"] == [
+        {"name": "[builder 1/6] FROM python:3.8", "duration": 1.0}
+    ]
+    assert written["image"] == {}
+    assert "build_image" in report.summary()
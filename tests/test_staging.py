@@ -0,0 +1,111 @@
+import os
+
+from setuptools_docker.staging import (
+    MANIFEST_FILE,
+    context_size,
+    dockerignore,
+    scan_context,
+    stage_files,
+)
+
+
+def test_stage_files(tmp_path):
+    source = tmp_path / "app-1.0-py3-none-any.whl"
+    source.write_bytes(b"wheel")
+    context = tmp_path / "context"
+
+    stage_files(str(context), {source.name: str(source), "Dockerfile": b"FROM python"})
+
+    assert (context / source.name).read_bytes() == b"wheel"
+    assert (context / "Dockerfile").read_bytes() == b"FROM python"
+    assert sorted(os.listdir(context)) == sorted(
+        [source.name, "Dockerfile", MANIFEST_FILE]
+    )
+
+
+def test_unchanged_files_are_kept(tmp_path):
+    source = tmp_path / "requirements.txt"
+    source.write_text("flask")
+    context = tmp_path / "context"
+    files = {source.name: str(source), "Dockerfile": b"FROM python"}
+
+    stage_files(str(context), files)
+    os.utime(context / "Dockerfile", (0, 0))
+    dest_stat = os.stat(context / source.name)
+
+    stage_files(str(context), files)
+    assert os.stat(context / "Dockerfile").st_mtime == 0
+    assert os.stat(context / source.name).st_ino == dest_stat.st_ino
+
+
+def test_changed_files_are_restaged(tmp_path):
+    source = tmp_path / "init.sh"
+    source.write_text("echo 1")
+    context = tmp_path / "context"
+
+    stage_files(str(context), {"init.sh": str(source)})
+    # replace source instead of modifying it in place, as editors do
+    source.unlink()
+    source.write_text("echo 22")
+    stage_files(str(context), {"init.sh": str(source)})
+
+    assert (context / "init.sh").read_text() == "echo 22"
+
+
+def test_stale_files_are_removed(tmp_path):
+    old_wheel = tmp_path / "app-1.0-py3-none-any.whl"
+    old_wheel.write_bytes(b"old")
+    new_wheel = tmp_path / "app-1.1-py3-none-any.whl"
+    new_wheel.write_bytes(b"new")
+    context = tmp_path / "context"
+
+    stage_files(str(context), {old_wheel.name: str(old_wheel), "sub/file": b"x"})
+    stage_files(str(context), {new_wheel.name: str(new_wheel)})
+
+    assert sorted(os.listdir(context)) == sorted([new_wheel.name, MANIFEST_FILE])
+
+
+def test_unstaged_files_are_kept(tmp_path):
+    (tmp_path / "setup.py").write_text("setup()")
+    (tmp_path / "src" / "app").mkdir(parents=True)
+    (tmp_path / "src" / "app" / "__init__.py").write_text("")
+
+    stage_files(str(tmp_path), {"sub/file": b"x"})
+    stage_files(str(tmp_path), {"Dockerfile": b"FROM python"})
+
+    assert (tmp_path / "setup.py").read_text() == "setup()"
+    assert (tmp_path / "src" / "app" / "__init__.py").exists()
+    assert not (tmp_path / "sub").exists()
+
+
+def test_linked_source_not_overwritten(tmp_path):
+    source = tmp_path / "init.sh"
+    source.write_text("echo 1")
+    context = tmp_path / "context"
+
+    stage_files(str(context), {"init.sh": str(source)})
+    stage_files(str(context), {"init.sh": b"echo generated"})
+
+    assert source.read_text() == "echo 1"
+    assert (context / "init.sh").read_text() == "echo generated"
+
+
+def test_dockerignore():
+    assert dockerignore(["wheelhouse/b.whl", "Dockerfile", "a.whl"]) == (
+        b"*\n!Dockerfile\n!a.whl\n!wheelhouse/b.whl\n"
+    )
+
+
+def test_scan_context(tmp_path):
+    source = tmp_path / "app-1.1-py3-none-any.whl"
+    source.write_bytes(b"wheel")
+    files = {source.name: str(source), "Dockerfile": b"FROM python"}
+    context = tmp_path / "context"
+    stage_files(str(context), files)
+    # e.g. written by another tool
+    (context / "app-1.0-py3-none-any.whl").write_bytes(b"x" * 100)
+
+    sent, ignored = scan_context(str(context), files)
+
+    assert sent == context_size(files) == len(b"wheel") + len(b"FROM python")
+    assert ignored == 100 + os.path.getsize(context / MANIFEST_FILE)
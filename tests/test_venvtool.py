@@ -0,0 +1,122 @@
+import compileall
+import os
+import subprocess
+import sys
+
+from setuptools_docker.venvtool import (
+    PRUNE_RULES_ALL,
+    prune,
+    runtime_closure,
+    strip_sources,
+)
+
+
+def test_strip_sources(tmp_path, monkeypatch):
+    site_packages = tmp_path / "site-packages"
+    for dist, module in [("dep", "dep"), ("app", "app")]:
+        (site_packages / module).mkdir(parents=True)
+        (site_packages / module / "__init__.py").write_text("x = 1\n")
+        dist_info = site_packages / f"{dist}-1.0.dist-info"
+        dist_info.mkdir()
+        (dist_info / "METADATA").write_text(
+            f"Metadata-Version: 2.1\nName: {dist}\nVersion: 1.0\n"
+        )
+        (dist_info / "RECORD").write_text(f"{module}/__init__.py,,\n")
+    (site_packages / "not_compiled.py").write_text("")
+    compileall.compile_dir(str(site_packages / "dep"), legacy=True, quiet=1)
+    compileall.compile_dir(str(site_packages / "app"), legacy=True, quiet=1)
+    monkeypatch.setattr(sys, "path", [str(site_packages)] + sys.path)
+
+    removed = strip_sources([str(site_packages)], keep_dists=["app"])
+
+    assert removed == len("x = 1\n")
+    assert not os.path.exists(site_packages / "dep" / "__init__.py")
+    assert os.path.exists(site_packages / "dep" / "__init__.pyc")
+    assert os.path.exists(site_packages / "app" / "__init__.py")
+    assert not os.path.exists(site_packages / "app" / "__init__.pyc")
+    assert os.path.exists(site_packages / "not_compiled.py")
+
+    # the kept sources get imported from bytecode, without compiling them
+    subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import importlib.machinery, sys\n"
+            "def compile(*args): raise Exception('compiled')\n"
+            "importlib.machinery.SourceFileLoader.source_to_code = compile\n"
+            f"sys.path.insert(0, {str(site_packages)!r})\n"
+            "import app, dep\n",
+        ],
+        env=dict(os.environ, PYTHONDONTWRITEBYTECODE="1"),
+        check=True,
+    )
+
+
+def test_prune(tmp_path):
+    site_packages = tmp_path / "lib" / "python3.8" / "site-packages"
+    files = {
+        "pkg/__init__.py": b"x" * 10,
+        "pkg/tests/test_pkg.py": b"x" * 100,
+        "pkg/__pycache__/__init__.cpython-27.pyc": b"x" * 1000,
+        f"pkg/__pycache__/__init__.{sys.implementation.cache_tag}.pyc": b"x" * 5,
+        f"pkg/__pycache__/__init__.{sys.implementation.cache_tag}.opt-1.pyc": b"x" * 5,
+        "pkg/README.md": b"x" * 10000,
+        "pkg/keep/README.md": b"x" * 3,
+        "pkg-1.0.dist-info/RECORD": b"x" * 100000,
+        "pkg/data.bin": b"x" * 7,
+    }
+    for name, content in files.items():
+        (site_packages / name).parent.mkdir(parents=True, exist_ok=True)
+        (site_packages / name).write_bytes(content)
+
+    saved = prune(
+        str(tmp_path),
+        rules=PRUNE_RULES_ALL,
+        include=["**/*.bin"],
+        exclude=["**/keep/**"],
+    )
+
+    assert saved["tests"] == 100
+    assert saved["foreign-bytecode"] == 1000
+    assert saved["docs"] == 10000
+    assert saved["record"] == 100000
+    assert saved["include"] == 7
+    remaining = sorted(
+        str(p.relative_to(site_packages))
+        for p in site_packages.rglob("*")
+        if p.is_file()
+    )
+    assert remaining == [
+        "pkg/__init__.py",
+        f"pkg/__pycache__/__init__.{sys.implementation.cache_tag}.opt-1.pyc",
+        f"pkg/__pycache__/__init__.{sys.implementation.cache_tag}.pyc",
+        "pkg/keep/README.md",
+    ]
+    assert not (site_packages / "pkg" / "tests").exists()
+
+
+def test_prune_defaults(tmp_path):
+    package = tmp_path / "lib" / "python3.8" / "site-packages" / "pkg"
+    (package / "__pycache__").mkdir(parents=True)
+    (package / "templates.md").write_text("{{ name }}")
+    (package / "__pycache__" / "__init__.cpython-27.opt-1.pyc").write_bytes(b"x")
+
+    saved = prune(str(tmp_path))
+
+    assert "docs" not in saved
+    assert saved["foreign-bytecode"] == 1
+    assert [p.name for p in package.iterdir()] == ["templates.md"]
+
+
+def test_runtime_closure(tmp_path):
+    venv_bin = tmp_path / "venv" / "bin"
+    venv_bin.mkdir(parents=True)
+    executable = os.path.realpath(sys.executable)
+    (venv_bin / "python").symlink_to(executable)
+    dest = tmp_path / "closure"
+
+    size = runtime_closure(str(dest), [str(tmp_path / "venv")], interpreter=False)
+
+    assert size > 0
+    assert (dest / executable.lstrip("/")).is_file()
+    assert list(dest.rglob("libc.so*"))
@@ -0,0 +1,109 @@
+import pytest
+
+from setuptools_docker.wheels import (
+    normalize_platform,
+    platform_wheel,
+    wheel_dist_name,
+    wheel_requirements,
+)
+
+
+@pytest.fixture()
+def test_wheel(tmp_path, make_wheel):
+    return make_wheel(
+        tmp_path,
+        "my-app",
+        "1.0",
+        requires=[
+            "flask",
+            'gunicorn[gevent] ; extra == "gunicorn"',
+            'uvloop ; (sys_platform != "win32") and extra == "Fast_IO"',
+            'typing-extensions ; python_version < "3.8"',
+        ],
+    )
+
+
+def test_wheel_dist_name(test_wheel):
+    assert wheel_dist_name(test_wheel) == "my-app"
+
+
+@pytest.mark.parametrize(
+    "extras, expected",
+    [
+        ([], ["flask", 'typing-extensions ; python_version < "3.8"']),
+        (
+            ["gunicorn", "fast-io"],
+            [
+                "flask",
+                'gunicorn[gevent] ; python_version >= "0"',
+                'uvloop ; (sys_platform != "win32") and python_version >= "0"',
+                'typing-extensions ; python_version < "3.8"',
+            ],
+        ),
+    ],
+)
+def test_wheel_requirements(test_wheel, extras, expected):
+    assert wheel_requirements(test_wheel, extras) == expected
+
+
+@pytest.mark.parametrize(
+    "platform, expected",
+    [
+        (
+            "linux/amd64",
+            "app-1.0-cp38-cp38-manylinux_2_17_x86_64.manylinux2014_x86_64.whl",
+        ),
+        ("linux/arm64", "app-1.0-cp38-cp38-manylinux_2_28_aarch64.whl"),
+    ],
+)
+def test_platform_wheel(tmp_path, platform, expected):
+    for name in [
+        "app-1.0-cp38-cp38-manylinux_2_17_x86_64.manylinux2014_x86_64.whl",
+        "app-1.0-cp38-cp38-manylinux_2_28_aarch64.whl",
+        "app-0.9-cp38-cp38-manylinux_2_28_s390x.whl",
+    ]:
+        (tmp_path / name).touch()
+    wheel_file = str(tmp_path / "app-1.0-cp38-cp38-manylinux_2_28_aarch64.whl")
+
+    assert platform_wheel(wheel_file, platform) == str(tmp_path / expected)
+
+
+@pytest.mark.parametrize(
+    "python_version, expected",
+    [
+        ("3.8", "app-1.0-cp38-cp38-manylinux_2_28_aarch64.whl"),
+        ("3.11", "app-1.0-cp311-cp311-manylinux_2_28_aarch64.whl"),
+        ("3.12", "app-1.0-cp39-abi3-manylinux_2_28_aarch64.whl"),
+    ],
+)
+def test_platform_wheel_python_version(tmp_path, python_version, expected):
+    for name in [
+        "app-1.0-cp311-cp311-manylinux_2_28_aarch64.whl",
+        "app-1.0-cp38-cp38-manylinux_2_28_aarch64.whl",
+        "app-1.0-cp39-abi3-manylinux_2_28_aarch64.whl",
+    ]:
+        (tmp_path / name).touch()
+    wheel_file = str(tmp_path / "app-1.0-cp311-cp311-manylinux_2_28_aarch64.whl")
+
+    assert platform_wheel(wheel_file, "linux/arm64/v8", python_version) == str(
+        tmp_path / expected
+    )
+    with pytest.raises(Exception, match="python 3.7"):
+        platform_wheel(wheel_file, "linux/arm64", "3.7")
+
+
+def test_normalize_platform():
+    assert normalize_platform("linux/arm64/v8") == "linux/arm64"
+    assert normalize_platform("Linux/AMD64") == "linux/amd64"
+    assert normalize_platform("linux/arm/v7") == "linux/arm/v7"
+
+
+def test_platform_wheel_pure(test_wheel):
+    assert platform_wheel(test_wheel, "linux/s390x") == test_wheel
+
+
+def test_platform_wheel_missing(tmp_path):
+    wheel_file = tmp_path / "app-1.0-cp38-cp38-manylinux_2_28_aarch64.whl"
+    wheel_file.touch()
+    with pytest.raises(Exception, match="linux/s390x"):
+        platform_wheel(str(wheel_file), "linux/s390x")